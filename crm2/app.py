@@ -2,6 +2,8 @@ from __future__ import annotations
 
 import asyncio
 import contextlib
+import hashlib
+import hmac
 import logging
 import os
 import pathlib
@@ -12,7 +14,8 @@ from contextlib import suppress
 # Список верхнеуровневых объектов файла (классы и функции).
 # Обновляется вручную при изменении состава функций/классов.
 # Классы: —
-# Функции: _load_env, _try_include, _test_db, _runner, main, health, _on_startup, _on_shutdown
+# Функции: _load_env, _lifespan, _set_webhook, _create_app, __getattr__, _try_include, _setup_dispatcher, _acquire_leader, _test_db, _runner, _serve_webhook,
+#          main, health, metrics, telegram_webhook, _feed_done, _on_startup, _leader_startup, _on_shutdown
 # === Конец автозаголовка
 # crm2/app.py
 # ... остальной код без изменений ...
@@ -20,17 +23,36 @@ from contextlib import suppress
 # Назначение: Главный файл приложения, инициализация FastAPI и бота, загрузка окружения, подключение роутеров, управление жизненным циклом.
 # Функции:
 # _load_env - Загрузка переменных окружения из файлов
+# _lifespan - Жизненный цикл FastAPI: в режиме webhook — startup диспетчера, setWebhook, дренаж апдейтов при остановке;
+#             в режиме cluster — только setWebhook (фронт, апдейты обрабатывают процессы crm2/cluster.py)
+# _set_webhook - Регистрация webhook в Telegram (WEBHOOK_URL + WEBHOOK_PATH, секрет, allowed_updates)
+# _create_app - Создание FastAPI-приложения при первом обращении к crm2.app.app (в polling fastapi не импортируется)
+# __getattr__ - Ленивый атрибут модуля app (uvicorn "crm2.app:app", кластер)
 # _try_include - Подключение роутеров с обработкой ошибок
+# _setup_dispatcher - Регистрация middleware, планировщика исходящих, роутеров и startup/shutdown (один раз на процесс)
+# _acquire_leader - Блокировка «ведущего» процесса: фоновые задачи и setWebhook — только в одном процессе сервиса
 # _test_db - Тестирование подключения к базе данных
 # _init_db - Инициализация базы данных (создание таблиц, если не существуют)
-# _runner - Основная функция запуска бота (инициализация БД, подключение middleware и роутеров, запуск поллинга)
-# main - Точка входа, запуск асинхронного приложения
+# _runner - Основная функция запуска бота в режиме polling (проверка БД, настройка диспетчера, снятие webhook, запуск поллинга)
+# _serve_webhook - Запуск FastAPI-приложения под uvicorn в режиме webhook (всегда один воркер)
+# main - Точка входа: режим выбирается переменной BOT_MODE (polling по умолчанию / webhook / cluster)
 # health - Эндпоинт для проверки здоровья приложения
-# _on_startup - Функция, выполняемая при запуске бота (отправка уведомления админу)
-# _on_shutdown - Функция, выполняемая при остановке бота (отправка уведомления админу)
+# metrics - Эндпоинт метрик: очереди апдейтов по чатам, планировщик исходящих, кэш пользователей, хранилище FSM
+# telegram_webhook - Приём апдейта от Telegram: проверка секрета, ответ 200 сразу, обработка в фоне (в кластере — пересылка обработчику чата)
+# _feed_done - Завершение фоновой обработки апдейта (учёт задач, лог ошибок)
+# _on_startup - Функция, выполняемая при запуске бота (построение индекса расписания в потоке параллельно с _leader_startup)
+# _leader_startup - Старт ведущего процесса: наблюдатель hot_reload, миграция паролей, возобновление рассылок и заданий ДЗ, уведомление админу
+# _on_shutdown - Функция, выполняемая при остановке бота (уведомление админу, остановка hot_reload, рассылок, заданий ДЗ и пула bcrypt, сброс очереди записи и закрытие пула БД)
 
-from dotenv import load_dotenv
-from fastapi import FastAPI
+from typing import TYPE_CHECKING
+
+# FastAPI (~0.5 с импорта) нужен только webhook/cluster — само приложение создаётся лениво (_create_app);
+# Request/Response — те же классы starlette, что реэкспортирует fastapi
+from starlette.requests import Request
+from starlette.responses import Response
+
+if TYPE_CHECKING:
+    from fastapi import FastAPI
 
 from crm2.middlewares.callback_auth_middleware import CallbackAuthMiddleware
 
@@ -41,17 +63,10 @@ def _load_env():
     Приоритет:
     1) Если задан ENV_FILE и файл существует — грузим его.
     2) Иначе ищем рядом с корнем проекта: .env.local -> .env -> .env.prod.
+    Файлы читаются один раз на процесс (crm2.config.load_env).
     """
-    root = pathlib.Path(__file__).resolve().parent.parent
-    env_file = os.getenv("ENV_FILE")
-    if env_file and pathlib.Path(env_file).exists():
-        load_dotenv(env_file, override=False)
-        return
-    for cand in (".env.local", ".env", ".env.prod"):
-        p = root / cand
-        if p.exists():
-            load_dotenv(p, override=False)
-            return
+    from crm2.config import load_env
+    load_env()
 
 
 # Загружаем окружение до импорта бота
@@ -77,16 +92,145 @@ else:
 
 from crm2.bot import bot, dp  # теперь окружение уже прогружено
 from crm2.middlewares.auth_middleware import AuthMiddleware
+from crm2.middlewares.user_context_middleware import UserContextMiddleware
+
+# ----------------- РЕЖИМ ЗАПУСКА -----------------
+# polling — бот сам опрашивает getUpdates; webhook — Telegram присылает апдейты в FastAPI (uvicorn);
+# cluster — webhook-фронт + процессы-обработчики по chat_id и один процесс-писатель БД (crm2/cluster.py)
+BOT_MODE = (os.getenv("BOT_MODE") or "polling").strip().lower()
+# Публичный адрес сервиса (https://...), к нему добавляется WEBHOOK_PATH
+WEBHOOK_URL = (os.getenv("WEBHOOK_URL") or "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH") or "/tg/webhook"
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token. Без явного значения выводится из токена —
+# одинаковый во всех процессах сервиса и не совпадает с самим токеном
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(
+    f"crm2-webhook:{os.getenv('TELEGRAM_TOKEN') or ''}".encode()).hexdigest()
+try:
+    WEBHOOK_DRAIN_S = float(os.getenv("WEBHOOK_DRAIN_S", "10"))
+except ValueError:
+    WEBHOOK_DRAIN_S = 10.0
+
+# Апдейты, принятые webhook'ом и ещё обрабатываемые (ссылки держим, чтобы задачи не собрал GC)
+_UPDATE_TASKS: set[asyncio.Task] = set()
+_DP_READY = False
+_IS_LEADER: bool | None = None
+_LEADER_LOCK = None
+
+
+@contextlib.asynccontextmanager
+async def _lifespan(_app: FastAPI):
+    if BOT_MODE == "cluster":
+        # фронт кластера: хендлеры и фоновые задачи — в процессах-обработчиках (crm2/cluster.py),
+        # диспетчер здесь нужен только для списка allowed_updates
+        _setup_dispatcher()
+        await _set_webhook()
+        try:
+            yield
+        finally:
+            await bot.session.close()
+        return
+    if BOT_MODE != "webhook":
+        yield
+        return
+    _test_db()
+    _setup_dispatcher()
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    if _acquire_leader():
+        await _set_webhook()
+    try:
+        yield
+    finally:
+        # апдейты, на которые Telegram уже получил 200, дорабатываем до остановки сервисов
+        if _UPDATE_TASKS:
+            await asyncio.wait(set(_UPDATE_TASKS), timeout=WEBHOOK_DRAIN_S)
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+
+
+async def _set_webhook():
+    if not WEBHOOK_URL:
+        logging.warning("[WEBHOOK] WEBHOOK_URL не задан — setWebhook не вызывается")
+        return
+    await bot.set_webhook(
+        WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logging.info("[WEBHOOK] set %s%s", WEBHOOK_URL, WEBHOOK_PATH)
+
 
 # ----------------- FASTAPI -----------------
-app = FastAPI(title="crm2")
+_APP: "FastAPI | None" = None
+
+
+def _create_app() -> "FastAPI":
+    """FastAPI-приложение (один раз на процесс): health, metrics и, в webhook/cluster, приём апдейтов."""
+    global _APP
+    if _APP is None:
+        from fastapi import FastAPI
+        _APP = FastAPI(title="crm2", lifespan=_lifespan)
+        _APP.add_api_route("/health", health, methods=["GET"])
+        _APP.add_api_route("/metrics", metrics, methods=["GET"])
+        if BOT_MODE in ("webhook", "cluster"):
+            _APP.add_api_route(WEBHOOK_PATH, telegram_webhook, methods=["POST"], include_in_schema=False)
+    return _APP
+
+
+def __getattr__(name: str):
+    # crm2.app.app (uvicorn "crm2.app:app", from crm2.app import app) — создаём приложение при первом обращении;
+    # в polling-режиме к нему никто не обращается и fastapi не импортируется
+    if name == "app":
+        return _create_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
-@app.get("/health")
 async def health():
     return {"ok": True}
 
 
+async def metrics():
+    from crm2.services.fsm_storage import SQLiteStorage
+    from crm2.services.outbound import scheduler
+    from crm2.services.update_executor import executor
+    from crm2.services.users import user_cache_stats
+    data = {"updates": executor.stats(), "outbound": scheduler.stats(), "user_cache": user_cache_stats()}
+    if isinstance(dp.storage, SQLiteStorage):
+        data["fsm"] = dp.storage.stats()
+    if BOT_MODE == "cluster":
+        from crm2.cluster import _CLUSTER
+        data["cluster"] = _CLUSTER.stats() if _CLUSTER is not None else None
+    return data
+
+
+async def telegram_webhook(request: Request):
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+        return Response(status_code=403)
+    from aiogram.types import Update
+    try:
+        data = await request.json()
+        update = Update.model_validate(data, context={"bot": bot})
+    except Exception as e:
+        logging.warning("[WEBHOOK] некорректный апдейт: %s", e)
+        return Response(status_code=400)
+    if BOT_MODE == "cluster":
+        # апдейт уходит процессу-обработчику своего чата; 503 — Telegram повторит доставку позже
+        from crm2.cluster import forward_update
+        from crm2.services.update_executor import chat_key
+        return Response(status_code=200 if forward_update(data, chat_key(update)) else 503)
+    # Telegram ждёт ответа и не шлёт следующий апдейт чата — отвечаем сразу, обрабатываем в фоне
+    task = asyncio.create_task(dp.feed_update(bot, update), name=f"update-{update.update_id}")
+    _UPDATE_TASKS.add(task)
+    task.add_done_callback(_feed_done)
+    return Response(status_code=200)
+
+
+def _feed_done(task: asyncio.Task) -> None:
+    _UPDATE_TASKS.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error("[WEBHOOK] ошибка обработки %s", task.get_name(), exc_info=task.exception())
+
+
 # ...после импорта bot, dp и загрузки .env:
 ADMIN_ID = os.getenv("ADMIN_ID")
 try:
@@ -123,6 +267,32 @@ def _try_include(module_path: str, attr: str = "router"):
 #             await bot.send_message(ADMIN_ID, "⛔️ Бот остановлен.")
 
 async def _on_startup():
+    # строим индекс расписания до первого нажатия «📅 Расписание» — в потоке, параллельно с остальным стартом
+    from crm2.services.schedule_index import get_index
+    index = asyncio.ensure_future(asyncio.to_thread(get_index))
+    try:
+        await _leader_startup()
+    finally:
+        await index
+
+
+async def _leader_startup():
+    # один раз на сервис: в кластере это делает только ведущий обработчик
+    if not _acquire_leader():
+        logging.info("[LEADER] фоновые задачи выполняет другой процесс (pid %s)", os.getpid())
+        return
+    # горячая подгрузка расписаний и текстов content/info без перезапуска
+    from crm2.services.hot_reload import start_watcher
+    start_watcher()
+    # фоновая миграция plain text паролей в bcrypt (возобновляется с сохранённого курсора)
+    from crm2.services.password_migration import start_migration
+    start_migration()
+    # рассылки, прерванные рестартом, продолжаются с оставшихся queued-получателей
+    from crm2.services.broadcast_engine import resume_broadcasts
+    await resume_broadcasts(bot)
+    # задания ДЗ, прерванные рестартом, досылаются тем, кому доставка ещё не отмечена
+    from crm2.services.homework_pipeline import resume_homework_jobs
+    await resume_homework_jobs(bot)
     if ADMIN_ID:
         try:
             await bot.send_message(ADMIN_ID, 'Бот запущен и готов к работе!')
@@ -130,11 +300,26 @@ async def _on_startup():
             pass
 
 async def _on_shutdown():
-    if ADMIN_ID:
+    if ADMIN_ID and _IS_LEADER:
         try:
             await bot.send_message(ADMIN_ID, 'Бот остановлен..')
         except Exception:
             pass
+    from crm2.services.hot_reload import stop_watcher
+    await stop_watcher()
+    from crm2.services.password_migration import stop_migration
+    await stop_migration()
+    from crm2.services.broadcast_engine import stop_broadcasts
+    await stop_broadcasts()
+    from crm2.services.homework_pipeline import stop_homework_jobs
+    await stop_homework_jobs()
+    from crm2.utils.password_pool import shutdown_pool
+    shutdown_pool()
+    # дописываем очередь группового коммита и закрываем соединения общего пула
+    from crm2.db.write_queue import close_write_queues
+    from crm2.db.pool import close_all
+    await close_write_queues()
+    close_all()
 
 # ----------------- DB TEST -----------------
 # В функции _test_db в app.py
@@ -214,14 +399,22 @@ async def _runner():
     _test_db()
 
     # ... остальной код
-# ----------------- RUNNER -----------------
-async def _runner():
-    # проверка базы перед стартом
-    _test_db()
+# ----------------- DISPATCHER -----------------
+def _setup_dispatcher():
+    """Middleware, планировщик исходящих, роутеры и startup/shutdown — общие для polling и webhook."""
+    global _DP_READY
+    if _DP_READY:
+        return
+    _DP_READY = True
 
     # Регистрируем middleware
+    # пользователь читается один раз на апдейт и дальше берётся из data['user'] / data['user_role']
+    dp.update.outer_middleware(UserContextMiddleware())
     dp.message.middleware(AuthMiddleware())
     dp.callback_query.middleware(CallbackAuthMiddleware())
+    # все исходящие сообщения (ответы, ДЗ, рассылки, уведомления) — через общий планировщик лимитов
+    from crm2.services.outbound import install
+    install(bot)
 
     # ---- Основные хендлеры ----
     _try_include("crm2.handlers.start")
@@ -248,6 +441,7 @@ async def _runner():
     _try_include("crm2.handlers.admin.broadcast")
     _try_include("crm2.handlers.admin.chatgpt")
     _try_include("crm2.handlers.admin.logs")
+    _try_include("crm2.handlers.admin.reachability")
     _try_include("crm2.handlers.admin.db")
 
     # ---- Дополнительные админские модули ----
@@ -259,10 +453,47 @@ async def _runner():
     dp.startup.register(_on_startup)
     dp.shutdown.register(_on_shutdown)
 
+
+def _acquire_leader() -> bool:
+    """
+    Ведущий процесс сервиса. В polling и webhook он один; в кластере ведущим становится обработчик,
+    первым взявший flock на файл рядом с БД (держится до завершения процесса). Лок страхует и от второго
+    экземпляра сервиса на том же DB_PATH.
+    """
+    global _IS_LEADER, _LEADER_LOCK
+    if _IS_LEADER is not None:
+        return _IS_LEADER
+    _IS_LEADER = True
+    if BOT_MODE not in ("webhook", "cluster"):
+        return _IS_LEADER
+    try:
+        import fcntl
+    except ImportError:  # Windows — без блокировки, запускать с одним воркером
+        return _IS_LEADER
+    from crm2.config import DB_PATH
+    fh = open(f"{DB_PATH}.leader.lock", "a+")
+    try:
+        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        _LEADER_LOCK = fh
+    except OSError:
+        fh.close()
+        _IS_LEADER = False
+    return _IS_LEADER
+
+
+# ----------------- RUNNER -----------------
+async def _runner():
+    # проверка базы (в потоке) идёт параллельно с импортом роутеров и запросом к Telegram
+    db_check = asyncio.ensure_future(asyncio.to_thread(_test_db))
+
+    _setup_dispatcher()
+
     logging.warning("[BUILD] starting application")
 
     try:
         logging.info("🚀 Бот запущен и готов к работе!")
+        # webhook, оставшийся от запуска в режиме webhook, блокирует getUpdates (409 Conflict)
+        await asyncio.gather(db_check, bot.delete_webhook(drop_pending_updates=False))
         await dp.start_polling(bot)
     except Exception as e:
         logging.exception("❌ Ошибка в работе бота: %s", e)
@@ -271,6 +502,27 @@ async def _runner():
         logging.info("⛔️ Бот остановлен.")
 
 
+def _serve_webhook():
+    try:
+        import uvicorn
+    except ImportError as e:
+        raise RuntimeError("BOT_MODE=webhook требует uvicorn (pip install uvicorn)") from e
+    # Один воркер: лимит исходящих (token bucket), порядок апдейтов чата и кэш FSM живут в памяти процесса —
+    # N воркеров дали бы N полных лимитов (429 от Telegram) и перемешали апдейты одного чата.
+    # Несколько ядер — BOT_MODE=cluster (шардирование по чату, общий писатель).
+    workers = os.getenv("WEB_CONCURRENCY")
+    if workers and workers.strip() not in ("", "1"):
+        logging.warning("[WEBHOOK] WEB_CONCURRENCY=%s ignored: webhook mode runs one worker, "
+                        "use BOT_MODE=cluster for several processes", workers)
+    uvicorn.run(
+        "crm2.app:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=1,
+        log_level=os.getenv("LOG_LEVEL", "INFO").split("#", 1)[0].strip().lower(),
+    )
+
+
 # ----------------- MAIN -----------------
 def main():
     logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
@@ -284,6 +536,13 @@ def main():
         await create_test_user_if_not_exists()
 
         # ... остальной код ...
+    if BOT_MODE == "webhook":
+        _serve_webhook()
+        return
+    if BOT_MODE == "cluster":
+        from crm2.cluster import run_cluster
+        run_cluster()
+        return
     with suppress(KeyboardInterrupt):
         asyncio.run(_runner())
 
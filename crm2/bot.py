@@ -17,15 +17,27 @@
 чтобы их можно было импортировать в других частях проекта.
 """
 import os
-from aiogram import Bot, Dispatcher
+from aiogram import Bot
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from crm2.services.fsm_storage import SQLiteStorage
+from crm2.services.update_executor import OrderedDispatcher
 
 TOKEN = os.getenv("TELEGRAM_TOKEN")
 if not TOKEN:
     raise RuntimeError("TELEGRAM_TOKEN не найден в окружении.")
 
+# Свой сервер Bot API (local bot-api или фейковый Telegram из crm2/tools/fake_telegram.py)
+API_BASE = os.getenv("TELEGRAM_API_BASE")
+session = AiohttpSession(api=TelegramAPIServer.from_base(API_BASE)) if API_BASE else None
+
 bot = Bot(
     token=TOKEN,
+    session=session,
     default=DefaultBotProperties(parse_mode="HTML")  # ✅ правильный способ
 )
-dp = Dispatcher()
+# апдейты разных чатов — параллельно, одного чата — по порядку (crm2/services/update_executor.py);
+# состояния FSM — в SQLite с кэшем и отложенной записью, переживают рестарт (crm2/services/fsm_storage.py)
+dp = OrderedDispatcher(storage=SQLiteStorage())
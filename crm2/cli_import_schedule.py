@@ -8,20 +8,27 @@
 # Назначение: одноразовый импорт расписания из XLSX в session_days (вне запуска бота)
 # Запуск на сервере (SSH):
 # python -m crm2.cli_import_schedule schedule_2025_1_cohort.xlsx schedule_2025_2_cohort.xlsx
+# Проверка без записи: добавить --dry-run --diff
 import argparse
 import logging
 from crm2.db.auto_migrate import ensure_schedule_schema
-from crm2.db.schedule_loader import sync_schedule_from_files
+from crm2.db.schedule_loader import import_schedule
 
 def main():
     logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
     parser = argparse.ArgumentParser(description="Импорт расписания в session_days из XLSX")
     parser.add_argument("files", nargs="+", help="Пути к файлам Excel (schedule_*.xlsx)")
+    parser.add_argument("--dry-run", action="store_true", help="Только показать изменения, ничего не записывать")
+    parser.add_argument("--prune", action="store_true", help="Удалить дни потоков, которых больше нет в файлах")
+    parser.add_argument("--diff", action="store_true", help="Вывести построчный список изменений")
     args = parser.parse_args()
 
     ensure_schedule_schema()
-    affected = sync_schedule_from_files(args.files)
-    print(f"[IMPORT] done; affected rows={affected}")
+    report = import_schedule(args.files, dry_run=args.dry_run, prune=args.prune)
+    if args.diff:
+        for ch in report.changes:
+            print(f"  {ch['action']:<7} {ch['date']} cohort={ch['cohort_id']} {ch['old_code'] or '—'} → {ch['new_code'] or '—'}")
+    print(f"[IMPORT] {report.summary()}; affected rows={report.affected}")
 
 if __name__ == "__main__":
     main()
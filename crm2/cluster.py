@@ -0,0 +1,314 @@
+# crm2/cluster.py
+# Назначение: Режим BOT_MODE=cluster — несколько процессов-обработчиков за одним webhook.
+#             Супервизор (этот процесс) поднимает процесс-писатель SQLite (crm2/db/writer_process.py)
+#             и CRM_CLUSTER_WORKERS процессов-обработчиков, сам обслуживает FastAPI-фронт (uvicorn):
+#             webhook проверяет секрет и пересылает апдейт обработчику abs(chat_id) % N по Unix-сокету.
+#             Все апдейты чата попадают в один процесс — FSM (память) и порядок внутри чата локальны.
+#             Обработчики читают БД своими read-only соединениями, пишут через процесс-писатель.
+#             Фоновые задачи (рассылки, ДЗ, миграции) выполняет один обработчик — ведущий по flock.
+#             Лимит исходящих Telegram общий: токены выдаёт процесс-писатель (outbound.SharedTokenBucket),
+#             поэтому рассылки ведущего идут на полной скорости, пока остальные обработчики молчат.
+#             Сбросы кэшей (пользователи, расписание, тексты) рассылаются остальным обработчикам (cache_bus).
+#             Сокеты — во временном каталоге 0700, подключение по общему authkey; всё на одной машине.
+# Классы:
+# - ShardSender - Очередь и поток отправки апдейтов в один процесс-обработчик (порядок сохраняется)
+# - Cluster - Процессы писателя и обработчиков, маршрутизация апдейтов, остановка в обратном порядке
+# Функции:
+# - _env_int - Чтение целого из переменной окружения
+# - shard_of - Номер обработчика для ключа чата
+# - _wait_socket - Дождаться появления Unix-сокета дочернего процесса
+# - _shard_main - Точка входа процесса-обработчика (spawn)
+# - _serve_shard - Цикл обработчика: приём апдейтов от фронта и подача в диспетчер
+# - _accept_loop - Поток приёма соединений фронта в процессе-обработчике
+# - _recv_loop - Поток чтения апдейтов из соединения фронта (передача в event loop по порядку)
+# - forward_update - Переслать апдейт обработчику его чата (вызывается webhook-фронтом)
+# - start_cluster - Запустить писатель и обработчики в фоне (фронт — вызывающий)
+# - stop_cluster - Остановить обработчики, затем писатель
+# - run_cluster - Запуск кластера и фронта под uvicorn; остановка при выходе
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Callable, Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, ""))
+    except ValueError:
+        return default
+
+
+# Число процессов-обработчиков (по умолчанию — по числу ядер, не больше 8)
+WORKERS = _env_int("CRM_CLUSTER_WORKERS", min(8, os.cpu_count() or 2))
+# Сколько ждать запуска дочернего процесса (импорт хендлеров, startup)
+START_TIMEOUT_S = _env_int("CRM_CLUSTER_START_TIMEOUT_S", 60)
+# Сколько ждать штатной остановки обработчика (дренаж апдейтов, очереди записи)
+STOP_TIMEOUT_S = _env_int("CRM_CLUSTER_STOP_TIMEOUT_S", 30)
+
+
+def shard_of(key: Optional[int], shards: int) -> int:
+    return abs(key) % shards if key is not None else 0
+
+
+def _wait_socket(path: str, proc: multiprocessing.process.BaseProcess, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if not proc.is_alive():
+            raise RuntimeError(f"{proc.name} завершился при запуске (код {proc.exitcode})")
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{proc.name} не запустился за {timeout:.0f} с")
+        time.sleep(0.05)
+
+
+class ShardSender:
+    """Апдейты одному обработчику: put() не блокирует фронт, поток отправляет по порядку."""
+
+    def __init__(self, index: int, address: str, authkey: bytes):
+        self.index = index
+        self._conn: Connection = Client(address, family="AF_UNIX", authkey=authkey)
+        self._q: "queue.SimpleQueue[Optional[Dict[str, Any]]]" = queue.SimpleQueue()
+        self.sent = 0
+        self.broken = False
+        self._thread = threading.Thread(target=self._run, name=f"shard-sender-{index}", daemon=True)
+        self._thread.start()
+
+    def put(self, update: Dict[str, Any]) -> None:
+        self._q.put(update)
+
+    def _run(self) -> None:
+        while True:
+            item = self._q.get()
+            if item is None:
+                break
+            try:
+                self._conn.send(item)
+                self.sent += 1
+            except (OSError, EOFError) as e:
+                log.error("[CLUSTER] shard %s: send failed: %s", self.index, e)
+                self.broken = True
+                break
+        self._conn.close()
+
+    def close(self) -> None:
+        self._q.put(None)
+        self._thread.join(timeout=5)
+
+
+class Cluster:
+    def __init__(self, workers: int = WORKERS):
+        self.workers = max(1, workers)
+        self.dir = tempfile.mkdtemp(prefix="crm2-cluster-")  # 0700
+        self.authkey = os.urandom(32)
+        self.writer_address = os.path.join(self.dir, "writer.sock")
+        self.shard_addresses = [os.path.join(self.dir, f"shard-{i}.sock") for i in range(self.workers)]
+        self._ctx = multiprocessing.get_context("spawn")
+        self._writer: Optional[multiprocessing.process.BaseProcess] = None
+        self._shards: List[multiprocessing.process.BaseProcess] = []
+        self._senders: List[ShardSender] = []
+        self._stopping = threading.Event()
+
+    def start(self) -> "Cluster":
+        from crm2.config import DB_PATH
+        from crm2.db.pool import configure_remote_writer
+        from crm2.db.writer_process import serve
+        from crm2.services.outbound import BURST, RATE_PER_S
+
+        self._writer = self._ctx.Process(target=serve,
+                                         args=(DB_PATH, self.writer_address, self.authkey, RATE_PER_S, BURST),
+                                         name="crm2-db-writer")
+        self._writer.start()
+        _wait_socket(self.writer_address, self._writer, START_TIMEOUT_S)
+        # фронт тоже пишет только через писатель (если ему понадобится БД)
+        configure_remote_writer(self.writer_address, self.authkey)
+
+        for i, address in enumerate(self.shard_addresses):
+            p = self._ctx.Process(target=_shard_main,
+                                  args=(i, self.workers, address, self.writer_address, self.authkey),
+                                  name=f"crm2-shard-{i}")
+            p.start()
+            self._shards.append(p)
+        for i, address in enumerate(self.shard_addresses):
+            _wait_socket(address, self._shards[i], START_TIMEOUT_S)
+            self._senders.append(ShardSender(i, address, self.authkey))
+        threading.Thread(target=self._watch, name="cluster-watch", daemon=True).start()
+        log.info("[CLUSTER] writer pid %s, %d shards: %s", self._writer.pid, self.workers,
+                 [p.pid for p in self._shards])
+        return self
+
+    def _watch(self) -> None:
+        """Упал писатель или обработчик — останавливаем фронт (SIGTERM себе), перезапуск — за systemd/Render."""
+        while not self._stopping.wait(1.0):
+            dead = [p for p in [self._writer, *self._shards] if p is not None and not p.is_alive()]
+            if dead or any(s.broken for s in self._senders):
+                log.error("[CLUSTER] process died: %s — stopping", [(p.name, p.exitcode) for p in dead])
+                os.kill(os.getpid(), signal.SIGTERM)
+                return
+
+    def forward(self, update: Dict[str, Any], key: Optional[int]) -> bool:
+        sender = self._senders[shard_of(key, self.workers)]
+        if sender.broken or self._stopping.is_set():
+            return False
+        sender.put(update)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {"shards": self.workers, "forwarded": [s.sent for s in self._senders]}
+
+    def stop(self) -> None:
+        self._stopping.set()
+        for s in self._senders:
+            s.close()
+        # обработчики дорабатывают апдейты и дописывают очереди, пока писатель ещё жив
+        for p in self._shards:
+            if p.is_alive():
+                p.terminate()
+        for p in self._shards:
+            p.join(STOP_TIMEOUT_S)
+            if p.is_alive():
+                log.warning("[CLUSTER] %s did not stop in %ss — killing", p.name, STOP_TIMEOUT_S)
+                p.kill()
+                p.join()
+        if self._writer is not None and self._writer.is_alive():
+            self._writer.terminate()
+            self._writer.join(STOP_TIMEOUT_S)
+        from crm2.db.pool import configure_remote_writer
+        configure_remote_writer(None)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+# ----------------- процесс-обработчик -----------------
+def _accept_loop(listener: Listener, loop: asyncio.AbstractEventLoop,
+                 feed: Callable[[Dict[str, Any]], None]) -> None:
+    while True:
+        try:
+            conn = listener.accept()
+        except OSError:
+            return
+        except Exception as e:
+            log.warning("[CLUSTER] rejected front connection: %s", e)
+            continue
+        threading.Thread(target=_recv_loop, args=(conn, loop, feed), daemon=True).start()
+
+
+def _recv_loop(conn: Connection, loop: asyncio.AbstractEventLoop,
+               feed: Callable[[Dict[str, Any]], None]) -> None:
+    with conn:
+        while True:
+            try:
+                update = conn.recv()
+            except (EOFError, OSError):
+                return
+            loop.call_soon_threadsafe(feed, update)
+
+
+async def _serve_shard(index: int, shards: int, address: str, writer_address: str, authkey: bytes) -> None:
+    from aiogram.types import Update
+
+    from crm2 import app as crm_app
+    from crm2.bot import bot, dp
+    from crm2.db.writer_process import RateClient
+    from crm2.services.outbound import RATE_PER_S, SharedTokenBucket, scheduler
+
+    # лимит Telegram считается на бота — токены из общего bucket процесса-писателя;
+    # доля rate / shards — только на случай, если писатель перестал отвечать
+    scheduler.bucket = SharedTokenBucket(RateClient(writer_address, authkey), rate=RATE_PER_S / shards)
+    crm_app._setup_dispatcher()
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    tasks: set = set()
+
+    def _feed(data: Dict[str, Any]) -> None:
+        try:
+            update = Update.model_validate(data, context={"bot": bot})
+        except Exception as e:
+            log.warning("[CLUSTER] shard %s: bad update: %s", index, e)
+            return
+        task = loop.create_task(dp.feed_update(bot, update), name=f"update-{update.update_id}")
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    threading.Thread(target=_accept_loop, args=(listener, loop, _feed), name="shard-accept", daemon=True).start()
+    log.info("[CLUSTER] shard %s/%s ready (pid %s)", index, shards, os.getpid())
+    try:
+        await stop.wait()
+    finally:
+        log.info("[CLUSTER] shard %s stopping: %d updates in flight", index, len(tasks))
+        listener.close()
+        if tasks:
+            await asyncio.wait(set(tasks), timeout=crm_app.WEBHOOK_DRAIN_S)
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+        log.info("[CLUSTER] shard %s stopped", index)
+
+
+def _shard_main(index: int, shards: int, address: str, writer_address: str, authkey: bytes) -> None:
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").split("#", 1)[0].strip())
+    os.environ["CRM_CLUSTER_SHARD"] = str(index)
+    from crm2.db.pool import configure_remote_writer
+    from crm2.services import cache_bus
+    configure_remote_writer(writer_address, authkey)
+    cache_bus.connect(writer_address, authkey)
+    try:
+        asyncio.run(_serve_shard(index, shards, address, writer_address, authkey))
+    finally:
+        cache_bus.close()
+        # пул bcrypt закрывается с wait=False: его процессы завершаем явно, иначе выход обработчика
+        # ждёт их в atexit, а после kill от супервизора они остаются сиротами
+        for child in multiprocessing.active_children():
+            child.terminate()
+            child.join(5)
+
+
+# ----------------- фронт -----------------
+_CLUSTER: Optional[Cluster] = None
+
+
+def forward_update(data: Dict[str, Any], key: Optional[int]) -> bool:
+    """False — кластер не запущен или обработчик недоступен (фронт ответит 503, Telegram повторит)."""
+    return _CLUSTER is not None and _CLUSTER.forward(data, key)
+
+
+def start_cluster(workers: int = WORKERS) -> Cluster:
+    global _CLUSTER
+    _CLUSTER = Cluster(workers).start()
+    return _CLUSTER
+
+
+def stop_cluster() -> None:
+    global _CLUSTER
+    if _CLUSTER is not None:
+        _CLUSTER.stop()
+        _CLUSTER = None
+
+
+def run_cluster(workers: int = WORKERS) -> None:
+    try:
+        import uvicorn
+    except ImportError as e:
+        raise RuntimeError("BOT_MODE=cluster требует uvicorn (pip install uvicorn)") from e
+    from crm2.app import app
+
+    start_cluster(workers)
+    try:
+        # фронт — один процесс: маршрутизация по чатам требует единой точки приёма
+        uvicorn.run(app, host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", "8000")),
+                    log_level=os.getenv("LOG_LEVEL", "INFO").split("#", 1)[0].strip().lower())
+    finally:
+        stop_cluster()
@@ -2,7 +2,7 @@
 # Список верхнеуровневых объектов файла (классы и функции).
 # Обновляется вручную при изменении состава функций/классов.
 # Классы: Settings, _Settings
-# Функции: get_settings
+# Функции: load_env, get_settings
 # === Конец автозаголовка
 #
 # === Файл: crm2/config.py
@@ -11,17 +11,38 @@
 from __future__ import annotations
 import os
 from pathlib import Path
-from dotenv import load_dotenv
 from dataclasses import dataclass
 
-# 1) Грузим .env.* (локальная отладка приоритетнее)
 cwd = Path(__file__).resolve().parents[1]  # .../crm2
 proj_root = cwd.parent                     # .../ (корень проекта)
 
-for env_name in (".env.local", ".env.prod", ".env"):
-    env_path = proj_root / env_name
-    if env_path.exists():
-        load_dotenv(env_path, override=False)
+# каталог, в котором лежит пакет crm2 (там же .env, как и ищет app.py)
+_ENV_DIR = Path(__file__).resolve().parents[1]
+_ENV_LOADED = False
+
+
+def load_env() -> None:
+    """
+    Загрузка .env один раз на процесс (повторные вызовы — без чтения файлов).
+    Читается ровно один файл: ENV_FILE, если он задан и существует, иначе первый найденный
+    из .env.local -> .env -> .env.prod в корне проекта; уже заданные переменные окружения не перезаписываются.
+    """
+    global _ENV_LOADED
+    if _ENV_LOADED:
+        return
+    _ENV_LOADED = True
+    env_file = os.getenv("ENV_FILE")
+    candidates = [Path(env_file)] if env_file and Path(env_file).exists() else \
+        [_ENV_DIR / name for name in (".env.local", ".env", ".env.prod")]
+    for f in candidates:
+        if f.exists():
+            from dotenv import load_dotenv
+            load_dotenv(f, override=False)
+            return
+
+
+# 1) Грузим .env.* (локальная отладка приоритетнее)
+load_env()
 
 # 2) Путь к БД
 #    Можно переопределить переменной окружения DB_PATH
@@ -4,7 +4,7 @@
 # Классы:
 # - Database - Простой асинхронный адаптер для выполнения SQL-запросов (execute, fetch_all, fetch_one)
 # Функции:
-# - get_db_connection - (импортируется из core) Получение соединения с БД
+# - get_db_connection - (импортируется из core) Получение соединения с БД из общего пула
 # - get_upcoming_sessions - (импортируется из sessions) Получение предстоящих сессий
 # - get_session_by_id - (импортируется из sessions) Получение сессии по ID
 # Экспортируем db. Здесь же создаём простой «асинхронный» адаптер
@@ -16,39 +16,22 @@ from .core import get_db_connection
 from .sessions import get_upcoming_sessions, get_session_by_id
 
 # Простой адаптер под await-API, поверх синхронного sqlite3.
-# Если позже перейдёшь на aiosqlite — реализация методов останется той же.
+# Соединения берутся из общего пула (crm2/db/pool.py): чтение — у читателей, запись — у писателя.
 class Database:
     def __init__(self):
         self._get_connection = get_db_connection
 
     async def execute(self, sql: str, params: tuple = ()) -> None:
-        con = self._get_connection()
-        try:
-            cur = con.cursor()
-            cur.execute(sql, params)
-            con.commit()
-        finally:
-            con.close()
+        with self._get_connection() as con:
+            con.execute(sql, params)
 
     async def fetch_all(self, sql: str, params: tuple = ()):
-        con = self._get_connection()
-        try:
-            cur = con.cursor()
-            cur.execute(sql, params)
-            rows = cur.fetchall()
-            return rows
-        finally:
-            con.close()
+        with self._get_connection(readonly=True) as con:
+            return con.execute(sql, params).fetchall()
 
     async def fetch_one(self, sql: str, params: tuple = ()):
-        con = self._get_connection()
-        try:
-            cur = con.cursor()
-            cur.execute(sql, params)
-            row = cur.fetchone()
-            return row
-        finally:
-            con.close()
+        with self._get_connection(readonly=True) as con:
+            return con.execute(sql, params).fetchone()
 
 # ✅ Экспортируемый во всём проекте объект БД
 db = Database()
@@ -17,7 +17,7 @@ def get_last_attendance(user_id: int, limit: int = 3) -> List[tuple]:
     Возвращает последние limit записей по посещаемости пользователя:
     (session_id, status, noted_at)
     """
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
         if not _table_exists(con, "attendance"):
             return []
@@ -32,7 +32,7 @@ def get_summary(user_id: int) -> Tuple[int,int,int]:
     """
     Возвращает кортеж: (present, absent, late) всего по пользователю.
     """
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
         if not _table_exists(con, "attendance"):
             return (0,0,0)
@@ -6,19 +6,30 @@
 # - ensure_topics_and_session_days - Создает таблицы topics и sessions (с авто-миграцией для добавления cohort_id)
 # - ensure_events_and_healings - Создает таблицы events и healing_sessions
 # - ensure_user_flags_and_attendance - Создает таблицы user_flags, attendance и payments
+# - ensure_session_blocks - Создает материализованную таблицу блоков занятий session_blocks (и заполняет, если пуста)
+# - ensure_homework_delivery - Создает таблицы homework_delivery, homework_jobs, user_reachability и индекс выборки получателей ДЗ
+# - ensure_schedule_changes - Создает счетчики изменений schedule_changes и триггеры на session_days/topics
+#   (триггеры session_blocks — в ensure_session_blocks, после создания таблицы)
+# - _ensure_change_triggers - Триггеры AFTER INSERT/UPDATE/DELETE одной таблицы, увеличивающие её счетчик
+# - ensure_fsm_storage - Создает таблицу fsm_state (состояния FSM бота, crm2/services/fsm_storage.py)
 # - ensure_schedule_schema - Публичная точка входа для создания базовых таблиц расписания (устаревшее, для обратной совместимости)
-# - ensure_all_schemas - Единая точка для создания всех необходимых таблиц (вызывается при старте бота)
+# - _schema_fingerprint - Отпечаток схемы: код миграций + PRAGMA schema_version базы
+# - ensure_all_schemas - Единая точка для создания всех необходимых таблиц (вызывается при старте бота;
+#   пропускается, если PRAGMA user_version совпадает с отпечатком; CRM_SCHEMA_CHECK=1 — проверять всегда)
 # === Автогенерированный заголовок: crm2/db/auto_migrate.py
 # Список верхнеуровневых объектов файла (классы и функции).
 # Обновляется вручную при изменении состава функций/классов.
 # Классы: —
-# Функции: _exec, _has_column, ensure_topics_and_session_days, ensure_events_and_healings, ensure_user_flags_and_attendance, ensure_schedule_schema, ensure_all_schemas
+# Функции: _exec, _has_column, ensure_topics_and_session_days, ensure_events_and_healings, ensure_user_flags_and_attendance, ensure_homework_delivery, ensure_schedule_changes, _ensure_change_triggers, ensure_fsm_storage, ensure_session_blocks, ensure_schedule_schema, _schema_fingerprint, ensure_all_schemas
 # === Конец автозаголовка
 # crm2/db/auto_migrate.py
 from __future__ import annotations
 
+import hashlib
 import logging
+import os
 import sqlite3
+from pathlib import Path
 from .core import get_db_connection
 
 log = logging.getLogger(__name__)
@@ -182,6 +193,146 @@ def ensure_user_flags_and_attendance(con: sqlite3.Connection) -> None:
     )
 
 
+# ---------------------------------------
+#  ДОСТАВКА ДЗ
+# ---------------------------------------
+def ensure_homework_delivery(con: sqlite3.Connection) -> None:
+    """
+    Таблицы конвейера ДЗ (crm2/services/homework_pipeline.py). Создаются один раз при старте,
+    а не на каждый запрос получателей.
+    """
+    _exec(
+        con,
+        """
+        CREATE TABLE IF NOT EXISTS homework_delivery (
+            id          INTEGER PRIMARY KEY,
+            session_id  INTEGER NOT NULL,
+            user_id     INTEGER NOT NULL,
+            link        TEXT NOT NULL,
+            sent_at     TEXT DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (session_id, user_id)
+        );
+        """,
+    )
+    _exec(
+        con,
+        """
+        CREATE TABLE IF NOT EXISTS homework_jobs (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id  INTEGER NOT NULL,
+            body        TEXT NOT NULL,
+            link        TEXT NOT NULL,
+            created_by  INTEGER,
+            status      TEXT DEFAULT 'sending',  -- sending|done
+            stats_json  TEXT,
+            created_at  TEXT DEFAULT CURRENT_TIMESTAMP,
+            finished_at TEXT
+        );
+        """,
+    )
+    # выборка получателей: attendance по занятию и статусу
+    _exec(
+        con,
+        "CREATE INDEX IF NOT EXISTS idx_attendance_session ON attendance(session_id, status, user_id);",
+    )
+    from crm2.services.reachability import ensure_reachability_table
+    ensure_reachability_table(con)
+
+
+# Таблицы расписания, изменения которых считают триггеры (отпечаток индекса crm2/services/schedule_index.py)
+SCHEDULE_TABLES = ("session_days", "topics", "session_blocks")
+
+
+def ensure_schedule_changes(con: sqlite3.Connection) -> None:
+    """
+    schedule_changes: по строке на таблицу расписания, version растёт на каждую вставку/правку/удаление
+    (триггеры AFTER INSERT/UPDATE/DELETE). Любой писатель — загрузчик, админка, скрипты crm2/data —
+    виден индексу расписания без полного перечитывания таблиц.
+    """
+    _exec(
+        con,
+        """
+        CREATE TABLE IF NOT EXISTS schedule_changes (
+            table_name  TEXT PRIMARY KEY,
+            version     INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+    )
+    existing = {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()}
+    for table in SCHEDULE_TABLES:
+        con.execute("INSERT OR IGNORE INTO schedule_changes(table_name, version) VALUES (?, 0)", (table,))
+        # session_blocks создаётся позже (ensure_session_blocks) и вешает свои триггеры сама
+        if table in existing:
+            _ensure_change_triggers(con, table)
+
+
+def _ensure_change_triggers(con: sqlite3.Connection, table: str) -> None:
+    for op in ("INSERT", "UPDATE", "DELETE"):
+        _exec(
+            con,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{op.lower()}_version AFTER {op} ON {table}
+            BEGIN
+                UPDATE schedule_changes SET version = version + 1 WHERE table_name = '{table}';
+            END;
+            """,
+        )
+
+
+def ensure_fsm_storage(con: sqlite3.Connection) -> None:
+    # состояния FSM (рассылка, ввод ДЗ, регистрация) переживают рестарт бота
+    from crm2.services.fsm_storage import ensure_fsm_table
+    ensure_fsm_table(con)
+
+
+# ---------------------------------------
+#  МАТЕРИАЛИЗОВАННЫЕ БЛОКИ ЗАНЯТИЙ
+# ---------------------------------------
+def ensure_session_blocks(con: sqlite3.Connection, *, populate: bool = True) -> None:
+    """
+    session_blocks — подряд идущие дни session_days одного потока, склеенные в блок.
+    Перестраивается загрузчиком расписания (schedule_loader.rebuild_session_blocks);
+    читатели получают блоки одним проходом по индексу (cohort_id, start_date).
+    """
+    _exec(
+        con,
+        """
+        CREATE TABLE IF NOT EXISTS session_blocks (
+            id            INTEGER PRIMARY KEY AUTOINCREMENT,
+            cohort_id     INTEGER NOT NULL,
+            start_date    TEXT NOT NULL,          -- YYYY-MM-DD
+            end_date      TEXT NOT NULL,          -- YYYY-MM-DD
+            topic_id      INTEGER,
+            topic_code    TEXT,
+            first_day_id  INTEGER,                -- session_days.id первого дня блока
+            days          INTEGER NOT NULL DEFAULT 1
+        );
+        """,
+    )
+    _exec(
+        con,
+        "CREATE INDEX IF NOT EXISTS idx_session_blocks_cohort_start ON session_blocks(cohort_id, start_date);",
+    )
+    # счетчик изменений — только если schedule_changes уже есть (иначе запись в блоки упала бы в триггере)
+    if con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='schedule_changes'").fetchone():
+        _ensure_change_triggers(con, "session_blocks")
+
+    if not populate:
+        return
+
+    # первичное заполнение для баз, где расписание загружали до появления таблицы,
+    # и пересборка, если session_days правили мимо загрузчика
+    try:
+        from .schedule_loader import rebuild_session_blocks, session_blocks_fresh
+        empty = con.execute("SELECT 1 FROM session_blocks LIMIT 1").fetchone() is None
+        if con.execute("SELECT 1 FROM session_days LIMIT 1").fetchone() is not None and (
+                empty or not session_blocks_fresh(con)):
+            rebuild_session_blocks(con)
+    except sqlite3.OperationalError:
+        # session_days ещё нет — заполнит первый импорт расписания
+        pass
+
+
 # ---------------------------------------
 #  ПУБЛИЧНЫЕ ТОЧКИ ВХОДА
 # ---------------------------------------
@@ -191,17 +342,53 @@ def ensure_schedule_schema() -> None:
     """
     with get_db_connection() as con:
         ensure_topics_and_session_days(con)
+        ensure_session_blocks(con)
         con.commit()
 
 
+# Модули, чей код задаёт схему: изменился любой — проверки при старте выполняются заново
+_SCHEMA_SOURCES = (
+    Path(__file__),
+    Path(__file__).resolve().parents[1] / "services" / "reachability.py",
+    Path(__file__).resolve().parents[1] / "services" / "fsm_storage.py",
+)
+
+
+def _schema_fingerprint(schema_version: int) -> int:
+    """
+    31-битный отпечаток (код миграций, PRAGMA schema_version). schema_version меняет любой
+    CREATE/ALTER/DROP, поэтому ручная правка схемы или подмена файла БД тоже сбрасывают совпадение.
+    """
+    h = hashlib.sha1(str(schema_version).encode())
+    for p in _SCHEMA_SOURCES:
+        h.update(p.read_bytes())
+    return int.from_bytes(h.digest()[:4], "big") & 0x7FFFFFFF or 1
+
+
 def ensure_all_schemas() -> None:
     """
     Единая точка: создаём всё, что нужно боту.
-    Вызывается при старте.
+    Вызывается при старте. Если схема уже приведена этим же кодом (отпечаток в PRAGMA user_version),
+    DDL не выполняется — рестарт не тратит время на десятки CREATE ... IF NOT EXISTS.
     """
-    log.info("[SCHEMA] topics/session_days/events/healings ensured")
+    force = os.getenv("CRM_SCHEMA_CHECK") == "1"
     with get_db_connection() as con:
+        if not force:
+            version = con.execute("PRAGMA schema_version").fetchone()[0]
+            if con.execute("PRAGMA user_version").fetchone()[0] == _schema_fingerprint(version):
+                log.info("[SCHEMA] up to date (fingerprint match), checks skipped")
+                return
         ensure_topics_and_session_days(con)
         ensure_events_and_healings(con)
         ensure_user_flags_and_attendance(con)
+        ensure_homework_delivery(con)
+        ensure_fsm_storage(con)
+        # счетчики — до session_blocks: пересборка блоков запоминает версию session_days
+        ensure_schedule_changes(con)
+        ensure_session_blocks(con)
         con.commit()
+        # user_version не меняет schema_version — отпечаток остаётся верным до следующей миграции
+        version = con.execute("PRAGMA schema_version").fetchone()[0]
+        con.execute(f"PRAGMA user_version = {_schema_fingerprint(version)}")
+        con.commit()
+    log.info("[SCHEMA] topics/session_days/events/healings ensured")
@@ -1,13 +1,25 @@
 # crm2/db/core.py
 # Назначение: Предоставляет функцию для подключения к SQLite базе данных (единая точка входа)
 # Функции:
-# - get_db_connection - Возвращает соединение с базой данных (с row_factory = sqlite3.Row)
+# - get_db_connection - Возвращает соединение из общего пула (с row_factory = sqlite3.Row)
+# - get_db_connection_async - То же для корутин: ожидание занятого писателя не блокирует цикл событий
 
 from __future__ import annotations
-import sqlite3
 from crm2.config import DB_PATH
+from crm2.db.pool import PooledConnection, get_pool
 
-def get_db_connection() -> sqlite3.Connection:
-    con = sqlite3.connect(DB_PATH)
-    con.row_factory = sqlite3.Row
-    return con
\ No newline at end of file
+def get_db_connection(*, readonly: bool = False) -> PooledConnection:
+    """
+    Соединение из общего пула (crm2/db/pool.py).
+    readonly=True → один из долгоживущих читателей (query_only=ON);
+    по умолчанию — выделенный писатель. close()/выход из with возвращают соединение в пул.
+    """
+    return get_pool(DB_PATH).acquire(readonly=readonly)
+
+
+async def get_db_connection_async(*, readonly: bool = False) -> PooledConnection:
+    """
+    Как get_db_connection, но писатель, занятый другой задачей или потоком, ждём вне цикла событий:
+    `with await get_db_connection_async() as con: ...`.
+    """
+    return await get_pool(DB_PATH).acquire_async(readonly=readonly)
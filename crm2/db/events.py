@@ -4,12 +4,11 @@
 # - upcoming_events_count - Возвращает количество будущих мероприятий (дата >= сегодня)
 
 from __future__ import annotations
-import sqlite3
-from crm2.db.sqlite import DB_PATH
+from crm2.db.sqlite import get_db_connection
 
 def upcoming_events_count() -> int:
     """Вернёт количество будущих мероприятий (date >= сегодня)."""
-    with sqlite3.connect(DB_PATH) as con:
+    with get_db_connection(readonly=True) as con:
         cur = con.cursor()
         cur.execute("""
             SELECT COUNT(*)
@@ -0,0 +1,324 @@
+# crm2/db/pool.py
+# Назначение: Общий пул соединений SQLite для всех модулей доступа к данным:
+#             несколько долгоживущих читателей (query_only=ON) + один выделенный писатель.
+#             PRAGMA применяются один раз — при создании соединения, а не на каждый запрос.
+#             В кластере (crm2/cluster.py) писатель — RemoteConnection к процессу-писателю
+#             (crm2/db/writer_process.py), читатели остаются локальными.
+# Классы:
+# - PooledConnection - Аренда соединения из пула (ведёт себя как sqlite3.Connection; close()/with возвращают его в пул)
+# - ConnectionPool - Пул соединений к одному файлу БД (читатели + писатель)
+# Функции:
+# - _env_int - Чтение целого числа из переменной окружения
+# - _apply_pragmas - Применение PRAGMA к новому соединению (один раз)
+# - _owner - Владелец аренды писателя: поток + текущая задача asyncio (вложенный вызов той же задачи — реентерабелен)
+# - configure_remote_writer - Направить запись пулов этого процесса в процесс-писатель (или вернуть локальную)
+# - get_pool - Пул для указанного пути к БД (один на процесс и путь)
+# - close_all - Закрыть все пулы (при остановке бота)
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, ""))
+    except ValueError:
+        return default
+
+
+# Сколько простаивающих читателей держим открытыми (лишние закрываются при возврате)
+READERS_MAX_IDLE = _env_int("CRM_DB_READERS", 4)
+# Сколько ждать блокировку файла, прежде чем получить «database is locked»
+BUSY_TIMEOUT_MS = _env_int("CRM_DB_BUSY_TIMEOUT_MS", 5000)
+
+# (адрес Unix-сокета, authkey) процесса-писателя; None — писатель пула локальный
+_REMOTE_WRITER: Optional[Tuple[str, bytes]] = None
+
+
+def _apply_pragmas(con: sqlite3.Connection, *, query_only: bool) -> None:
+    con.row_factory = sqlite3.Row
+    con.execute("PRAGMA foreign_keys = ON;")
+    con.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS};")
+    con.execute("PRAGMA journal_mode = WAL;")
+    con.execute("PRAGMA synchronous = NORMAL;")
+    con.execute(f"PRAGMA query_only = {'ON' if query_only else 'OFF'};")
+
+
+def _owner() -> Tuple[int, Optional[asyncio.Task]]:
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:  # нет работающего цикла событий в этом потоке
+        task = None
+    return threading.get_ident(), task
+
+
+class PooledConnection:
+    """
+    Арендованное соединение. Всё, кроме close()/with, проксируется в sqlite3.Connection,
+    поэтому старый код вида `with get_db_connection() as con:` работает без изменений.
+    Выход из with — как у sqlite3 (commit/rollback) + возврат соединения в пул.
+    """
+
+    __slots__ = ("_con", "_pool", "_readonly")
+
+    def __init__(self, pool: "ConnectionPool", con: sqlite3.Connection, readonly: bool):
+        object.__setattr__(self, "_pool", pool)
+        object.__setattr__(self, "_con", con)
+        object.__setattr__(self, "_readonly", readonly)
+
+    def _raw(self) -> sqlite3.Connection:
+        con = object.__getattribute__(self, "_con")
+        if con is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return con
+
+    def __getattr__(self, name):
+        return getattr(self._raw(), name)
+
+    def __setattr__(self, name, value):
+        # row_factory, isolation_level и т.п. — на реальное соединение (сбросятся при возврате)
+        setattr(self._raw(), name, value)
+
+    def __enter__(self) -> "PooledConnection":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        try:
+            self._raw().__exit__(exc_type, exc, tb)
+        finally:
+            self.close()
+        return False
+
+    def close(self) -> None:
+        con = object.__getattribute__(self, "_con")
+        if con is None:
+            return
+        object.__setattr__(self, "_con", None)
+        self._pool.release(con, readonly=self._readonly)
+
+    def __del__(self):
+        # Страховка для кода, который забывает close(): соединение вернётся в пул при сборке мусора
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    Пул соединений к одному файлу БД.
+    - Читатели: открываются по требованию, простаивающие (до max_idle) переиспользуются.
+    - Писатель: одно соединение на процесс; аренда эксклюзивна между владельцами (поток + задача asyncio)
+      и реентерабельна только внутри одного владельца — вложенный вызов той же задачи/того же потока
+      получает то же соединение, а другая корутина того же цикла — нет (иначе её commit/rollback
+      завершил бы чужую транзакцию).
+    - Синхронная аренда из цикла событий не ждёт занятого писателя (цикл встал бы вместе с владельцем):
+      выдаётся отдельное соединение-писатель на время аренды, очерёдность записи обеспечит busy_timeout SQLite.
+      acquire_async ждёт общего писателя вне цикла.
+    """
+
+    def __init__(self, db_path: str, *, max_idle_readers: int = READERS_MAX_IDLE):
+        self.db_path = str(db_path)
+        self.max_idle_readers = max(0, max_idle_readers)
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._w_cond = threading.Condition()
+        self._w_owner: Optional[Tuple[int, Optional[asyncio.Task]]] = None
+        self._w_depth = 0
+        self._closed = False
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+
+    # ---------- создание ----------
+
+    def _open(self, *, query_only: bool) -> sqlite3.Connection:
+        if not query_only and _REMOTE_WRITER is not None:
+            from crm2.db.writer_process import RemoteConnection
+            return RemoteConnection(*_REMOTE_WRITER, self.db_path)
+        con = sqlite3.connect(self.db_path, check_same_thread=False)
+        _apply_pragmas(con, query_only=query_only)
+        return con
+
+    # ---------- аренда ----------
+
+    def acquire(self, *, readonly: bool = False) -> PooledConnection:
+        if self._closed:
+            raise sqlite3.ProgrammingError(f"Connection pool for {self.db_path} is closed.")
+        if readonly:
+            try:
+                con = self._idle.get_nowait()
+            except queue.Empty:
+                con = self._open(query_only=True)
+            return PooledConnection(self, con, readonly=True)
+
+        me = _owner()
+        try:
+            asyncio.get_running_loop()
+            on_loop = True
+        except RuntimeError:
+            on_loop = False
+        with self._w_cond:
+            if on_loop:
+                con = self._take_writer(me)
+                if con is not None:
+                    return con
+                # в цикле событий не ждём владельца (другую задачу или поток) — пишем своим соединением
+                con = self._open(query_only=False)
+                holder = self._w_owner[1]
+                if (self._writer.in_transaction
+                        and holder is not None and holder.get_loop() is asyncio.get_running_loop()):
+                    # транзакцию держит корутина этого же цикла: пока мы ждём, она не продвинется —
+                    # «database is locked» сразу, а не через busy_timeout с остановленным циклом
+                    if isinstance(con, sqlite3.Connection):
+                        con.execute("PRAGMA busy_timeout = 0;")
+                    else:  # RemoteConnection: ожидание писателя ограничивает сам процесс-писатель
+                        con.busy_timeout = 0.0
+                return PooledConnection(self, con, readonly=False)
+            while self._w_owner is not None and self._w_owner != me:
+                self._w_cond.wait()
+            return self._take_writer(me)
+
+    async def acquire_async(self, *, readonly: bool = False) -> PooledConnection:
+        """Аренда для корутин: ожидание занятого писателя идёт в потоке, цикл событий не блокируется."""
+        if readonly:
+            return self.acquire(readonly=True)
+        if self._closed:
+            raise sqlite3.ProgrammingError(f"Connection pool for {self.db_path} is closed.")
+        me = _owner()
+        while True:
+            with self._w_cond:
+                con = self._take_writer(me)
+            if con is not None:
+                return con
+            await asyncio.to_thread(self._wait_writer, 0.5)
+
+    def _take_writer(self, me) -> Optional[PooledConnection]:
+        """Под _w_cond: общий писатель, если он свободен или уже у этого владельца; иначе None."""
+        if self._w_owner is not None and self._w_owner != me:
+            return None
+        if self._writer is None:
+            self._writer = self._open(query_only=False)
+        self._w_owner = me
+        self._w_depth += 1
+        return PooledConnection(self, self._writer, readonly=False)
+
+    def _wait_writer(self, timeout: float) -> None:
+        with self._w_cond:
+            self._w_cond.wait_for(lambda: self._w_owner is None or self._closed, timeout)
+
+    def release(self, con: sqlite3.Connection, *, readonly: bool) -> None:
+        if readonly:
+            self._reset(con)
+            if self._closed or self._idle.qsize() >= self.max_idle_readers:
+                con.close()
+            else:
+                self._idle.put(con)
+            return
+
+        if con is not self._writer:
+            # отдельный писатель, выданный при занятом общем (см. acquire)
+            self._reset(con)
+            con.close()
+            return
+
+        with self._w_cond:
+            self._w_depth -= 1
+            if self._w_depth > 0:
+                return
+            # незакоммиченное при возврате отбрасываем — как при закрытии обычного соединения
+            self._reset(con)
+            self._w_owner = None
+            if self._closed and self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self._w_cond.notify_all()
+
+    @staticmethod
+    def _reset(con: sqlite3.Connection) -> None:
+        try:
+            if con.in_transaction:
+                con.rollback()
+        except sqlite3.Error:
+            pass
+        con.row_factory = sqlite3.Row
+
+    @contextmanager
+    def reader(self) -> Iterator[PooledConnection]:
+        con = self.acquire(readonly=True)
+        try:
+            yield con
+        finally:
+            con.close()
+
+    @contextmanager
+    def writer(self) -> Iterator[PooledConnection]:
+        """Транзакция писателя: commit при успехе, rollback при исключении."""
+        con = self.acquire(readonly=False)
+        with con:
+            yield con
+
+    # ---------- завершение ----------
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._w_cond:
+            if self._writer is not None and self._w_owner is None:
+                self._writer.close()
+                self._writer = None
+
+
+_POOLS: Dict[str, ConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def configure_remote_writer(address: Optional[str], authkey: bytes = b"") -> None:
+    """
+    Запись всех пулов процесса — через процесс-писатель по address (None — снова локально).
+    Уже открытые пулы закрываются: следующие get_pool() создают писателя по новой настройке.
+    """
+    global _REMOTE_WRITER
+    _REMOTE_WRITER = (address, authkey) if address else None
+    close_all()
+
+
+def get_pool(db_path: Optional[str] = None) -> ConnectionPool:
+    """
+    Пул для пути к БД. Без аргумента — путь из crm2.config.DB_PATH.
+    Модули с собственным резолвером пути передают свой DB_PATH; при совпадении путей пул общий.
+    """
+    if db_path is None:
+        from crm2.config import DB_PATH as db_path
+    key = os.path.abspath(str(db_path))
+    pool = _POOLS.get(key)
+    if pool is not None and not pool._closed:
+        return pool
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None or pool._closed:
+            pool = ConnectionPool(key)
+            _POOLS[key] = pool
+            log.info("[DB] connection pool created for %s", key)
+        return pool
+
+
+def close_all() -> None:
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close()
+        _POOLS.clear()
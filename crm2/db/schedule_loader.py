@@ -2,12 +2,25 @@
 # Назначение: Загрузка и синхронизация расписания из XLSX файлов в базу данных (таблицы topics и session_days)
 # Классы:
 # - Row - Dataclass для представления строки расписания (date, code, title, annotation, cohort_id)
+# - ImportReport - Итог импорта: inserted/updated/unchanged/removed + аудит изменений
 # Функции:
 # - _norm - Нормализация строки для сравнения (удаление лишних символов, приведение к нижнему регистру)
 # - _pick - Выбор первого существующего ключа из словаря по списку кандидатов
 # - _detect_cohort_from_filename - Извлечение номера когорты из имени файла
-# - _iter_xlsx - Итератор по строкам XLSX файла, преобразующий данные в объекты Row
-# - sync_schedule_from_files - Синхронизация расписания из списка файлов в БД
+# - _to_dates - Векторное преобразование колонки в даты
+# - _to_text - Векторное преобразование колонки в строки (None для пустых)
+# - _parse_sheet - Разбор одного листа в компактный фрейм (date, code, title, annotation, cohort_id)
+# - _parse_xlsx - Разбор всей книги XLSX (все листы) за один проход
+# - _iter_xlsx - Итератор объектов Row поверх _parse_xlsx (совместимость)
+# - _parse_files - Разбор всех XLSX в список строк (до транзакции — писатель на время разбора не занят)
+# - _stage_rows - Загрузка разобранных строк во временные таблицы (executemany)
+# - _merge_topics - Set-based слияние тем из временной таблицы в topics
+# - _diff_session_days - Классификация строк session_days (insert/update/unchanged/remove)
+# - _merge_session_days - Set-based применение различий к session_days
+# - import_schedule - Пакетный импорт расписания с отчётом и режимом dry-run
+# - sync_schedule_from_files - Синхронизация расписания из списка файлов в БД (обёртка над import_schedule)
+# - rebuild_session_blocks - Пересборка материализованных блоков занятий из session_days одним запросом
+# - session_blocks_fresh - Построены ли блоки по текущей версии session_days (иначе читать session_days)
 # - list_schedule_files - Поиск файлов расписания по шаблону в корне проекта
 # - sync_schedule_autodiscover - Автоматическое обнаружение файлов расписания и их синхронизация
 
@@ -15,10 +28,11 @@ from __future__ import annotations
 
 import logging
 import re
-from dataclasses import dataclass
+import sqlite3
+from dataclasses import dataclass, field
 from datetime import timedelta
 from pathlib import Path
-from typing import Dict, Iterable, Iterator, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 
 from .core import get_db_connection
 
@@ -73,23 +87,44 @@ class Row:
     cohort_id: Optional[int]
 
 
-def _iter_xlsx(path: Path, default_cohort: Optional[int]) -> Iterator[Row]:
-    try:
-        import pandas as pd  # type: ignore
-    except Exception as e:
-        log.error("Pandas is required to read %s (install pandas+openpyxl). Error: %s", path.name, e)
-        return
+FRAME_COLUMNS = ["date", "code", "title", "annotation", "cohort_id"]
 
-    try:
-        df = pd.read_excel(path)  # requires openpyxl
-    except Exception as e:
-        log.error("Failed to read %s: %s", path, e)
-        return
+
+def _to_dates(series):
+    """
+    Колонка → даты (normalize) одним векторным вызовом на каждый формат.
+    ISO 'YYYY-MM-DD' разбираем строго, остальное — общим разбором без dayfirst.
+    """
+    import pandas as pd
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return pd.to_datetime(series, errors="coerce").dt.normalize()
+    s = series.astype(str).str.strip().where(series.notna())
+    iso = s.str.match(ISO_RE.pattern, na=False)
+    out = pd.Series(pd.NaT, index=series.index, dtype="datetime64[ns]")
+    if iso.any():
+        out[iso] = pd.to_datetime(s[iso], format="%Y-%m-%d", errors="coerce")
+    rest = s.notna() & ~iso
+    if rest.any():
+        out[rest] = pd.to_datetime(s[rest], errors="coerce", dayfirst=False, format="mixed")
+    return out.dt.normalize()
+
+
+def _to_text(series):
+    """Колонка → str.strip() / None для пустых ячеек."""
+    import pandas as pd
+    out = series.astype(str).str.strip().to_numpy(dtype=object)
+    out[series.isna().to_numpy()] = None
+    return pd.Series(out, index=series.index, dtype=object)
+
+
+def _parse_sheet(df, default_cohort: Optional[int], *, name: str, autodetect: bool):
+    """Один лист → компактный фрейм FRAME_COLUMNS (по строке на день)."""
+    import numpy as np
+    import pandas as pd
 
     cols_norm_map: Dict[str, int] = {_norm(c): i for i, c in enumerate(df.columns.astype(str).tolist())}
-    log.info("[SCHEDULE] %s columns: %s", path.name, list(cols_norm_map.keys()))
+    log.info("[SCHEDULE] %s columns: %s", name, list(cols_norm_map.keys()))
 
-    # pick indices
     idx_date = _pick(cols_norm_map, _COL_SYNONYMS["date"])
     idx_start = _pick(cols_norm_map, _COL_SYNONYMS["start"])
     idx_end = _pick(cols_norm_map, _COL_SYNONYMS["end"])
@@ -98,142 +133,425 @@ def _iter_xlsx(path: Path, default_cohort: Optional[int]) -> Iterator[Row]:
     idx_ann = _pick(cols_norm_map, _COL_SYNONYMS["annotation"])
     idx_cohort = _pick(cols_norm_map, _COL_SYNONYMS["cohort"])
 
-    # helper
-    def _to_date(v):
-        import pandas as pd  # local import to avoid mypy noise
-        if v is None:
-            return None
-        s = str(v).strip()
-        # ISO формат — парсим строго без dayfirst (устраняет предупреждение pandas)
-        if ISO_RE.match(s):
-            d = pd.to_datetime(s, format="%Y-%m-%d", errors="coerce")
-        else:
-            d = pd.to_datetime(s, errors="coerce", dayfirst=False)
-        return None if pd.isna(d) else d.normalize()
-
-    # iterate rows
-    for _, row in df.iterrows():
-        # determine date(s)
-        dates_list: List[str] = []
-
-        if idx_start is not None or idx_end is not None:
-            v_start = row.iloc[idx_start] if idx_start is not None else None
-            v_end = row.iloc[idx_end] if idx_end is not None else None
-            d_start = _to_date(v_start) or _to_date(v_end)
-            d_end = _to_date(v_end) or _to_date(v_start)
-            if d_start is not None:
-                if d_end is None or d_end < d_start:
-                    d_end = d_start
-                cur = d_start
-                while cur <= d_end:
-                    dates_list.append(cur.strftime("%Y-%m-%d"))
-                    cur = cur + timedelta(days=1)
-        elif idx_date is not None:
-            v = row.iloc[idx_date]
-            d = _to_date(v)
-            if d is not None:
-                dates_list.append(d.strftime("%Y-%m-%d"))
-        else:
-            # Auto-detect column with most date-like values (без dayfirst — тут лишь эвристика)
-            try:
-                import pandas as pd
-                best_idx, best_hits = None, -1
-                for i in range(df.shape[1]):
-                    series = df.iloc[:, i]
-                    parsed = pd.to_datetime(series, errors="coerce")
-                    hits = int(parsed.notna().sum())
-                    if hits > best_hits:
-                        best_idx, best_hits = i, hits
-                if best_idx is not None and best_hits >= 3:
-                    v = row.iloc[best_idx]
-                    d = _to_date(v)
-                    if d is not None:
-                        dates_list.append(d.strftime("%Y-%m-%d"))
-            except Exception:
-                pass
-
-        if not dates_list:
+    # 1) даты начала/окончания — по колонкам целиком
+    if idx_start is not None or idx_end is not None:
+        d_start = _to_dates(df.iloc[:, idx_start]) if idx_start is not None else None
+        d_end = _to_dates(df.iloc[:, idx_end]) if idx_end is not None else None
+        if d_start is None:
+            d_start = d_end
+        if d_end is None:
+            d_end = d_start
+        start = d_start.fillna(d_end)
+        end = d_end.fillna(d_start)
+        end = end.where(end >= start, start)
+    else:
+        date_idx = idx_date
+        if date_idx is None and autodetect:
+            # колонка с наибольшим числом дат — выбираем один раз на лист
+            best_idx, best_hits = None, -1
+            for k in range(df.shape[1]):
+                hits = int(pd.to_datetime(df.iloc[:, k], errors="coerce", format="mixed").notna().sum())
+                if hits > best_hits:
+                    best_idx, best_hits = k, hits
+            if best_idx is not None and best_hits >= 3:
+                date_idx = best_idx
+        if date_idx is None:
+            return pd.DataFrame(columns=FRAME_COLUMNS)
+        start = end = _to_dates(df.iloc[:, date_idx])
+
+    keep = start.notna().to_numpy()
+    if not keep.any():
+        return pd.DataFrame(columns=FRAME_COLUMNS)
+
+    # 2) прочие поля — тоже колонками
+    def _text(idx):
+        if idx is None:
+            return np.full(len(df), None, dtype=object)
+        return _to_text(df.iloc[:, idx]).to_numpy()
+
+    if idx_cohort is not None:
+        cohort = pd.to_numeric(_to_text(df.iloc[:, idx_cohort]), errors="coerce")
+        cohort = np.where(cohort.notna(), np.floor(cohort.fillna(0)), np.nan)
+    else:
+        cohort = np.full(len(df), np.nan)
+    if default_cohort is not None:
+        cohort = np.where(np.isnan(cohort), float(default_cohort), cohort)
+
+    # 3) раскрытие диапазонов: повторяем строку n раз и прибавляем 0..n-1 дней
+    s_days = start.to_numpy(dtype="datetime64[D]")[keep]
+    e_days = end.to_numpy(dtype="datetime64[D]")[keep]
+    n = (e_days - s_days).astype(np.int64) + 1
+    rep = np.repeat(np.flatnonzero(keep), n)
+    offsets = np.arange(int(n.sum())) - np.repeat(np.cumsum(n) - n, n)
+    days = np.repeat(s_days, n) + offsets.astype("timedelta64[D]")
+
+    cohort_rep = cohort[rep]
+    # dtype=object: пустые ячейки остаются None (строковый dtype pandas превратил бы их в NaN)
+    return pd.DataFrame({
+        "date": np.datetime_as_string(days, unit="D").astype(object),
+        "code": pd.Series(_text(idx_code)[rep], dtype=object),
+        "title": pd.Series(_text(idx_title)[rep], dtype=object),
+        "annotation": pd.Series(_text(idx_ann)[rep], dtype=object),
+        "cohort_id": pd.Series([None if np.isnan(c) else int(c) for c in cohort_rep], dtype=object),
+    }, columns=FRAME_COLUMNS)
+
+
+def _parse_xlsx(path: Path, default_cohort: Optional[int]):
+    """
+    Векторный разбор книги: все листы за одно чтение файла, даты — одним вызовом на колонку,
+    диапазоны раскрываются арифметикой над datetime64. Возвращает фрейм FRAME_COLUMNS или None.
+    Листы, кроме первого, берутся только при распознанных колонках дат.
+    """
+    try:
+        import pandas as pd  # type: ignore
+    except Exception as e:
+        log.error("Pandas is required to read %s (install pandas+openpyxl). Error: %s", path.name, e)
+        return None
+
+    try:
+        sheets = pd.read_excel(path, sheet_name=None)  # requires openpyxl
+    except Exception as e:
+        log.error("Failed to read %s: %s", path, e)
+        return None
+
+    frames = []
+    for n, (sheet, df) in enumerate(sheets.items()):
+        if df.empty:
             continue
+        name = path.name if n == 0 else f"{path.name}[{sheet}]"
+        frames.append(_parse_sheet(df, default_cohort, name=name, autodetect=(n == 0)))
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=FRAME_COLUMNS)
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
 
-        # extract other fields
-        def _cell(idx):
-            if idx is None:
-                return None
-            v = row.iloc[idx]
-            try:
-                import pandas as pd
-                if pd.isna(v):  # type: ignore[attr-defined]
-                    return None
-            except Exception:
-                pass
-            return str(v).strip()
-
-        code = _cell(idx_code)
-        title = _cell(idx_title)
-        ann = _cell(idx_ann)
-
-        # cohort
-        cohort_id = None
-        sv = _cell(idx_cohort)
-        if sv is not None:
-            try:
-                cohort_id = int(float(sv))
-            except Exception:
-                cohort_id = default_cohort
-        else:
-            cohort_id = default_cohort
 
-        for ds in dates_list:
-            yield Row(date=ds, code=code, title=title, annotation=ann, cohort_id=cohort_id)
+def _iter_xlsx(path: Path, default_cohort: Optional[int]) -> Iterator[Row]:
+    frame = _parse_xlsx(path, default_cohort)
+    if frame is None:
+        return
+    for d, code, title, ann, cohort_id in frame.itertuples(index=False, name=None):
+        yield Row(date=d, code=code, title=title, annotation=ann, cohort_id=cohort_id)
+
+
+# --------- materialized blocks ---------
+
+def rebuild_session_blocks(con) -> int:
+    """
+    Пересобирает session_blocks из session_days (в транзакции вызывающего).
+    Острова подряд идущих дат внутри потока находятся оконными функциями:
+    julianday(day) - ROW_NUMBER() одинаков у всех дней одного блока.
+    """
+    from .auto_migrate import ensure_session_blocks
+    ensure_session_blocks(con, populate=False)
+    con.execute("DELETE FROM session_blocks")
+    before = con.total_changes
+    con.execute(
+        """
+        WITH days AS (
+            SELECT MIN(id) AS id, cohort_id, date(date) AS day, topic_id, topic_code
+            FROM session_days
+            WHERE cohort_id IS NOT NULL AND date(date) IS NOT NULL
+            GROUP BY cohort_id, date(date)
+        ),
+        islands AS (
+            SELECT id, cohort_id, day, topic_id, topic_code,
+                   julianday(day) - ROW_NUMBER() OVER (PARTITION BY cohort_id ORDER BY day) AS grp
+            FROM days
+        ),
+        marked AS (
+            SELECT cohort_id, grp, day,
+                   FIRST_VALUE(id)         OVER w AS first_day_id,
+                   FIRST_VALUE(topic_id)   OVER w AS topic_id,
+                   FIRST_VALUE(topic_code) OVER w AS topic_code
+            FROM islands
+            WINDOW w AS (PARTITION BY cohort_id, grp ORDER BY day)
+        )
+        INSERT INTO session_blocks(cohort_id, start_date, end_date, topic_id, topic_code, first_day_id, days)
+        SELECT cohort_id, MIN(day), MAX(day), MAX(topic_id), MAX(topic_code), MAX(first_day_id), COUNT(*)
+        FROM marked
+        GROUP BY cohort_id, grp
+        ORDER BY cohort_id, MIN(day)
+        """
+    )
+    # rowcount у INSERT с WITH-префиксом не заполняется — считаем по total_changes
+    blocks = con.total_changes - before
+    # версия session_days, из которой собраны блоки: прямые правки дней мимо загрузчика
+    # (crm2/data, админка) её сдвигают триггером — и читатели уходят на session_days
+    try:
+        con.execute(
+            """
+            INSERT OR REPLACE INTO schedule_changes(table_name, version)
+            SELECT 'session_blocks_source', version FROM schedule_changes WHERE table_name = 'session_days'
+            """
+        )
+    except sqlite3.OperationalError:  # база без счетчиков (не прошла auto_migrate)
+        pass
+    log.info("[SCHEDULE] session_blocks rebuilt: %s blocks", blocks)
+    return blocks
+
+
+def session_blocks_fresh(con) -> bool:
+    """
+    True — session_blocks собраны по текущему session_days. Без счетчиков schedule_changes
+    (старая база) считаем блоки актуальными, как раньше.
+    """
+    try:
+        row = con.execute(
+            """
+            SELECT (SELECT version FROM schedule_changes WHERE table_name = 'session_days'),
+                   (SELECT version FROM schedule_changes WHERE table_name = 'session_blocks_source')
+            """
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return True
+    return row[0] is None or row[0] == row[1]
 
 
 # --------- sync into DB ---------
 
+@dataclass
+class ImportReport:
+    """Итог импорта расписания: счётчики по session_days/topics и построчный аудит изменений."""
+    dry_run: bool = False
+    files: int = 0
+    staged: int = 0            # строк-дней после раскрытия диапазонов (без дублей)
+    skipped: int = 0           # строк без потока
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    removed: int = 0           # есть в БД для импортируемых потоков, но нет в файлах
+    pruned: bool = False       # удалены ли такие строки (prune=True)
+    topics_inserted: int = 0
+    topics_updated: int = 0
+    changes: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def affected(self) -> int:
+        return self.inserted + self.updated + (self.removed if self.pruned else 0)
+
+    def summary(self) -> str:
+        mode = "DRY-RUN " if self.dry_run else ""
+        return (
+            f"{mode}files={self.files} staged={self.staged} skipped={self.skipped} | "
+            f"session_days: +{self.inserted} ~{self.updated} ={self.unchanged} "
+            f"-{self.removed}{'' if self.pruned else ' (kept)'} | "
+            f"topics: +{self.topics_inserted} ~{self.topics_updated}"
+        )
+
+
+def _parse_files(files: Iterable[str], report: ImportReport) -> List[tuple]:
+    """Разбор XLSX (pandas/openpyxl) в строки (date, cohort_id, code, title, annotation) — без обращений к БД."""
+    rows: List[tuple] = []
+    for f in files:
+        p = Path(f)
+        if not p.exists():
+            log.warning("[SCHEDULE] skip non-existent file: %s", p)
+            continue
+        report.files += 1
+        frame = _parse_xlsx(p, _detect_cohort_from_filename(p))
+        if frame is None or frame.empty:
+            continue
+        no_cohort = frame["cohort_id"].isna()
+        report.skipped += int(no_cohort.sum())
+        frame = frame[~no_cohort]
+        rows.extend(zip(
+            frame["date"], frame["cohort_id"].astype(int),
+            (c or None for c in frame["code"]), frame["title"], frame["annotation"],
+        ))
+    return rows
+
+
+def _stage_rows(con, rows: List[tuple], report: ImportReport) -> None:
+    """Разобранные строки → временная таблица temp._stage_schedule (executemany, без обращений к основным таблицам)."""
+    con.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS _stage_schedule (
+            seq        INTEGER PRIMARY KEY,
+            date       TEXT NOT NULL,
+            cohort_id  INTEGER NOT NULL,
+            code       TEXT,
+            title      TEXT,
+            annotation TEXT
+        )
+        """
+    )
+    con.execute("DELETE FROM temp._stage_schedule")
+    con.executemany(
+        "INSERT INTO temp._stage_schedule(date, cohort_id, code, title, annotation) VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+
+    # Итоговые строки: при повторе (date, cohort_id) побеждает последняя, как при построчном upsert
+    con.execute("DROP TABLE IF EXISTS temp._stage_days")
+    con.execute(
+        """
+        CREATE TEMP TABLE _stage_days AS
+        SELECT s.date, s.cohort_id, s.code
+        FROM temp._stage_schedule s
+        JOIN (SELECT MAX(seq) AS seq FROM temp._stage_schedule GROUP BY date, cohort_id) last
+          ON last.seq = s.seq
+        """
+    )
+    con.execute("CREATE INDEX temp.idx_stage_days ON _stage_days(cohort_id, date)")
+    report.staged = con.execute("SELECT COUNT(*) FROM temp._stage_days").fetchone()[0]
+
+    # Темы: последнее непустое title/annotation по коду (None не затирает значение в БД)
+    con.execute("DROP TABLE IF EXISTS temp._stage_topics")
+    con.execute(
+        """
+        CREATE TEMP TABLE _stage_topics AS
+        SELECT c.code,
+               (SELECT title FROM temp._stage_schedule s
+                 WHERE s.code = c.code AND s.title IS NOT NULL ORDER BY s.seq DESC LIMIT 1) AS title,
+               (SELECT annotation FROM temp._stage_schedule s
+                 WHERE s.code = c.code AND s.annotation IS NOT NULL ORDER BY s.seq DESC LIMIT 1) AS annotation
+        FROM (SELECT DISTINCT code FROM temp._stage_schedule WHERE code IS NOT NULL) c
+        """
+    )
+
+
+def _merge_topics(con, report: ImportReport) -> None:
+    report.topics_inserted = con.execute(
+        """
+        INSERT INTO topics(code, title, annotation)
+        SELECT st.code, st.title, st.annotation
+        FROM temp._stage_topics st
+        WHERE NOT EXISTS (SELECT 1 FROM topics t WHERE t.code = st.code)
+        """
+    ).rowcount
+    report.topics_updated = con.execute(
+        """
+        UPDATE topics
+        SET title      = COALESCE((SELECT st.title FROM temp._stage_topics st WHERE st.code = topics.code), title),
+            annotation = COALESCE((SELECT st.annotation FROM temp._stage_topics st WHERE st.code = topics.code), annotation)
+        WHERE code IN (
+            SELECT st.code FROM temp._stage_topics st
+            WHERE st.code = topics.code
+              AND ((st.title IS NOT NULL AND st.title IS NOT topics.title)
+                OR (st.annotation IS NOT NULL AND st.annotation IS NOT topics.annotation))
+        )
+        """
+    ).rowcount
+
+
+def _diff_session_days(con, report: ImportReport) -> None:
+    """Классификация строк до записи: insert / update / unchanged / remove (+ аудит)."""
+    con.execute("DROP TABLE IF EXISTS temp._stage_diff")
+    con.execute(
+        """
+        CREATE TEMP TABLE _stage_diff AS
+        SELECT CASE
+                 WHEN sd.id IS NULL THEN 'insert'
+                 WHEN COALESCE(t.id, sd.topic_id) IS NOT sd.topic_id
+                   OR COALESCE(st.code, sd.topic_code) IS NOT sd.topic_code THEN 'update'
+                 ELSE 'unchanged'
+               END                                      AS action,
+               st.date, st.cohort_id, sd.id AS day_id,
+               sd.topic_code                            AS old_code,
+               COALESCE(st.code, sd.topic_code)         AS new_code,
+               COALESCE(t.id, sd.topic_id)              AS new_topic_id
+        FROM temp._stage_days st
+        LEFT JOIN topics t ON t.code = st.code
+        LEFT JOIN session_days sd ON sd.date = st.date AND sd.cohort_id = st.cohort_id
+        UNION ALL
+        SELECT 'remove', sd.date, sd.cohort_id, sd.id, sd.topic_code, NULL, NULL
+        FROM session_days sd
+        WHERE sd.cohort_id IN (SELECT DISTINCT cohort_id FROM temp._stage_days)
+          AND NOT EXISTS (SELECT 1 FROM temp._stage_days st
+                          WHERE st.cohort_id = sd.cohort_id AND st.date = sd.date)
+        """
+    )
+    counts = dict(con.execute("SELECT action, COUNT(*) FROM temp._stage_diff GROUP BY action").fetchall())
+    report.inserted = counts.get("insert", 0)
+    report.updated = counts.get("update", 0)
+    report.unchanged = counts.get("unchanged", 0)
+    report.removed = counts.get("remove", 0)
+    report.changes = [
+        {"action": a, "date": d, "cohort_id": c, "old_code": o, "new_code": n}
+        for a, d, c, o, n in con.execute(
+            """
+            SELECT action, date, cohort_id, old_code, new_code
+            FROM temp._stage_diff
+            WHERE action <> 'unchanged'
+            ORDER BY cohort_id, date, action
+            """
+        ).fetchall()
+    ]
+
+
+def _merge_session_days(con, *, prune: bool) -> None:
+    con.execute(
+        """
+        UPDATE session_days
+        SET topic_id   = (SELECT d.new_topic_id FROM temp._stage_diff d WHERE d.day_id = session_days.id AND d.action = 'update'),
+            topic_code = (SELECT d.new_code     FROM temp._stage_diff d WHERE d.day_id = session_days.id AND d.action = 'update')
+        WHERE id IN (SELECT day_id FROM temp._stage_diff WHERE action = 'update')
+        """
+    )
+    con.execute(
+        """
+        INSERT INTO session_days(date, cohort_id, topic_id, topic_code)
+        SELECT date, cohort_id, new_topic_id, new_code
+        FROM temp._stage_diff
+        WHERE action = 'insert'
+        ORDER BY cohort_id, date
+        """
+    )
+    if prune:
+        con.execute("DELETE FROM session_days WHERE id IN (SELECT day_id FROM temp._stage_diff WHERE action = 'remove')")
+
+
+def import_schedule(files: Iterable[str], *, dry_run: bool = False, prune: bool = False) -> ImportReport:
+    """
+    Пакетный импорт XLSX → SQLite:
+      1) разбор всех файлов в память — до транзакции, писатель БД в это время свободен;
+      2) загрузка во временные таблицы, слияние topics и session_days set-based запросами в одной транзакции;
+      3) отчёт inserted/updated/unchanged/removed + построчный аудит изменений.
+    dry_run=True — всё считается, но транзакция откатывается.
+    prune=True — удалять дни импортируемых потоков, которых больше нет в файлах
+    (по умолчанию только сообщаем о них: на дни могут ссылаться attendance/homework_delivery).
+    """
+    report = ImportReport(dry_run=dry_run, pruned=prune and not dry_run)
+    rows = _parse_files(files, report)
+    with get_db_connection() as con:
+        con.row_factory = None
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            _stage_rows(con, rows, report)
+            _merge_topics(con, report)
+            _diff_session_days(con, report)
+            if not dry_run:
+                _merge_session_days(con, prune=prune)
+                rebuild_session_blocks(con)
+        except Exception:
+            con.rollback()
+            raise
+        if dry_run:
+            con.rollback()
+        else:
+            con.commit()
+        for t in ("_stage_schedule", "_stage_days", "_stage_topics", "_stage_diff"):
+            con.execute(f"DROP TABLE IF EXISTS temp.{t}")
+
+    log.info("[SYNC] schedule import: %s", report.summary())
+    if not dry_run:
+        # индекс расписания в памяти пересоберётся при следующем обращении
+        from crm2.services.schedule_index import invalidate
+        invalidate()
+    return report
+
+
 def sync_schedule_from_files(files: Iterable[str]) -> int:
     """
     XLSX с колонками: No | start_date | end_date | topic_code | title | annotation
     - Диапазоны дат раскрываются в отдельные дни.
     - topics обновляются только реальными title/annotation из файла.
-    - session_days upsert по (date, cohort_id).
+    - session_days сливаются по (date, cohort_id) пакетно (см. import_schedule).
+    - session_blocks пересобираются в той же транзакции.
+    Возвращает число вставленных/обновлённых строк session_days.
     """
-    added = 0
-    with get_db_connection() as con:
-        con.row_factory = None
-        cur = con.cursor()
-        for f in files:
-            p = Path(f)
-            if not p.exists():
-                log.warning("[SCHEDULE] skip non-existent file: %s", p)
-                continue
-
-            default_cohort = _detect_cohort_from_filename(p)
-            for r in _iter_xlsx(p, default_cohort):
-                topic_id = None
-                if r.code:
-                    cur.execute("INSERT OR IGNORE INTO topics(code) VALUES (?)", (r.code,))
-                    if r.title is not None:
-                        cur.execute("UPDATE topics SET title=? WHERE code=?", (r.title, r.code))
-                    if r.annotation is not None:
-                        cur.execute("UPDATE topics SET annotation=? WHERE code=?", (r.annotation, r.code))
-                    row = cur.execute("SELECT id FROM topics WHERE code=?", (r.code,)).fetchone()
-                    topic_id = int(row[0]) if row else None
-
-                cur.execute(
-                    """
-                    INSERT INTO session_days(date, cohort_id, topic_id, topic_code)
-                    VALUES (?, ?, ?, ?)
-                    ON CONFLICT(date, cohort_id) DO UPDATE SET
-                        topic_id=COALESCE(excluded.topic_id, session_days.topic_id),
-                        topic_code=COALESCE(excluded.topic_code, session_days.topic_code)
-                    """,
-                    (r.date, r.cohort_id, topic_id, r.code),
-                )
-                # rowcount может быть 1 и при INSERT, и при UPDATE — нам подходит
-                if cur.rowcount is not None and cur.rowcount > 0:
-                    added += cur.rowcount
-        con.commit()
-    log.info("[SYNC] schedule from files done; affected rows=%s", added)
-    return added
+    return import_schedule(files).affected
 
 def list_schedule_files() -> List[str]:
     """
@@ -23,13 +23,13 @@ def _dicts(rows: List[Row]) -> List[Dict[str, Any]]:
 
 # ---------- ТРЕНИНГИ ПО ПОТОКАМ (session_days) ----------
 def count_trainings(cohort_id: int) -> int:
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         cur = con.execute("SELECT COUNT(*) FROM session_days WHERE cohort_id = ?", (cohort_id,))
         return int(cur.fetchone()[0] or 0)
 
 def list_trainings(cohort_id: int, offset: int, limit: int) -> List[Dict[str, Any]]:
     # подцепим title темы по topic_code или topic_id
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = Row
         cur = con.execute("""
             SELECT sd.id,
@@ -47,12 +47,12 @@ def list_trainings(cohort_id: int, offset: int, limit: int) -> List[Dict[str, An
 
 # ---------- МЕРОПРИЯТИЯ (events) ----------
 def count_events() -> int:
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         cur = con.execute("SELECT COUNT(*) FROM events")
         return int(cur.fetchone()[0] or 0)
 
 def list_events(offset: int, limit: int) -> List[Dict[str, Any]]:
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = Row
         cur = con.execute("""
             SELECT id, date, title, COALESCE(description, '') AS description
@@ -64,12 +64,12 @@ def list_events(offset: int, limit: int) -> List[Dict[str, Any]]:
 
 # ---------- ЦЕЛИТЕЛЬСКИЕ ПРИЁМЫ (healing_sessions) ----------
 def count_healings() -> int:
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         cur = con.execute("SELECT COUNT(*) FROM healing_sessions")
         return int(cur.fetchone()[0] or 0)
 
 def list_healings(offset: int, limit: int) -> List[Dict[str, Any]]:
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = Row
         cur = con.execute("""
             SELECT id, date, time_start, COALESCE(note, '') AS note
@@ -81,7 +81,7 @@ def list_healings(offset: int, limit: int) -> List[Dict[str, Any]]:
 
 # ---------- ОБЩЕЕ РАСПИСАНИЕ (всё вместе) ----------
 def count_all() -> int:
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         cur = con.execute("""
             SELECT
               (SELECT COUNT(*) FROM session_days)
@@ -91,7 +91,7 @@ def count_all() -> int:
         return int(cur.fetchone()[0] or 0)
 
 def list_all(offset: int, limit: int) -> List[Dict[str, Any]]:
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = Row
         cur = con.execute("""
             SELECT start_at, kind, title, details
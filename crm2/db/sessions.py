@@ -1,17 +1,24 @@
 # crm2/db/sessions.py
 # Назначение: Функции для работы с сессиями (тренинги, мероприятия) и получения расписания для пользователей
+# Классы:
+# - _SchemaPlan - Скомпилированный план запросов: найденные таблицы/столбцы и готовые тексты SQL
 # Функции:
 # - get_session_detail_by_cohort_and_date - Получение деталей сессии по когорте и дате
 # - _table_exists - Проверка существования таблицы в БД
 # - _cols - Получение списка столбцов таблицы
 # - _pick - Выбор первого существующего столбца из списка кандидатов
-# - _safe_title_from_table - Безопасное получение заголовка из таблицы по ID
+# - _safe_title_from_table - Безопасное получение заголовка из таблицы по ID (без кэша плана)
+# - _build_plan - Разбор схемы и сборка текстов SQL (один раз на версию схемы)
+# - _get_plan - План запросов из кэша по PRAGMA schema_version
 # - get_user_cohort_title_by_tg - Получение когорты пользователя и ее названия по Telegram ID
-# - _select_from_session_days - Выборка из session_days (с группировкой последовательных дней)
+# - _select_from_session_days - Выборка блоков из session_blocks (фолбэк — группировка дней session_days, в т.ч. если блоки устарели)
 # - _select_from_sessions - Выборка из таблицы sessions
 # - _select_from_events - Выборка из таблицы events
+# - _resolve_cohort_id - Поток пользователя по Telegram ID: participants, затем users.cohort_id
+# - _select_before_session_days - Выборка из источников с приоритетом над session_days (sessions → events)
+# - get_upcoming_from_sessions_events - Поток пользователя и предстоящие занятия из sessions/events (для индекса расписания)
 # - get_upcoming_sessions - Получение предстоящих сессий для пользователя (с учетом его когорты)
-# - get_session_by_id - Получение сессии по ID (из sessions, events или session_days)
+# - get_session_by_id - Получение сессии по ID (из sessions, events или session_days + session_blocks)
 # - get_upcoming_sessions_by_cohort - Получение предстоящих сессий для когорты
 # - get_nearest_session_text - Получение текстовой строки с ближайшим занятием
 # - get_recent_past_sessions_by_cohort - Получение последних прошедших сессий для когорты
@@ -19,35 +26,23 @@
 from __future__ import annotations
 
 import sqlite3
+import threading
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional, Tuple
 
 from typing import Optional, Dict, Any
-from crm2.db.core import get_db_connection
+from crm2.db.core import DB_PATH, get_db_connection
+from crm2.db.schedule_loader import session_blocks_fresh
 
 
 def get_session_detail_by_cohort_and_date(cohort_id: int, date_iso: str) -> Optional[Dict[str, Any]]:
     """Возвращает одну запись по потоку и дате (из session_days + topics)."""
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
-        if not _table_exists(con, "session_days"):
+        sql = _get_plan(con).sd_detail
+        if sql is None:
             return None
-        cols = _cols(con, "session_days")
-        cohort_col = _pick(cols, ["cohort_id", "stream_id"])  # ← принимаем stream_id
-        sql = f"""
-            SELECT
-                sd.id AS id,
-                sd.date AS start_date,
-                sd.date AS end_date,
-                sd.topic_code AS topic_code,
-                COALESCE(t.title, '')      AS title,
-                COALESCE(t.annotation, '') AS annotation
-            FROM session_days sd
-            LEFT JOIN topics t
-                   ON (t.id = sd.topic_id) OR (t.code = sd.topic_code)
-            WHERE sd.date = ? AND {cohort_col} = ?
-            LIMIT 1
-        """
         row = con.execute(sql, (date_iso, cohort_id)).fetchone()
         return dict(row) if row else None
 
@@ -84,13 +79,215 @@ def _safe_title_from_table(con: sqlite3.Connection, table: str, id_value: int) -
     return (row["title"] if row and "title" in row.keys() else None)
 
 
+# ───────────────────── План запросов (кэш по версии схемы) ─────────────────────
+# Разбор схемы (sqlite_master, PRAGMA table_info) и сборка SQL выполняются один раз
+# на значение PRAGMA schema_version; любая миграция (CREATE/ALTER/DROP) меняет версию,
+# и план пересобирается при следующем запросе.
+
+@dataclass
+class _SchemaPlan:
+    tables: frozenset = frozenset()
+    # sessions
+    sessions_upcoming: Optional[str] = None
+    sessions_upcoming_cohort: Optional[str] = None
+    sessions_error: Optional[str] = None
+    sessions_by_id: Optional[str] = None
+    # events
+    events_upcoming: Optional[str] = None
+    events_upcoming_cohort: Optional[str] = None
+    events_by_id: Optional[str] = None
+    # session_days
+    sd_upcoming: Optional[str] = None
+    sd_upcoming_cohort: Optional[str] = None
+    sd_by_id: Optional[str] = None
+    sd_neighbour: Optional[str] = None
+    sd_detail: Optional[str] = None
+    # session_blocks (материализованные блоки, см. schedule_loader.rebuild_session_blocks)
+    sb_upcoming: Optional[str] = None
+    sb_upcoming_cohort: Optional[str] = None
+    sb_by_day_id: Optional[str] = None
+    # справочники
+    cohort_title: Optional[str] = None
+
+
+_PLANS: Dict[str, Tuple[int, _SchemaPlan]] = {}
+_PLANS_LOCK = threading.Lock()
+
+
+def _build_plan(con: sqlite3.Connection) -> _SchemaPlan:
+    tables = frozenset(
+        r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+    )
+    plan = _SchemaPlan(tables=tables)
+
+    if "sessions" in tables:
+        cols = _cols(con, "sessions")
+        id_col = "id"
+        start_col = _pick(cols, ["start_date", "start", "date"])
+        end_col = _pick(cols, ["end_date", "end", "date"])
+        topic_col = _pick(cols, ["topic_code", "code", "topic"])
+        title_col = _pick(cols, ["title", "name"])
+        ann_col = _pick(cols, ["annotation", "ann", "description", "desc"])
+        cohort_col = _pick(cols, ["cohort_id", "stream_id"])
+
+        if start_col is None:
+            plan.sessions_error = "Table 'sessions' has no start_date/start/date column"
+        else:
+            select_cols = [f"{id_col} AS id", f"{start_col} AS start_date"]
+            select_cols.append(f"{end_col} AS end_date" if end_col else f"{start_col} AS end_date")
+            select_cols.append(f"{topic_col} AS topic_code" if topic_col else "NULL AS topic_code")
+            select_cols.append(f"{title_col} AS title" if title_col else "NULL AS title")
+            select_cols.append(f"{ann_col} AS annotation" if ann_col else "'' AS annotation")
+
+            def upcoming(where: str) -> str:
+                return f"""
+                    SELECT {', '.join(select_cols)}
+                    FROM sessions
+                    WHERE {where}
+                    ORDER BY {start_col}
+                    LIMIT ?
+                """
+
+            where = f"date({start_col}) >= date('now')"
+            plan.sessions_upcoming = upcoming(where)
+            if cohort_col is not None:
+                plan.sessions_upcoming_cohort = upcoming(f"{where} AND {cohort_col}=?")
+
+            plan.sessions_by_id = f"SELECT {', '.join(select_cols)} FROM sessions WHERE {id_col}=? LIMIT 1"
+
+    if "events" in tables:
+        cols = _cols(con, "events")
+        id_col = "id"
+        date_col = _pick(cols, ["date", "event_date", "start", "start_date"]) or "date"
+        title_col = _pick(cols, ["title", "name"])
+        ann_col = _pick(cols, ["annotation", "ann", "description", "desc"])
+        cohort_col = _pick(cols, ["cohort_id", "stream_id"])
+
+        select_cols = [f"{id_col} AS id",
+                       f"{date_col} AS start_date",
+                       f"{date_col} AS end_date"]
+        select_cols.append(f"{title_col} AS title" if title_col else "NULL AS title")
+        select_cols.append(f"{ann_col} AS annotation" if ann_col else "'' AS annotation")
+        select_cols.append("NULL AS topic_code")
+
+        def upcoming(where: str) -> str:
+            return f"""
+                SELECT {', '.join(select_cols)}
+                FROM events
+                WHERE {where}
+                ORDER BY {date_col}
+                LIMIT ?
+            """
+
+        where = f"date({date_col}) >= date('now')"
+        plan.events_upcoming = upcoming(where)
+        if cohort_col is not None:
+            plan.events_upcoming_cohort = upcoming(f"{where} AND {cohort_col}=?")
+        plan.events_by_id = f"SELECT {', '.join(select_cols)} FROM events WHERE {id_col}=? LIMIT 1"
+
+    if "session_days" in tables:
+        cols = _cols(con, "session_days")
+        id_col = "id"
+        day_col = _pick(cols, ["day", "date", "day_date", "session_day"]) or "date"
+        cohort_col = _pick(cols, ["cohort_id", "stream_id"])
+        topic_code_col = _pick(cols, ["topic_code", "code"])
+        topic_id_col = _pick(cols, ["topic_id"])
+
+        select_cols = [f"{id_col} AS id", f"{day_col} AS day"]
+        select_cols.append(f"{topic_code_col} AS topic_code" if topic_code_col else "NULL AS topic_code")
+        select_cols.append(f"{topic_id_col} AS topic_id" if topic_id_col else "NULL AS topic_id")
+        select_cols.append(f"{cohort_col} AS cohort_id" if cohort_col else "NULL AS cohort_id")
+
+        where = f"date({day_col}) >= date('now')"
+        plan.sd_upcoming = f"SELECT {', '.join(select_cols)} FROM session_days WHERE {where} ORDER BY {day_col}"
+        if cohort_col is not None:
+            plan.sd_upcoming_cohort = (
+                f"SELECT {', '.join(select_cols)} FROM session_days "
+                f"WHERE {where} AND {cohort_col}=? ORDER BY {day_col}"
+            )
+        plan.sd_by_id = (
+            f"SELECT {id_col} AS id, {day_col} AS day, "
+            f"{(topic_code_col + ' AS topic_code') if topic_code_col else 'NULL AS topic_code'}, "
+            f"{(topic_id_col + ' AS topic_id') if topic_id_col else 'NULL AS topic_id'} "
+            f"FROM session_days WHERE {id_col}=? LIMIT 1"
+        )
+        plan.sd_neighbour = f"SELECT 1 FROM session_days WHERE date({day_col})=date(?) LIMIT 1"
+        if cohort_col is not None:  # ← принимаем stream_id
+            plan.sd_detail = f"""
+                SELECT
+                    sd.id AS id,
+                    sd.date AS start_date,
+                    sd.date AS end_date,
+                    sd.topic_code AS topic_code,
+                    COALESCE(t.title, '')      AS title,
+                    COALESCE(t.annotation, '') AS annotation
+                FROM session_days sd
+                LEFT JOIN topics t
+                       ON (t.id = sd.topic_id) OR (t.code = sd.topic_code)
+                WHERE sd.date = ? AND {cohort_col} = ?
+                LIMIT 1
+            """
+
+    if "session_blocks" in tables and "session_days" in tables:
+        topics_join = "LEFT JOIN topics t ON t.id = b.topic_id" if "topics" in tables else ""
+        topic_cols = (
+            "COALESCE(t.code, b.topic_code) AS topic_code, "
+            "COALESCE(t.title, '') AS title, COALESCE(t.annotation, '') AS annotation"
+            if "topics" in tables else
+            "b.topic_code AS topic_code, '' AS title, '' AS annotation"
+        )
+        upcoming_sql = (
+            f"SELECT b.first_day_id AS id, b.start_date, b.end_date, {topic_cols}, b.cohort_id "
+            f"FROM session_blocks b {topics_join} "
+            "WHERE {where} ORDER BY b.start_date LIMIT ?"
+        )
+        plan.sb_upcoming = upcoming_sql.format(where="b.end_date >= date('now')")
+        # индекс (cohort_id, start_date): равенство по потоку + готовый порядок по дате
+        plan.sb_upcoming_cohort = upcoming_sql.format(where="b.cohort_id = ? AND b.end_date >= date('now')")
+        if "topics" in tables:
+            plan.sb_by_day_id = """
+                SELECT sd.id AS id, b.start_date, b.end_date,
+                       COALESCE(t1.code, t2.code, sd.topic_code) AS topic_code,
+                       COALESCE(t1.title, t2.title, '')           AS title,
+                       COALESCE(t1.annotation, t2.annotation, '') AS annotation
+                FROM session_days sd
+                JOIN session_blocks b
+                  ON b.cohort_id = sd.cohort_id AND date(sd.date) BETWEEN b.start_date AND b.end_date
+                LEFT JOIN topics t1 ON t1.id = sd.topic_id
+                LEFT JOIN topics t2 ON sd.topic_id IS NULL AND t2.code = sd.topic_code
+                WHERE sd.id = ?
+                LIMIT 1
+            """
+
+    if "cohorts" in tables:
+        cols = _cols(con, "cohorts")
+        id_col = _pick(cols, ["id", "cohorts_id"]) or "id"
+        title_col = _pick(cols, ["title", "name", "code", "label"])
+        if title_col:
+            plan.cohort_title = f"SELECT {title_col} AS title FROM cohorts WHERE {id_col}=? LIMIT 1"
+
+    return plan
+
+
+def _get_plan(con: sqlite3.Connection) -> _SchemaPlan:
+    """План для текущей версии схемы: один PRAGMA вместо 4–8 обращений к каталогу."""
+    version = con.execute("PRAGMA schema_version").fetchone()[0]
+    cached = _PLANS.get(DB_PATH)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    plan = _build_plan(con)
+    with _PLANS_LOCK:
+        _PLANS[DB_PATH] = (version, plan)
+    return plan
+
+
 def get_user_cohort_title_by_tg(tg_id: int) -> Tuple[Optional[int], Optional[str]]:
     """
     Возвращает (cohort_id, заголовок потока) по telegram_id пользователя.
     Используем users.cohort_id. Если таблица cohorts существует — берём title оттуда,
     иначе возвращаем дефолтную подпись по словарю.
     """
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
         u = con.execute(
             "SELECT cohort_id FROM users WHERE telegram_id=? LIMIT 1",
@@ -103,9 +300,11 @@ def get_user_cohort_title_by_tg(tg_id: int) -> Tuple[Optional[int], Optional[str
     cohort_id = int(u["cohort_id"])
 
     # если есть таблица cohorts — тянем подпись оттуда
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
-        title = _safe_title_from_table(con, "cohorts", cohort_id)
+        sql = _get_plan(con).cohort_title
+        row = con.execute(sql, (cohort_id,)).fetchone() if sql else None
+        title = row["title"] if row else None
 
     if not title:
         titles = {
@@ -118,43 +317,28 @@ def get_user_cohort_title_by_tg(tg_id: int) -> Tuple[Optional[int], Optional[str
 
 
 
-def _select_from_session_days(con: sqlite3.Connection, *, cohort_id: Optional[int], limit: int) -> List[Dict[str, Any]]:
-    cols = _cols(con, "session_days")
-    id_col = "id"
-    day_col = _pick(cols, ["day", "date", "day_date", "session_day"]) or "date"
-    cohort_col = _pick(cols, ["cohort_id", "stream_id"])
-    topic_code_col = _pick(cols, ["topic_code", "code"])
-    topic_id_col = _pick(cols, ["topic_id"])
-
-    where = f"date({day_col}) >= date('now')"
-    params: List[Any] = []
-    if cohort_id is not None and cohort_col is not None:
-        where += f" AND {cohort_col}=?"
-        params.append(cohort_id)
-
-    select_cols = [f"{id_col} AS id", f"{day_col} AS day"]
-    if topic_code_col:
-        select_cols.append(f"{topic_code_col} AS topic_code")
-    else:
-        select_cols.append("NULL AS topic_code")
-    if topic_id_col:
-        select_cols.append(f"{topic_id_col} AS topic_id")
-    else:
-        select_cols.append("NULL AS topic_id")
+def _select_from_session_days(con: sqlite3.Connection, plan: _SchemaPlan, *, cohort_id: Optional[int], limit: int) -> List[Dict[str, Any]]:
+    # Готовые блоки из session_blocks — один проход по индексу вместо склейки дней в Python
+    # (если блоки собраны по текущей версии session_days)
+    if plan.sb_upcoming is not None and session_blocks_fresh(con):
+        if cohort_id is not None:
+            rows = con.execute(plan.sb_upcoming_cohort, (cohort_id, limit)).fetchall()
+        else:
+            rows = con.execute(plan.sb_upcoming, (limit,)).fetchall()
+        if rows:
+            return [dict(r) for r in rows]
 
-    if cohort_col:
-        select_cols.append(f"{cohort_col} AS cohort_id")
+    if cohort_id is not None and plan.sd_upcoming_cohort is not None:
+        sql, params = plan.sd_upcoming_cohort, [cohort_id]
     else:
-        select_cols.append("NULL AS cohort_id")
-
-    sql = f"SELECT {', '.join(select_cols)} FROM session_days WHERE {where} ORDER BY {day_col}"
+        sql, params = plan.sd_upcoming, []
     rows = [dict(r) for r in con.execute(sql, params).fetchall()]
     if not rows:
         return []
 
     topics_by_id: Dict[int, Dict[str, str]] = {}
     topics_by_code: Dict[str, Dict[str, str]] = {}
-    if _table_exists(con, "topics"):
+    if "topics" in plan.tables:
         for tr in con.execute("SELECT id, code, title, annotation FROM topics").fetchall():
             rec = {
                 "topic_code": tr["code"],
@@ -256,116 +440,92 @@ def _select_from_session_days(con: sqlite3.Connection, *, cohort_id: Optional[in
     return cleaned
 
 
-def _select_from_sessions(con: sqlite3.Connection, *, cohort_id: Optional[int], limit: int) -> List[Dict[str, Any]]:
-    cols = _cols(con, "sessions")
-    id_col = "id"
-    start_col = _pick(cols, ["start_date", "start", "date"])
-    end_col = _pick(cols, ["end_date", "end", "date"])
-    topic_col = _pick(cols, ["topic_code", "code", "topic"])
-    title_col = _pick(cols, ["title", "name"])
-    ann_col = _pick(cols, ["annotation", "ann", "description", "desc"])
-    cohort_col = _pick(cols, ["cohort_id", "stream_id"])
-
-    if start_col is None:
-        raise RuntimeError("Table 'sessions' has no start_date/start/date column")
-
-    where = f"date({start_col}) >= date('now')"
-    params: List[Any] = []
-    if cohort_id is not None and cohort_col is not None:
-        where += f" AND {cohort_col}=?"
-        params.append(cohort_id)
-
-    select_cols = [f"{id_col} AS id", f"{start_col} AS start_date"]
-    select_cols.append(f"{end_col} AS end_date" if end_col else f"{start_col} AS end_date")
-    select_cols.append(f"{topic_col} AS topic_code" if topic_col else "NULL AS topic_code")
-    select_cols.append(f"{title_col} AS title" if title_col else "NULL AS title")
-    select_cols.append(f"{ann_col} AS annotation" if ann_col else "'' AS annotation")
-
-    sql = f"""
-        SELECT {', '.join(select_cols)}
-        FROM sessions
-        WHERE {where}
-        ORDER BY {start_col}
-        LIMIT ?
-    """
-    params.append(limit)
+def _select_from_sessions(con: sqlite3.Connection, plan: _SchemaPlan, *, cohort_id: Optional[int], limit: int) -> List[Dict[str, Any]]:
+    if plan.sessions_error:
+        raise RuntimeError(plan.sessions_error)
+
+    if cohort_id is not None and plan.sessions_upcoming_cohort is not None:
+        sql, params = plan.sessions_upcoming_cohort, [cohort_id, limit]
+    else:
+        sql, params = plan.sessions_upcoming, [limit]
     rows = con.execute(sql, params).fetchall()
     return [dict(r) for r in rows]
 
 
-def _select_from_events(con: sqlite3.Connection, *, cohort_id: Optional[int], limit: int) -> List[Dict[str, Any]]:
-    cols = _cols(con, "events")
-    id_col = "id"
-    date_col = _pick(cols, ["date", "event_date", "start", "start_date"]) or "date"
-    title_col = _pick(cols, ["title", "name"])
-    ann_col = _pick(cols, ["annotation", "ann", "description", "desc"])
-    cohort_col = _pick(cols, ["cohort_id", "stream_id"])
-
-    where = f"date({date_col}) >= date('now')"
-    params: List[Any] = []
-    if cohort_id is not None and cohort_col is not None:
-        where += f" AND {cohort_col}=?"
-        params.append(cohort_id)
-
-    select_cols = [f"{id_col} AS id",
-                   f"{date_col} AS start_date",
-                   f"{date_col} AS end_date"]
-    select_cols.append(f"{title_col} AS title" if title_col else "NULL AS title")
-    select_cols.append(f"{ann_col} AS annotation" if ann_col else "'' AS annotation")
-    select_cols.append("NULL AS topic_code")
-
-    sql = f"""
-        SELECT {', '.join(select_cols)}
-        FROM events
-        WHERE {where}
-        ORDER BY {date_col}
-        LIMIT ?
-    """
-    params.append(limit)
+def _select_from_events(con: sqlite3.Connection, plan: _SchemaPlan, *, cohort_id: Optional[int], limit: int) -> List[Dict[str, Any]]:
+    if cohort_id is not None and plan.events_upcoming_cohort is not None:
+        sql, params = plan.events_upcoming_cohort, [cohort_id, limit]
+    else:
+        sql, params = plan.events_upcoming, [limit]
     rows = con.execute(sql, params).fetchall()
     return [dict(r) for r in rows]
 
 
+def _resolve_cohort_id(con, tg_id: int) -> Optional[int]:
+    row = con.execute(
+        """
+        WITH u AS (SELECT id, cohort_id
+                   FROM users
+                   WHERE telegram_id = ?
+                   LIMIT 1),
+             p AS (SELECT cohort_id
+                   FROM participants
+                   WHERE user_id=(SELECT id FROM u LIMIT 1)
+                   ORDER BY id DESC
+                   LIMIT 1)
+        SELECT COALESCE(p.cohort_id, u.cohort_id) AS cohort_id
+        FROM u LEFT JOIN p ON 1=1
+        """,
+        (tg_id,),
+    ).fetchone()
+    if row and row["cohort_id"] not in (None, ""):
+        return int(row["cohort_id"])
+    return None
+
+
+def _select_before_session_days(con, plan: "_SchemaPlan", cohort_id: Optional[int], limit: int) -> List[Dict[str, Any]]:
+    # 1) sessions → 2) events: первый непустой набор
+    if "sessions" in plan.tables:
+        rows = _select_from_sessions(con, plan, cohort_id=cohort_id, limit=limit)
+        if rows:
+            return rows
+    if "events" in plan.tables:
+        rows = _select_from_events(con, plan, cohort_id=cohort_id, limit=limit)
+        if rows:
+            return rows
+    return []
+
+
+def get_upcoming_from_sessions_events(*, limit: int = 5, tg_id: Optional[int] = None,
+                                      cohort_id: Optional[int] = None) -> Tuple[Optional[int], List[Dict[str, Any]]]:
+    """
+    То, что get_upcoming_sessions проверяет раньше session_days: (поток, строки sessions/events).
+    С tg_id поток определяется так же (participants, затем users.cohort_id); пустой список —
+    отвечает индекс расписания (session_days/session_blocks) для этого потока.
+    """
+    with get_db_connection(readonly=True) as con:
+        con.row_factory = sqlite3.Row
+        if tg_id is not None:
+            cohort_id = _resolve_cohort_id(con, tg_id)
+        return cohort_id, _select_before_session_days(con, _get_plan(con), cohort_id, limit)
+
+
 def get_upcoming_sessions(*, limit: int = 5, tg_id: Optional[int] = None) -> List[Dict[str, Any]]:
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
 
         # определяем поток пользователя (если нужно фильтровать)
-        cohort_id = None
-        if tg_id is not None:
-            row = con.execute(
-                """
-                WITH u AS (SELECT id, cohort_id
-                           FROM users
-                           WHERE telegram_id = ?
-                           LIMIT 1),
-                     p AS (SELECT cohort_id
-                           FROM participants
-                           WHERE user_id=(SELECT id FROM u LIMIT 1)
-                           ORDER BY id DESC
-                           LIMIT 1)
-                SELECT COALESCE(p.cohort_id, u.cohort_id) AS cohort_id
-                FROM u LEFT JOIN p ON 1=1
-                """,
-                (tg_id,),
-            ).fetchone()
-            if row and row["cohort_id"] not in (None, ""):
-                cohort_id = int(row["cohort_id"])
+        cohort_id = _resolve_cohort_id(con, tg_id) if tg_id is not None else None
 
         # 1) sessions → 2) events → 3) session_days
         # пробуем по очереди и возвращаем первый непустой набор
-        if _table_exists(con, "sessions"):
-            rows = _select_from_sessions(con, cohort_id=cohort_id, limit=limit)
-            if rows:
-                return rows
-
-        if _table_exists(con, "events"):
-            rows = _select_from_events(con, cohort_id=cohort_id, limit=limit)
-            if rows:
-                return rows
+        plan = _get_plan(con)
+        rows = _select_before_session_days(con, plan, cohort_id, limit)
+        if rows:
+            return rows
 
-        if _table_exists(con, "session_days"):
-            rows = _select_from_session_days(con, cohort_id=cohort_id, limit=limit)
+        if "session_days" in plan.tables:
+            rows = _select_from_session_days(con, plan, cohort_id=cohort_id, limit=limit)
             if rows:
                 return rows
 
@@ -373,64 +533,28 @@ def get_upcoming_sessions(*, limit: int = 5, tg_id: Optional[int] = None) -> Lis
 
 
 def get_session_by_id(session_id: int) -> Optional[Dict[str, Any]]:
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
+        plan = _get_plan(con)
+
+        if plan.sessions_by_id is not None:
+            row = con.execute(plan.sessions_by_id, (session_id,)).fetchone()
+            if row:
+                return dict(row)
 
-        if _table_exists(con, "sessions"):
-            cols = _cols(con, "sessions")
-            id_col = "id"
-            start_col = _pick(cols, ["start_date", "start", "date"])
-            end_col = _pick(cols, ["end_date", "end", "date"])
-            topic_col = _pick(cols, ["topic_code", "code", "topic"])
-            title_col = _pick(cols, ["title", "name"])
-            ann_col = _pick(cols, ["annotation", "ann", "description", "desc"])
-            select_cols = [
-                f"{id_col} AS id",
-                f"{start_col} AS start_date",
-                f"{(end_col or start_col)} AS end_date",
-                (f"{topic_col} AS topic_code" if topic_col else "NULL AS topic_code"),
-                (f"{title_col} AS title" if title_col else "NULL AS title"),
-                (f"{ann_col} AS annotation" if ann_col else "'' AS annotation"),
-            ]
-            sql = f"SELECT {', '.join(select_cols)} FROM sessions WHERE {id_col}=? LIMIT 1"
-
-            row = con.execute(sql, (session_id,)).fetchone()
+        if plan.events_by_id is not None:
+            row = con.execute(plan.events_by_id, (session_id,)).fetchone()
             if row:
                 return dict(row)
 
-        if _table_exists(con, "events"):
-            cols = _cols(con, "events")
-            id_col = "id"
-            date_col = _pick(cols, ["date", "event_date", "start", "start_date"]) or "date"
-            title_col = _pick(cols, ["title", "name"])
-            ann_col = _pick(cols, ["annotation", "ann", "description", "desc"])
-            select_cols = [
-                f"{id_col} AS id",
-                f"{date_col} AS start_date",
-                f"{date_col} AS end_date",
-                (f"{title_col} AS title" if title_col else "NULL AS title"),
-                (f"{ann_col} AS annotation" if ann_col else "'' AS annotation"),
-                "NULL AS topic_code",
-            ]
-            sql = f"SELECT {', '.join(select_cols)} FROM events WHERE {id_col}=? LIMIT 1"
-            row = con.execute(sql, (session_id,)).fetchone()
+        if plan.sb_by_day_id is not None and session_blocks_fresh(con):
+            # границы блока — из session_blocks того же потока
+            row = con.execute(plan.sb_by_day_id, (session_id,)).fetchone()
             if row:
                 return dict(row)
 
-        if _table_exists(con, "session_days"):
-            cols = _cols(con, "session_days")
-            id_col = "id"
-            day_col = _pick(cols, ["day", "date", "day_date", "session_day"]) or "date"
-            topic_code_col = _pick(cols, ["topic_code", "code"])
-            topic_id_col = _pick(cols, ["topic_id"])
-
-            base = con.execute(
-                f"SELECT {id_col} AS id, {day_col} AS day, "
-                f"{(topic_code_col + ' AS topic_code') if topic_code_col else 'NULL AS topic_code'}, "
-                f"{(topic_id_col + ' AS topic_id') if topic_id_col else 'NULL AS topic_id'} "
-                f"FROM session_days WHERE {id_col}=? LIMIT 1",
-                (session_id,),
-            ).fetchone()
+        if plan.sd_by_id is not None:
+            base = con.execute(plan.sd_by_id, (session_id,)).fetchone()
             if not base:
                 return None
 
@@ -443,7 +567,7 @@ def get_session_by_id(session_id: int) -> Optional[Dict[str, Any]]:
 
             title = ""
             ann = ""
-            if _table_exists(con, "topics"):
+            if "topics" in plan.tables:
                 if topic_id is not None:
                     t = con.execute("SELECT code, title, annotation FROM topics WHERE id=?",
                                     (topic_id,)).fetchone()
@@ -457,10 +581,8 @@ def get_session_by_id(session_id: int) -> Optional[Dict[str, Any]]:
                     title = t["title"] or ""
                     ann = t["annotation"] or ""
 
-            prev = con.execute(f"SELECT 1 FROM session_days WHERE date({day_col})=date(?) LIMIT 1",
-                               ((bday - timedelta(days=1)).isoformat(),)).fetchone()
-            nxt = con.execute(f"SELECT 1 FROM session_days WHERE date({day_col})=date(?) LIMIT 1",
-                              ((bday + timedelta(days=1)).isoformat(),)).fetchone()
+            prev = con.execute(plan.sd_neighbour, ((bday - timedelta(days=1)).isoformat(),)).fetchone()
+            nxt = con.execute(plan.sd_neighbour, ((bday + timedelta(days=1)).isoformat(),)).fetchone()
 
             start_date = (bday - timedelta(days=1)).isoformat() if prev else bday.isoformat()
             end_date = (bday + timedelta(days=1)).isoformat() if nxt else bday.isoformat()
@@ -478,17 +600,18 @@ def get_session_by_id(session_id: int) -> Optional[Dict[str, Any]]:
 
 
 def get_upcoming_sessions_by_cohort(cohort_id: int | None, *, limit: int = 50) -> list[dict]:
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
         # 1) sessions → 2) events → 3) session_days (пошаговый фолбэк)
-        if _table_exists(con, "sessions"):
-            rows = _select_from_sessions(con, cohort_id=cohort_id, limit=limit)
+        plan = _get_plan(con)
+        if "sessions" in plan.tables:
+            rows = _select_from_sessions(con, plan, cohort_id=cohort_id, limit=limit)
             if rows: return rows
-        if _table_exists(con, "events"):
-            rows = _select_from_events(con, cohort_id=cohort_id, limit=limit)
+        if "events" in plan.tables:
+            rows = _select_from_events(con, plan, cohort_id=cohort_id, limit=limit)
             if rows: return rows
-        if _table_exists(con, "session_days"):
-            rows = _select_from_session_days(con, cohort_id=cohort_id, limit=limit)
+        if "session_days" in plan.tables:
+            rows = _select_from_session_days(con, plan, cohort_id=cohort_id, limit=limit)
             if rows: return rows
         return []
 
@@ -498,10 +621,11 @@ def get_nearest_session_text() -> str | None:
     Короткая строка «Ближайшее занятие: 13.09.2025 — 14.09.2025 • ПТГ-2».
     Берём самое раннее занятие независимо от потока.
     """
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
         # Попробуем через session_days, т.к. там точнее даты
-        if _table_exists(con, "session_days") and _table_exists(con, "topics"):
+        plan = _get_plan(con)
+        if "session_days" in plan.tables and "topics" in plan.tables:
             cur = con.execute("""
                               SELECT MIN(sd.date) AS start_date,
                                      MAX(sd.date) AS end_date,
@@ -530,7 +654,7 @@ def get_recent_past_sessions_by_cohort(cohort_id: int, limit: int = 5) -> List[D
     """
     Последние прошедшие занятия потока (по start_date <= today), новее – выше.
     """
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
         rows = con.execute(
             """
@@ -2,18 +2,16 @@
 # Назначение: Единая точка подключения к SQLite (синхронное и асинхронное) с поддержкой режима только чтение
 # Функции:
 # - _query_only_enabled - Проверка, включен ли режим только чтения (через переменную окружения CRM_DB_QUERY_ONLY)
-# - _apply_pragmas_sync - Применение PRAGMA для синхронного соединения
-# - _apply_pragmas_async - Применение PRAGMA для асинхронного соединения
-# - get_db_connection - Синхронное подключение к БД (с опциональным режимом только чтения)
-# - aget_db_connection - Асинхронное подключение к БД (с опциональным режимом только чтения)
+# - get_db_connection - Соединение из общего пула (читатель или писатель)
+# - aget_db_connection - То же, но аренда выполняется вне event loop (ожидание писателя не блокирует бота)
 # - ensure_schema - Идемпотентное создание базовых таблиц users, cohorts, consents (в режиме записи)
 from __future__ import annotations
 
+import asyncio
 import os
-import sqlite3
-import aiosqlite
 
 from crm2.config import get_settings
+from crm2.db.pool import PooledConnection, get_pool
 
 # Единый путь к БД (на Render → /var/data/crm.db)
 DB_PATH = get_settings().DB_PATH
@@ -24,63 +22,33 @@ def _query_only_enabled() -> bool:
     return os.getenv("CRM_DB_QUERY_ONLY", "1") == "1"
 
 
-def _apply_pragmas_sync(conn: sqlite3.Connection, *, query_only: bool) -> None:
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON;")
-    # Разделяем режимы: читательский/пишущий
-    conn.execute(f"PRAGMA query_only = {'ON' if query_only else 'OFF'};")
-    # Небольшие улучшения стабильности
-    conn.execute("PRAGMA journal_mode = WAL;")
-    conn.execute("PRAGMA synchronous = NORMAL;")
-
-
-async def _apply_pragmas_async(conn: aiosqlite.Connection, *, query_only: bool) -> None:
-    conn.row_factory = sqlite3.Row  # aiosqlite понимает sqlite3.Row как row_factory
-    await conn.execute("PRAGMA foreign_keys = ON;")
-    await conn.execute(f"PRAGMA query_only = {'ON' if query_only else 'OFF'};")
-    await conn.execute("PRAGMA journal_mode = WAL;")
-    await conn.execute("PRAGMA synchronous = NORMAL;")
-
-
-def get_db_connection(*, readonly: bool | None = None) -> sqlite3.Connection:
+def get_db_connection(*, readonly: bool | None = None) -> PooledConnection:
     """
-    Синхронное подключение.
+    Синхронное подключение из общего пула.
     readonly=None → берём режим из ENV CRM_DB_QUERY_ONLY (по умолчанию: только чтение).
     readonly=True/False → принудительно переопределяем.
     """
     if readonly is None:
         readonly = _query_only_enabled()
-    conn = sqlite3.connect(DB_PATH)
-    _apply_pragmas_sync(conn, query_only=readonly)
-    return conn
+    return get_pool(DB_PATH).acquire(readonly=readonly)
 
 
-async def aget_db_connection(*, readonly: bool | None = None) -> aiosqlite.Connection:
+async def aget_db_connection(*, readonly: bool | None = None) -> PooledConnection:
     """
-    Асинхронное подключение (aiosqlite).
-    readonly=None → берём режим из ENV CRM_DB_QUERY_ONLY (по умолчанию: только чтение).
-    readonly=True/False → принудительно переопределяем.
+    Асинхронная аренда соединения из общего пула.
+    Само соединение синхронное: тяжёлые запросы выполняйте через asyncio.to_thread.
     """
-    if readonly is None:
-        readonly = _query_only_enabled()
-    conn = await aiosqlite.connect(DB_PATH)
-    await _apply_pragmas_async(conn, query_only=readonly)
-    return conn
+    return await asyncio.to_thread(get_db_connection, readonly=readonly)
 
 
 def ensure_schema() -> None:
     """
-    Идемпотентно создаёт базовые таблицы. ВАЖНО: всегда открываем соединение
-    во ВКЛАДЫВАЕМОМ режиме записи (query_only=OFF), чтобы схема точно создалась
+    Идемпотентно создаёт базовые таблицы. ВАЖНО: всегда берём соединение
+    писателя (query_only=OFF), чтобы схема точно создалась
     даже если ENV по умолчанию — только чтение.
     """
-    import os as _os
-    if not _os.path.exists(DB_PATH):
-        _os.makedirs(_os.path.dirname(DB_PATH), exist_ok=True)
-
-    # Здесь принудительно пишущий режим
-    with sqlite3.connect(DB_PATH) as conn:
-        _apply_pragmas_sync(conn, query_only=False)
+    # Здесь принудительно пишущий режим (каталог БД создаёт пул)
+    with get_db_connection(readonly=False) as conn:
         cur = conn.cursor()
 
         cur.execute("""
@@ -1,7 +1,8 @@
 # crm2/db/users.py
 # Назначение: Функции для работы с пользователями (CRUD операции)
 # Функции:
-# - get_db_connection - Получение синхронного соединения с БД (с row_factory=sqlite3.Row)
+# - get_db_connection - Получение соединения из общего пула (с row_factory=sqlite3.Row)
+# - _invalidate_cached - Сброс записи пользователя в кэше services/users после записи
 # - _row_to_dict - Преобразование строки sqlite3.Row в словарь
 # - list_users - Получение списка всех пользователей
 # - list_users_by_role - Получение пользователей по роли
@@ -15,18 +16,24 @@ import sqlite3
 from typing import Optional, List, Dict, Any
 
 from crm2.config import DB_PATH
+from crm2.db.pool import get_pool
 
 # ───────────────────────────────────────────────────────────────────────────────
 # ВСПОМОГАТЕЛЬНЫЕ
 # ───────────────────────────────────────────────────────────────────────────────
 
-def get_db_connection() -> sqlite3.Connection:
+def get_db_connection(*, readonly: bool = False):
     """
-    Открывает соединение с SQLite с row_factory=sqlite3.Row.
+    Соединение из общего пула с row_factory=sqlite3.Row
+    (readonly=True — читатель, иначе писатель).
     """
-    con = sqlite3.connect(DB_PATH)
-    con.row_factory = sqlite3.Row
-    return con
+    return get_pool(DB_PATH).acquire(readonly=readonly)
+
+
+def _invalidate_cached(telegram_id: int) -> None:
+    """Сброс записи в кэше пользователей crm2.services.users (импорт ленивый: services зависит от db, не наоборот)."""
+    from crm2.services.users import invalidate_user
+    invalidate_user(telegram_id)
 
 
 def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
@@ -42,35 +49,35 @@ def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
 
 def list_users() -> List[Dict[str, Any]]:
     """Возвращает список всех пользователей."""
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         rows = con.execute("SELECT * FROM users").fetchall()
         return [_row_to_dict(r) for r in rows]
 
 
 def list_users_by_role(role: str) -> List[Dict[str, Any]]:
     """Возвращает список пользователей по роли."""
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         rows = con.execute("SELECT * FROM users WHERE role = ?", (role,)).fetchall()
         return [_row_to_dict(r) for r in rows]
 
 
 def list_users_by_cohort(cohort_id: int) -> List[Dict[str, Any]]:
     """Возвращает список пользователей по cohort_id."""
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         rows = con.execute("SELECT * FROM users WHERE cohort_id = ?", (cohort_id,)).fetchall()
         return [_row_to_dict(r) for r in rows]
 
 
 def get_user_by_tg(telegram_id: int) -> Optional[Dict[str, Any]]:
     """Возвращает пользователя по telegram_id."""
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         row = con.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,)).fetchone()
         return _row_to_dict(row) if row else None
 
 
 def get_user_by_nickname(nickname: str) -> Optional[Dict[str, Any]]:
     """Возвращает пользователя по nickname."""
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         row = con.execute("SELECT * FROM users WHERE nickname = ?", (nickname,)).fetchone()
         return _row_to_dict(row) if row else None
 
@@ -80,6 +87,7 @@ def delete_user_by_tg(telegram_id: int) -> None:
     with get_db_connection() as con:
         con.execute("DELETE FROM users WHERE telegram_id = ?", (telegram_id,))
         con.commit()
+    _invalidate_cached(telegram_id)
 
 
 # ───────────────────────────────────────────────────────────────────────────────
@@ -127,6 +135,7 @@ def upsert_user(
                 params.append(telegram_id)
                 con.execute(f"UPDATE users SET {', '.join(sets)} WHERE telegram_id = ?", params)
                 con.commit()
+                _invalidate_cached(telegram_id)
 
             return row[0]
 
@@ -149,5 +158,6 @@ def upsert_user(
             ),
         )
         con.commit()
+        _invalidate_cached(telegram_id)
         new_id = con.execute("SELECT id FROM users WHERE telegram_id = ?", (telegram_id,)).fetchone()[0]
         return new_id
@@ -68,14 +68,14 @@ def _row_to_dict(row: Row) -> dict:
 # ---- публичные функции -------------------------------------------------------
 
 def count_users(group_key: str) -> int:
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         cols = _users_columns(con)
         where = _where_for_group(group_key, cols)
         cur = con.execute(f"SELECT COUNT(*) FROM users WHERE {where}")
         return int(cur.fetchone()[0] or 0)
 
 def list_users(group_key: str, offset: int, limit: int) -> List[dict]:
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = Row
         cols = _users_columns(con)
         where = _where_for_group(group_key, cols)
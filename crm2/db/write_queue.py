@@ -0,0 +1,164 @@
+# crm2/db/write_queue.py
+# Назначение: Очередь мелких записей с групповым коммитом (group commit).
+#             Один фоновый task-писатель собирает накопившиеся запросы и выполняет их
+#             одной транзакцией на писателе пула: раз в несколько миллисекунд или по N запросов.
+#             Каждый вызывающий получает awaitable, который завершается после коммита его пачки.
+# Классы:
+# - WriteQueue - Асинхронная очередь записи к одному файлу БД
+# Функции:
+# - get_write_queue - Очередь для пути к БД (одна на путь и event loop)
+# - close_write_queues - Дописать хвост и остановить все очереди (при остановке бота)
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from crm2.db.pool import _env_int, get_pool
+
+log = logging.getLogger(__name__)
+
+# Окно накопления пачки (мс) и максимальный размер пачки (запросов)
+FLUSH_MS = _env_int("CRM_DB_WRITE_FLUSH_MS", 5)
+MAX_BATCH = _env_int("CRM_DB_WRITE_BATCH", 200)
+
+# (sql, params, many, future)
+_Item = Tuple[str, Any, bool, "asyncio.Future"]
+
+
+class WriteQueue:
+    """
+    Очередь записи к одному файлу БД.
+    Ошибка отдельного запроса (нарушение ограничения и т.п.) откатывается до его SAVEPOINT
+    и возвращается только этому вызывающему; остальные запросы пачки коммитятся.
+    """
+
+    def __init__(self, db_path: str, *, flush_ms: int = FLUSH_MS, max_batch: int = MAX_BATCH):
+        self.db_path = str(db_path)
+        self.flush_s = max(0, flush_ms) / 1000
+        self.max_batch = max(1, max_batch)
+        self.loop = asyncio.get_running_loop()
+        self._q: "asyncio.Queue[Optional[_Item]]" = asyncio.Queue()
+        self._task = self.loop.create_task(self._run(), name=f"db-write-queue:{os.path.basename(self.db_path)}")
+        self._closed = False
+        # счётчики для диагностики
+        self.batches = 0
+        self.statements = 0
+
+    # ---------- публичный API ----------
+
+    def submit(self, sql: str, params: Sequence[Any] = ()) -> "asyncio.Future[int]":
+        """Поставить запрос в очередь. Future → rowcount после коммита."""
+        return self._put(sql, tuple(params), False)
+
+    def submit_many(self, sql: str, seq_of_params: Iterable[Sequence[Any]]) -> "asyncio.Future[int]":
+        """То же для executemany (все наборы параметров — в одной пачке)."""
+        return self._put(sql, [tuple(p) for p in seq_of_params], True)
+
+    async def execute(self, sql: str, params: Sequence[Any] = ()) -> int:
+        return await self.submit(sql, params)
+
+    async def executemany(self, sql: str, seq_of_params: Iterable[Sequence[Any]]) -> int:
+        return await self.submit_many(sql, seq_of_params)
+
+    async def flush(self) -> None:
+        """Дождаться коммита всего, что уже поставлено в очередь."""
+        await self._put("SELECT 1", (), False)
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        await self._q.put(None)
+        await self._task
+
+    # ---------- внутреннее ----------
+
+    def _put(self, sql: str, params: Any, many: bool) -> "asyncio.Future[int]":
+        if self._closed:
+            raise RuntimeError(f"Write queue for {self.db_path} is closed.")
+        fut = self.loop.create_future()
+        self._q.put_nowait((sql, params, many, fut))
+        return fut
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = await self._q.get()
+            if item is None:
+                break
+            batch: List[_Item] = [item]
+            # даём набраться пачке, если очередь ещё не заполнена
+            if self._q.qsize() + 1 < self.max_batch and self.flush_s:
+                await asyncio.sleep(self.flush_s)
+            while len(batch) < self.max_batch:
+                try:
+                    nxt = self._q.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if nxt is None:
+                    stopping = True
+                    break
+                batch.append(nxt)
+
+            try:
+                results = await asyncio.to_thread(self._commit_batch, [(s, p, m) for s, p, m, _ in batch])
+            except Exception as e:  # коммит всей пачки не удался
+                log.error("[DB] write batch of %d failed: %s", len(batch), e)
+                results = [e] * len(batch)
+
+            self.batches += 1
+            self.statements += len(batch)
+            for (_, _, _, fut), res in zip(batch, results):
+                if fut.done():  # вызывающий уже отменил ожидание
+                    continue
+                if isinstance(res, BaseException):
+                    fut.set_exception(res)
+                else:
+                    fut.set_result(res)
+
+    def _commit_batch(self, batch: List[Tuple[str, Any, bool]]) -> List[Union[int, BaseException]]:
+        results: List[Union[int, BaseException]] = []
+        with get_pool(self.db_path).writer() as con:
+            # BEGIN IMMEDIATE: берём блокировку записи сразу, без апгрейда посреди пачки
+            con.execute("BEGIN IMMEDIATE")
+            for sql, params, many in batch:
+                con.execute("SAVEPOINT wq_item")
+                try:
+                    cur = con.executemany(sql, params) if many else con.execute(sql, params)
+                    results.append(cur.rowcount)
+                    con.execute("RELEASE wq_item")
+                except sqlite3.Error as e:
+                    con.execute("ROLLBACK TO wq_item")
+                    con.execute("RELEASE wq_item")
+                    results.append(e)
+        return results
+
+
+_QUEUES: Dict[str, WriteQueue] = {}
+
+
+def get_write_queue(db_path: Optional[str] = None) -> WriteQueue:
+    """
+    Очередь для пути к БД (без аргумента — crm2.config.DB_PATH).
+    Вызывать из работающего event loop: task-писатель создаётся лениво при первом обращении.
+    """
+    if db_path is None:
+        from crm2.config import DB_PATH as db_path
+    key = os.path.abspath(str(db_path))
+    loop = asyncio.get_running_loop()
+    wq = _QUEUES.get(key)
+    if wq is None or wq._closed or wq.loop is not loop:
+        wq = WriteQueue(key)
+        _QUEUES[key] = wq
+    return wq
+
+
+async def close_write_queues() -> None:
+    queues = list(_QUEUES.values())
+    _QUEUES.clear()
+    for wq in queues:
+        if wq.loop is asyncio.get_running_loop():
+            await wq.close()
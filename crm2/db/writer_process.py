@@ -0,0 +1,579 @@
+# crm2/db/writer_process.py
+# Назначение: Единственный процесс-писатель SQLite для кластера обработчиков (crm2/cluster.py).
+#             Процесс держит одно соединение на запись и принимает запросы по локальному Unix-сокету
+#             (multiprocessing.connection, authkey). Транзакция клиента эксклюзивна: первый запрос,
+#             открывший транзакцию, занимает писателя до COMMIT/ROLLBACK (или отключения клиента) —
+#             как блокировка записи SQLite, но без busy-ожиданий между процессами.
+#             Первое сообщение клиента задаёт роль соединения: «open» с путём к БД — клиент записи
+#             (своё соединение на запись и своя очередь транзакций на каждый файл БД, путь сверяется при
+#             подключении), «rate» — общий для всех обработчиков token bucket исходящих Telegram,
+#             «bus» — шина инвалидации кэшей между обработчиками (сообщение уходит всем, кроме отправителя).
+#             Ожидание занятого писателя ограничено таймаутом клиента (как busy_timeout SQLite),
+#             клиент не ждёт ответа бесконечно.
+#             RemoteConnection — соединение-писатель пула в процессе-обработчике: чтение вне транзакции
+#             идёт в локальное read-only соединение, запись и всё внутри транзакции — в процесс-писатель.
+# Классы:
+# - _WriteTarget - Соединение на запись к одному файлу БД и клиент, держащий его транзакцию
+# - _RateBucket - Общий лимит исходящих сообщений бота (выдача токенов обработчикам)
+# - WriterServer - Сервер процесса-писателя (поток на клиента, одна транзакция за раз на файл БД)
+# - RemoteRow - Строка ответа писателя с доступом по имени колонки (как sqlite3.Row)
+# - RemoteCursor - Курсор с результатом запроса, выполненного в процессе-писателе
+# - RemoteConnection - Писатель пула в процессе-обработчике (локальное чтение + удалённая запись)
+# - RateClient - Клиент общего token bucket (outbound.SharedTokenBucket)
+# Функции:
+# - _env_float - Чтение числа из переменной окружения
+# - _is_read - Можно ли выполнить запрос на локальном read-only соединении
+# - _reply - Ответ писателя с ограничением ожидания (None — писатель не ответил вовремя)
+# - _raise_remote - Поднять исключение, пришедшее из процесса-писателя, с исходным классом
+# - serve - Точка входа процесса-писателя
+from __future__ import annotations
+
+import builtins
+import logging
+import os
+import re
+import signal
+import sqlite3
+import threading
+import time
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from crm2.db.pool import BUSY_TIMEOUT_MS, _apply_pragmas
+
+log = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, ""))
+    except ValueError:
+        return default
+
+
+# Сколько (сверх ожидания писателя) ждать ответа на запрос — время выполнения самого запроса
+REPLY_TIMEOUT_S = _env_float("CRM_WRITER_REPLY_TIMEOUT_S", 30.0)
+
+_COMMENT_RE = re.compile(r"^\s*(?:--[^\n]*\n|/\*.*?\*/)\s*", re.S)
+_WRITE_RE = re.compile(r"\b(INSERT|UPDATE|DELETE|REPLACE)\b", re.I)
+
+
+def _is_read(sql: str) -> bool:
+    """SELECT/VALUES/EXPLAIN, WITH без DML и PRAGMA без присваивания — локально; остальное — писателю."""
+    text = sql
+    while True:
+        m = _COMMENT_RE.match(text)
+        if not m:
+            break
+        text = text[m.end():]
+    head = text.lstrip(" \t\r\n(").split(None, 1)
+    word = head[0].upper() if head else ""
+    if word in ("SELECT", "VALUES", "EXPLAIN"):
+        return True
+    if word == "WITH":
+        return not _WRITE_RE.search(text)
+    if word == "PRAGMA":
+        return "=" not in text
+    return False
+
+
+# ----------------- процесс-писатель -----------------
+class _WriteTarget:
+    """Соединение на запись к одному файлу БД; owner — клиент, чья транзакция сейчас открыта."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.con = sqlite3.connect(db_path, check_same_thread=False)
+        _apply_pragmas(self.con, query_only=False)
+        self.con.row_factory = None  # строки уходят клиенту кортежами
+        self.cond = threading.Condition()
+        self.owner: Optional[int] = None
+
+
+class _RateBucket:
+    """
+    Лимит Telegram считается на бота, поэтому токены выдаёт один процесс на все обработчики.
+    grant() не ждёт: возвращает (выдано, через сколько секунд будет следующий токен, остаток паузы).
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = max(0.1, rate)
+        self.capacity = max(1.0, burst)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def grant(self, want: int) -> Tuple[int, float, float]:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            paused = max(0.0, self._paused_until - now)
+            if paused > 0:
+                return 0, paused, paused
+            granted = min(max(0, int(want)), int(self._tokens))
+            self._tokens -= granted
+            wait = 0.0 if self._tokens >= 1.0 else (1.0 - self._tokens) / self.rate
+            return granted, wait, 0.0
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+            self._updated = time.monotonic()
+
+
+class WriterServer:
+    """
+    По одному соединению на запись на каждый файл БД. Клиент (процесс-обработчик) занимает его на время
+    своей транзакции: остальные клиенты этого файла ждут на условии (не дольше своего таймаута),
+    а не в busy_timeout SQLite.
+    """
+
+    def __init__(self, db_path: str, address: str, authkey: bytes,
+                 rate: float = 28.0, burst: float = 2.0):
+        self.db_path = os.path.realpath(str(db_path))
+        self.address = address
+        self.authkey = authkey
+        self._targets: Dict[str, _WriteTarget] = {self.db_path: _WriteTarget(self.db_path)}
+        self._targets_lock = threading.Lock()
+        self.rate = _RateBucket(rate, burst)
+        self._subscribers: Dict[Connection, threading.Lock] = {}
+        self._subs_lock = threading.Lock()
+        self._listener: Optional[Listener] = None
+        self.requests = 0
+
+    # ---------- запись ----------
+
+    def _target(self, db_path: str) -> _WriteTarget:
+        path = os.path.realpath(str(db_path))
+        with self._targets_lock:
+            target = self._targets.get(path)
+            if target is None:
+                target = self._targets[path] = _WriteTarget(path)
+                log.info("[DB-WRITER] serving %s", path)
+            return target
+
+    @staticmethod
+    def _take(target: _WriteTarget, client: int, wait: float) -> bool:
+        with target.cond:
+            if not target.cond.wait_for(lambda: target.owner is None or target.owner == client, wait):
+                return False
+            target.owner = client
+            return True
+
+    @staticmethod
+    def _drop(target: _WriteTarget, client: int, *, rollback: bool = False) -> None:
+        with target.cond:
+            if target.owner != client:
+                return
+            if rollback and target.con.in_transaction:
+                target.con.rollback()
+            target.owner = None
+            target.cond.notify()
+
+    def _handle(self, target: _WriteTarget, client: int, op: str, sql: Optional[str], params: Any,
+                wait: float) -> Tuple:
+        if not self._take(target, client, wait):
+            # транзакцию держит другой клиент дольше таймаута — как «database is locked» у SQLite
+            return ("err", "OperationalError", "database is locked", False)
+        con = target.con
+        try:
+            self.requests += 1
+            before = con.total_changes
+            rows: List[tuple] = []
+            names: Optional[List[str]] = None
+            rowcount, lastrowid = -1, None
+            if op == "execute":
+                cur = con.execute(sql, params)
+                if cur.description is not None:
+                    names = [d[0] for d in cur.description]
+                    rows = cur.fetchall()
+                rowcount, lastrowid = cur.rowcount, cur.lastrowid
+            elif op == "executemany":
+                cur = con.executemany(sql, params)
+                rowcount = cur.rowcount
+            elif op == "executescript":
+                con.executescript(sql)
+            elif op == "commit":
+                con.commit()
+            elif op == "rollback":
+                con.rollback()
+            else:
+                raise sqlite3.ProgrammingError(f"unknown writer op {op!r}")
+            return ("ok", rows, names, rowcount, lastrowid,
+                    con.total_changes - before, con.in_transaction)
+        except Exception as e:
+            return ("err", type(e).__name__, str(e), con.in_transaction)
+        finally:
+            # вне транзакции (autocommit, COMMIT, ROLLBACK, SELECT) писатель свободен для других
+            if not con.in_transaction:
+                self._drop(target, client)
+
+    def _serve_writes(self, conn: Connection, client: int, db_path: Any) -> None:
+        if not isinstance(db_path, str) or not db_path:
+            conn.send(("err", "ProgrammingError", "writer handshake without db_path", False))
+            return
+        try:
+            target = self._target(db_path)
+        except sqlite3.Error as e:
+            conn.send(("err", type(e).__name__, str(e), False))
+            return
+        conn.send(("ok", target.db_path))
+        try:
+            while True:
+                try:
+                    op, sql, params, wait = conn.recv()
+                except (EOFError, OSError):
+                    break
+                conn.send(self._handle(target, client, op, sql, params, wait))
+        finally:
+            # клиент отключился посреди транзакции — откатываем и освобождаем писателя
+            self._drop(target, client, rollback=True)
+
+    # ---------- общий лимит исходящих ----------
+
+    def _serve_rate(self, conn: Connection) -> None:
+        while True:
+            try:
+                op, value = conn.recv()
+            except (EOFError, OSError):
+                return
+            if op == "pause":
+                self.rate.pause(float(value))
+                value = 0
+            conn.send(self.rate.grant(int(value)))
+
+    # ---------- шина инвалидации кэшей ----------
+
+    def _serve_bus(self, conn: Connection) -> None:
+        with self._subs_lock:
+            self._subscribers[conn] = threading.Lock()
+        try:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+                with self._subs_lock:
+                    targets = [(c, lock) for c, lock in self._subscribers.items() if c is not conn]
+                for other, lock in targets:
+                    try:
+                        with lock:
+                            other.send(message)
+                    except (OSError, ValueError):
+                        pass  # подписчик отключается — его поток сам уберёт запись
+        finally:
+            with self._subs_lock:
+                self._subscribers.pop(conn, None)
+
+    def _client(self, conn: Connection, client: int) -> None:
+        try:
+            try:
+                first = conn.recv()
+            except (EOFError, OSError):
+                return
+            role = first[0] if isinstance(first, tuple) and first else None
+            if role == "open":
+                self._serve_writes(conn, client, first[2])
+            elif role == "rate":
+                self._serve_rate(conn)
+            elif role == "bus":
+                self._serve_bus(conn)
+            else:
+                conn.send(("err", "ProgrammingError", f"unknown writer handshake {role!r}", False))
+        finally:
+            conn.close()
+
+    def serve_forever(self) -> None:
+        self._listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        log.info("[DB-WRITER] listening on %s (%s)", self.address, self.db_path)
+        n = 0
+        while True:
+            try:
+                conn = self._listener.accept()
+            except OSError:  # listener закрыт в close()
+                break
+            except Exception as e:  # неверный authkey и т.п. — клиента не пускаем
+                log.warning("[DB-WRITER] rejected client: %s", e)
+                continue
+            n += 1
+            threading.Thread(target=self._client, args=(conn, n), name=f"db-writer-{n}", daemon=True).start()
+
+    def close(self) -> None:
+        if self._listener is not None:
+            self._listener.close()
+        with self._targets_lock:
+            for target in self._targets.values():
+                with target.cond:
+                    if target.con.in_transaction:
+                        target.con.rollback()
+                    target.con.close()
+
+
+def serve(db_path: str, address: str, authkey: bytes, rate: float = 28.0, burst: float = 2.0) -> None:
+    """Точка входа процесса-писателя: работает до SIGTERM от супервизора (Ctrl+C игнорирует —
+    обработчики должны успеть дописать очереди при остановке)."""
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").split("#", 1)[0].strip())
+    server = WriterServer(db_path, address, authkey, rate, burst)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: server.close())
+    try:
+        server.serve_forever()
+    finally:
+        log.info("[DB-WRITER] stopped after %d requests", server.requests)
+
+
+# ----------------- клиент (процесс-обработчик) -----------------
+def _reply(conn: Connection, timeout: float) -> Optional[Any]:
+    return conn.recv() if conn.poll(timeout) else None
+
+
+def _raise_remote(name: str, message: str) -> None:
+    exc = getattr(sqlite3, name, None) or getattr(builtins, name, None)
+    if not (isinstance(exc, type) and issubclass(exc, Exception)):
+        exc = sqlite3.Error
+    raise exc(message)
+
+
+class RemoteRow(tuple):
+    """Кортеж с доступом row['col'] (без учёта регистра), keys() и dict(row) — как sqlite3.Row."""
+
+    _names: Tuple[str, ...] = ()
+
+    def __new__(cls, names: Tuple[str, ...], values: Sequence[Any]):
+        row = super().__new__(cls, values)
+        row._names = names
+        return row
+
+    def keys(self) -> List[str]:
+        return list(self._names)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            low = key.lower()
+            for i, name in enumerate(self._names):
+                if name.lower() == low:
+                    return tuple.__getitem__(self, i)
+            raise IndexError("No item with that key")
+        return tuple.__getitem__(self, key)
+
+
+class RemoteCursor:
+    """Курсор: удалённый результат (строки уже получены) или локальный sqlite3.Cursor для чтения."""
+
+    arraysize = 1
+
+    def __init__(self, connection: "RemoteConnection"):
+        self.connection = connection
+        self._local: Optional[sqlite3.Cursor] = None
+        self._rows: List[Any] = []
+        self._pos = 0
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def _load(self, rows: List[Any], names: Optional[List[str]], rowcount: int, lastrowid: Optional[int]) -> None:
+        self._local = None
+        self.description = tuple((n, None, None, None, None, None, None) for n in names) if names else None
+        factory = self.connection.row_factory
+        if names and factory is sqlite3.Row:
+            keys = tuple(names)
+            rows = [RemoteRow(keys, r) for r in rows]
+        elif names and factory is not None:
+            rows = [factory(self, r) for r in rows]
+        self._rows, self._pos = rows, 0
+        self.rowcount, self.lastrowid = rowcount, lastrowid
+
+    def execute(self, sql: str, params: Any = ()) -> "RemoteCursor":
+        return self.connection._execute_into(self, sql, params)
+
+    def executemany(self, sql: str, seq_of_params: Any) -> "RemoteCursor":
+        return self.connection._executemany_into(self, sql, seq_of_params)
+
+    def fetchone(self) -> Any:
+        if self._local is not None:
+            return self._local.fetchone()
+        if self._pos >= len(self._rows):
+            return None
+        self._pos += 1
+        return self._rows[self._pos - 1]
+
+    def fetchmany(self, size: Optional[int] = None) -> List[Any]:
+        if self._local is not None:
+            return self._local.fetchmany(size or self.arraysize)
+        size = size or self.arraysize
+        chunk = self._rows[self._pos:self._pos + size]
+        self._pos += len(chunk)
+        return chunk
+
+    def fetchall(self) -> List[Any]:
+        if self._local is not None:
+            return self._local.fetchall()
+        rest = self._rows[self._pos:]
+        self._pos = len(self._rows)
+        return rest
+
+    def __iter__(self) -> Iterator[Any]:
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def close(self) -> None:
+        if self._local is not None:
+            self._local.close()
+        self._rows = []
+
+
+class RemoteConnection:
+    """
+    Писатель пула в процессе-обработчике (подменяет sqlite3.Connection, см. pool.configure_remote_writer).
+    Вне транзакции чтение выполняется локально (query_only); первый пишущий запрос открывает транзакцию
+    в процессе-писателе, и до commit()/rollback() все запросы идут туда — чтение видит свою запись.
+    total_changes считает только изменения этого соединения.
+    busy_timeout (с) — сколько писатель ждёт чужую транзакцию, прежде чем ответить «database is locked»;
+    ответа клиент ждёт не дольше busy_timeout + REPLY_TIMEOUT_S, потом переподключается.
+    """
+
+    def __init__(self, address: str, authkey: bytes, db_path: str):
+        self._address = address
+        self._authkey = authkey
+        self.db_path = os.path.abspath(str(db_path))
+        self.busy_timeout = BUSY_TIMEOUT_MS / 1000
+        self._conn: Optional[Connection] = None
+        self._connect()
+        self._local = sqlite3.connect(db_path, check_same_thread=False)
+        _apply_pragmas(self._local, query_only=True)
+        self._row_factory: Any = sqlite3.Row
+        self.in_transaction = False
+        self.total_changes = 0
+
+    def _connect(self) -> Connection:
+        """Подключение с рукопожатием: писатель открывает запись именно в этот файл БД."""
+        conn = Client(self._address, family="AF_UNIX", authkey=self._authkey)
+        conn.send(("open", None, self.db_path, 0.0))
+        reply = _reply(conn, REPLY_TIMEOUT_S)
+        if reply is None or reply[0] != "ok":
+            conn.close()
+            if reply is None:
+                raise sqlite3.OperationalError("database writer did not answer the handshake")
+            _raise_remote(reply[1], reply[2])
+        self._conn = conn
+        return conn
+
+    @property
+    def row_factory(self) -> Any:
+        return self._row_factory
+
+    @row_factory.setter
+    def row_factory(self, value: Any) -> None:
+        self._row_factory = value
+        self._local.row_factory = value
+
+    def _call(self, op: str, sql: Optional[str] = None, params: Any = ()) -> Tuple:
+        conn = self._conn or self._connect()
+        conn.send((op, sql, params, self.busy_timeout))
+        reply = _reply(conn, self.busy_timeout + REPLY_TIMEOUT_S)
+        if reply is None:
+            # ответ может прийти позже и сбить очередность — соединение бросаем; писатель откатит
+            # незавершённую транзакцию, когда заметит отключение
+            conn.close()
+            self._conn = None
+            self.in_transaction = False
+            raise sqlite3.OperationalError(
+                f"database writer did not reply in {self.busy_timeout + REPLY_TIMEOUT_S:.0f}s")
+        if reply[0] == "err":
+            self.in_transaction = reply[3]
+            _raise_remote(reply[1], reply[2])
+        _, rows, names, rowcount, lastrowid, changes, in_tx = reply
+        self.total_changes += changes
+        self.in_transaction = in_tx
+        return rows, names, rowcount, lastrowid
+
+    def _execute_into(self, cur: RemoteCursor, sql: str, params: Any) -> RemoteCursor:
+        if not self.in_transaction and _is_read(sql):
+            cur._local = self._local.execute(sql, params)
+            cur.description = cur._local.description
+            cur.rowcount, cur.lastrowid = cur._local.rowcount, None
+            return cur
+        cur._load(*self._call("execute", sql, params))
+        return cur
+
+    def _executemany_into(self, cur: RemoteCursor, sql: str, seq_of_params: Any) -> RemoteCursor:
+        params = [tuple(p) if not isinstance(p, dict) else p for p in seq_of_params]
+        cur._load(*self._call("executemany", sql, params))
+        return cur
+
+    # --- интерфейс sqlite3.Connection, используемый в проекте ---
+    def cursor(self) -> RemoteCursor:
+        return RemoteCursor(self)
+
+    def execute(self, sql: str, params: Any = ()) -> Any:
+        if not self.in_transaction and _is_read(sql):
+            return self._local.execute(sql, params)
+        return self._execute_into(RemoteCursor(self), sql, params)
+
+    def executemany(self, sql: str, seq_of_params: Any) -> RemoteCursor:
+        return self._executemany_into(RemoteCursor(self), sql, seq_of_params)
+
+    def executescript(self, script: str) -> RemoteCursor:
+        self._call("executescript", script)
+        return RemoteCursor(self)
+
+    def commit(self) -> None:
+        if self.in_transaction:
+            self._call("commit")
+
+    def rollback(self) -> None:
+        if self.in_transaction:
+            self._call("rollback")
+
+    def __enter__(self) -> "RemoteConnection":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def close(self) -> None:
+        try:
+            self.rollback()
+        except Exception:
+            pass
+        if self._conn is not None:
+            self._conn.close()
+        self._local.close()
+
+
+class RateClient:
+    """Токены общего лимита исходящих из процесса-писателя (см. _RateBucket). Вызовы не ждут токенов."""
+
+    def __init__(self, address: str, authkey: bytes):
+        self._conn = Client(address, family="AF_UNIX", authkey=authkey)
+        self._conn.send(("rate",))
+        self._lock = threading.Lock()
+
+    def _ask(self, op: str, value: float) -> Tuple[int, float, float]:
+        with self._lock:
+            self._conn.send((op, value))
+            reply = _reply(self._conn, REPLY_TIMEOUT_S)
+        if reply is None:
+            raise OSError("rate limiter did not reply")
+        return reply
+
+    def grant(self, want: int = 1) -> Tuple[int, float, float]:
+        """(выдано токенов, через сколько секунд спросить снова, остаток общей паузы)."""
+        return self._ask("grant", want)
+
+    def pause(self, seconds: float) -> Tuple[int, float, float]:
+        """TelegramRetryAfter касается всего бота — пауза для всех обработчиков."""
+        return self._ask("pause", seconds)
+
+    def close(self) -> None:
+        self._conn.close()
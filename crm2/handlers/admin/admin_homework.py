@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 import asyncio
-import logging
 from typing import Iterable
 
 # crm2/handlers/admin/admin_homework.py
@@ -68,8 +67,8 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKe
 from crm2.services.attendance import (
     get_sessions_near,
     get_not_yet_delivered,
-    mark_homework_delivered,
 )
+from crm2.services.homework_pipeline import count_pending, create_job, start_homework
 
 router = Router()
 
@@ -162,26 +161,21 @@ async def hw_got_links(message: Message, state: FSMContext):
         await message.answer("Не нашёл ссылок. Пришли строку(и) с URL.")
         return
 
-    # Кому слать: присутствовавшие и ещё не получавшие
-    user_ids = await get_not_yet_delivered(session_id)
-    if not user_ids:
+    # Кому слать: присутствовавшие и ещё не получавшие (anti-join в БД)
+    pending = await asyncio.to_thread(count_pending, session_id)
+    if not pending:
         await message.answer("Никто не отмечен «присутствовал», либо всем уже отправляли.")
         await state.clear()
         return
 
-    sent = 0
-    for uid in user_ids:
-        text = "📚 Домашнее задание:\n" + "\n".join(links)
-        try:
-            await message.bot.send_message(uid, text)
-            # отметим доставку (берём первую ссылку как «основную»)
-            await mark_homework_delivered(session_id, uid, link=links[0])
-            sent += 1
-            await asyncio.sleep(0.05)  # не душим API
-        except Exception as e:
-            logging.warning("HW delivery failed: user=%s err=%r", uid, e)
-
-    await message.answer(f"Готово: отправлено {sent} из {len(user_ids)} пользователям.")
+    # задание сохраняется в БД: отправка идёт фоном параллельно (лимиты — общий планировщик исходящих)
+    # и продолжится после рестарта; итог придёт отдельным сообщением
+    job_id, created = await asyncio.to_thread(create_job, session_id, links, message.from_user.id)
+    start_homework(message.bot, job_id, notify_chat=message.from_user.id)
+    if created:
+        await message.answer(f"Отправляю ДЗ {pending} пользователям (задание #{job_id}). Итог пришлю отдельно.")
+    else:
+        await message.answer(f"По этому занятию уже идёт отправка (задание #{job_id}), жду её завершения.")
     await state.clear()
     # назад к карточке занятия
     await message.answer(f"Занятие #{session_id}.", reply_markup=_session_actions_kb(session_id))
@@ -377,7 +377,7 @@ async def set_attendance_status(cq: CallbackQuery):
                 # Если выбран статус "Не отмечен", удаляем запись
                 if existing:
                     print("🗑️ Удаляем запись (статус 'Не отмечен')...")
-                    await db.execute(
+                    await db.execute_batched(
                         "DELETE FROM attendance WHERE user_id = ? AND session_id = ?",
                         (student_id, session_id)
                     )
@@ -385,14 +385,14 @@ async def set_attendance_status(cq: CallbackQuery):
                 if existing:
                     # Обновляем существующую запись
                     print("🔄 Обновляем существующую запись...")
-                    await db.execute(
+                    await db.execute_batched(
                         "UPDATE attendance SET status = ? WHERE user_id = ? AND session_id = ?",
                         (status, student_id, session_id)
                     )
                 else:
                     # Создаем новую запись
                     print("➕ Создаем новую запись...")
-                    await db.execute(
+                    await db.execute_batched(
                         "INSERT INTO attendance (user_id, session_id, status) VALUES (?, ?, ?)",
                         (student_id, session_id, status)
                     )
@@ -15,18 +15,28 @@
 # - no_attach - Подтверждение отсутствия файла
 # - with_attach - Обработка прикрепленного файла
 # - back_to_text - Возврат к редактированию текста
-# - do_send - Выполнение рассылки с троттлингом
+# - do_send - Создание рассылки (без недоступных получателей, если не выбрано «Включая недоступных»), панель прогресса и запуск фоновой отправки (services/broadcast_engine)
 # - cancel_bc - Отмена рассылки
 # - back_bc - Возврат к выбору аудитории
+# - bc_pause, bc_resume, bc_cancel - Кнопки панели прогресса рассылки
 from __future__ import annotations
-import asyncio, json, math
 from aiogram import Router, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import (Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton,
                            ReplyKeyboardRemove)
 from crm2.db.core import get_db_connection
+from crm2.services.broadcast_engine import (
+    cancel_broadcast,
+    enqueue_audience,
+    pause_broadcast,
+    resume_broadcast,
+    start_broadcast,
+)
+from crm2.services.broadcast_progress import format_progress, progress_kb
+from crm2.utils.guards import AdminOnly
 
 router = Router()
 
@@ -45,7 +55,7 @@ def audience_kb():
     ])
 
 def cohorts_kb():
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         rows = con.execute("SELECT id, name FROM cohorts ORDER BY id").fetchall()
     buttons = [[InlineKeyboardButton(text=r[1], callback_data=f"bc:c:{r[0]}")] for r in rows] or \
               [[InlineKeyboardButton(text="Без потоков", callback_data="bc:c:null")]]
@@ -56,6 +66,7 @@ def confirm_kb():
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="✅ Отправить", callback_data="bc:send"),
          InlineKeyboardButton(text="✏️ Править текст", callback_data="bc:edit")],
+        [InlineKeyboardButton(text="📨 Включая недоступных", callback_data="bc:send_all")],
         [InlineKeyboardButton(text="Отмена", callback_data="bc:cancel")]
     ])
 
@@ -128,7 +139,7 @@ async def back_to_text(cb: CallbackQuery, state: FSMContext):
     await cb.message.answer("Введите текст заново:")
     await cb.answer()
 
-@router.callback_query(BroadcastFSM.confirm, F.data == "bc:send")
+@router.callback_query(BroadcastFSM.confirm, F.data.in_({"bc:send", "bc:send_all"}))
 async def do_send(cb: CallbackQuery, state: FSMContext):
     from aiogram import Bot
     bot: Bot = cb.bot
@@ -137,6 +148,8 @@ async def do_send(cb: CallbackQuery, state: FSMContext):
     body = data.get("body") or ""
     file_id, mime = data.get("attachment_file_id"), data.get("attachment_mime")
     admin_tg = cb.from_user.id
+    # заблокировавших бота / удалённых (services/reachability) не включаем, если админ не попросил явно
+    skip_dead = cb.data != "bc:send_all"
 
     # 1) создаём запись рассылки
     with get_db_connection() as con:
@@ -147,74 +160,22 @@ async def do_send(cb: CallbackQuery, state: FSMContext):
         """, ("Рассылка", body, file_id, mime, audience, cohort_id, admin_tg))
         bc_id = cur.lastrowid
 
-        # 2) получатели
-        if audience == "all":
-            users = con.execute("SELECT telegram_id FROM users WHERE telegram_id IS NOT NULL").fetchall()
-        else:
-            users = con.execute("""
-               SELECT u.telegram_id
-               FROM users u
-               WHERE (u.cohort_id IS ? OR u.cohort_id = ?) AND u.telegram_id IS NOT NULL
-            """, (None if cohort_id is None else None, cohort_id)).fetchall()
-        users = [u[0] for u in users]
-        cur.executemany("INSERT OR IGNORE INTO broadcast_recipients(broadcast_id, user_id) VALUES(?,?)",
-                        [(bc_id, uid) for uid in users])
+        # 2) получатели — одним INSERT … SELECT внутри БД; отправка читает их пачками (keyset)
+        total = enqueue_audience(con, bc_id, audience, cohort_id, skip_unreachable=skip_dead)
+        # в той же транзакции: после рестарта рассылка продолжится с queued-строк
+        cur.execute("UPDATE broadcasts SET status='sending' WHERE id=?", (bc_id,))
         con.commit()
 
-    total = len(users)
     if total == 0:
         await cb.message.answer("Получателей нет.")
         await cb.answer(); return
 
-    await cb.message.answer(f"Отправляю ({total} получателей)… Это может занять немного времени.")
-
-    # 3) отправка (мягкий троттлинг)
-    sent = failed = 0
-    for i, uid in enumerate(users, 1):
-        try:
-            if file_id:
-                if mime and mime.startswith("image/"):
-                    await bot.send_photo(uid, file_id, caption=body)
-                elif mime and mime.startswith("video/"):
-                    await bot.send_video(uid, file_id, caption=body)
-                elif mime and (mime.startswith("audio/") or mime == "audio/mpeg"):
-                    await bot.send_audio(uid, file_id, caption=body)
-                else:
-                    await bot.send_document(uid, file_id, caption=body)
-            else:
-                await bot.send_message(uid, body)
-            status, err = "sent", None
-            sent += 1
-        except Exception as e:
-            status, err = "failed", str(e)[:300]
-            failed += 1
-
-        # записываем статус
-        with get_db_connection() as con:
-            con.execute("""
-              UPDATE broadcast_recipients
-              SET status=?, error=?, sent_at=CURRENT_TIMESTAMP
-              WHERE broadcast_id=? AND user_id=?
-            """, (status, err, bc_id, uid))
-            con.commit()
-
-        # троттлинг: ~20/сек (0.05с)
-        if i % 20 == 0:
-            await asyncio.sleep(1.0)
-        else:
-            await asyncio.sleep(0.05)
-
-    # 4) финал
-    stats = {"total": total, "sent": sent, "failed": failed}
-    with get_db_connection() as con:
-        con.execute("""
-          UPDATE broadcasts
-          SET status='done', sent_at=CURRENT_TIMESTAMP, stats_json=?
-          WHERE id=?
-        """, (json.dumps(stats, ensure_ascii=False), bc_id))
-        con.commit()
-
-    await cb.message.answer(f"Готово. Отправлено: {sent}/{total}. Ошибок: {failed}.")
+    # 3) отправка — фоновым движком: общий лимит скорости бота, RetryAfter, возобновление после рестарта;
+    #    это сообщение движок будет редактировать как панель прогресса
+    panel = await cb.message.answer(
+        format_progress(bc_id, {"total": total}, "sending"), reply_markup=progress_kb(bc_id, "sending")
+    )
+    start_broadcast(bot, bc_id, notify_chat=admin_tg, panel_chat=panel.chat.id, panel_message=panel.message_id)
     await state.clear()
     await cb.answer()
 
@@ -229,3 +190,27 @@ async def back_bc(cb: CallbackQuery, state: FSMContext):
     await state.set_state(BroadcastFSM.audience)
     await cb.message.answer("Выберите аудиторию:", reply_markup=audience_kb())
     await cb.answer()
+
+# --- панель прогресса: пауза / продолжить / отмена ---
+
+@router.callback_query(F.data.startswith("bcp:pause:"), AdminOnly())
+async def bc_pause(cb: CallbackQuery):
+    ok = await pause_broadcast(int(cb.data.split(":")[2]))
+    await cb.answer("Пауза" if ok else "Рассылка уже не идёт")
+
+@router.callback_query(F.data.startswith("bcp:resume:"), AdminOnly())
+async def bc_resume(cb: CallbackQuery):
+    bc_id = int(cb.data.split(":")[2])
+    ok = await resume_broadcast(cb.bot, bc_id, notify_chat=cb.from_user.id,
+                                panel_chat=cb.message.chat.id, panel_message=cb.message.message_id)
+    await cb.answer("Продолжаю" if ok else "Рассылка уже завершена")
+
+@router.callback_query(F.data.startswith("bcp:cancel:"), AdminOnly())
+async def bc_cancel(cb: CallbackQuery):
+    bc_id = int(cb.data.split(":")[2])
+    stats = await cancel_broadcast(bc_id)
+    try:  # если рассылка шла, панель уже обновил движок; после рестарта — обновляем здесь
+        await cb.message.edit_text(format_progress(bc_id, stats, "cancelled"))
+    except TelegramBadRequest:
+        pass
+    await cb.answer("Рассылка отменена")
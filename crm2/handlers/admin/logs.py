@@ -42,7 +42,7 @@ def safe_json_parse(json_str: str) -> dict:
 async def logs_overview(cb: CallbackQuery):
     """Показ последних рассылок с их статистикой"""
     try:
-        with get_db_connection() as con:
+        with get_db_connection(readonly=True) as con:
             last_bc = con.execute("""
                                   SELECT id,
                                          title,
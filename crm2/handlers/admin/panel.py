@@ -15,6 +15,7 @@ import logging
 # - go_schedule - Переход в раздел расписания (заглушка)
 # - go_users - Переход в раздел пользователей (заглушка)
 # - go_db - Переход в раздел базы данных (заглушка)
+# - go_unreachable - Переход к списку недоступных получателей
 #handlers/
 #├── admin/                    # Актуальные обработчики админ-панели
 #│   ├── attendance.py        # ✅ ОБНОВЛЕН - использует users.cohort_id
@@ -47,16 +48,15 @@ from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from crm2.services.users import get_user_by_telegram
 
 logger = logging.getLogger(__name__)
 router = Router(name="admin_panel")
 
 
 @router.message(F.text == "⚙️ Админ")
-async def handle_admin_button(message: Message):
+async def handle_admin_button(message: Message, user: dict | None = None):
     """Обработчик кнопки Админ из главного меню"""
-    u = await get_user_by_telegram(message.from_user.id)
+    u = user
     if not u or u.get("role") != "admin":
         await message.answer("⛔️ Доступ только для админов.")
         return
@@ -72,9 +72,10 @@ def _admin_kb() -> InlineKeyboardBuilder:
     kb.button(text="👥 Пользователи", callback_data="admin:users")
     kb.button(text="🗄 База", callback_data="admin:db")
     kb.button(text="📊 Логи рассылок", callback_data="admin:logs")
+    kb.button(text="🚫 Недоступные", callback_data="admin:unreachable")
     kb.button(text="🤖 ChatGPT статус", callback_data="admin:chatgpt")
     kb.button(text="⬅️ В главное меню", callback_data="admin:back_main")
-    kb.adjust(2, 2, 2, 2)
+    kb.adjust(2, 2, 2, 2, 1)
     return kb
 
 
@@ -83,8 +84,8 @@ async def open_admin_menu(message: Message) -> None:
 
 
 @router.message(Command("admin"))
-async def cmd_admin(message: Message):
-    u = await get_user_by_telegram(message.from_user.id)
+async def cmd_admin(message: Message, user: dict | None = None):
+    u = user
     if not u or (u.get("role") != "admin"):
         await message.answer("⛔️ Доступ только для админов.")
         return
@@ -145,4 +146,11 @@ async def go_logs(cq: CallbackQuery):
 async def go_chatgpt(cq: CallbackQuery):
     await cq.answer()
     from crm2.handlers.admin.chatgpt import admin_chatgpt_entry
-    await admin_chatgpt_entry(cq.message)
\ No newline at end of file
+    await admin_chatgpt_entry(cq.message)
+
+
+@router.callback_query(F.data == "admin:unreachable")
+async def go_unreachable(cq: CallbackQuery):
+    await cq.answer()
+    from crm2.handlers.admin.reachability import unreachable_entry
+    await unreachable_entry(cq)
@@ -0,0 +1,118 @@
+# crm2/handlers/admin/reachability.py
+# Назначение: Админ-просмотр недоступных получателей (заблокировали бота, удалили аккаунт, чат не найден)
+#             со сбросом отметки по одному или всех сразу и разметкой по старым ошибкам рассылок.
+# Функции:
+# - _human_reason - Читаемая причина недоступности
+# - _page_kb - Клавиатура страницы: сброс по получателю, пагинация, общие действия
+# - _render - Текст и клавиатура страницы списка
+# - unreachable_entry - Вход в раздел (из админ-панели)
+# Обработчики:
+# - unreachable_page - Пагинация
+# - unreachable_reset_one - Сброс отметки у получателя
+# - unreachable_reset_all - Сброс всех отметок
+# - unreachable_backfill - Разметка по ошибкам прошлых рассылок
+# - unreachable_back - Возврат в админ-панель
+import asyncio
+
+from aiogram import Router, F
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+
+from crm2.services.reachability import (
+    REASON_HUMAN,
+    backfill_from_broadcasts,
+    count_unreachable,
+    list_unreachable,
+    reset_reachability,
+)
+from crm2.utils.guards import AdminOnly
+
+router = Router(name="admin_reachability")
+router.callback_query.filter(AdminOnly())
+
+PAGE_SIZE = 10
+
+
+def _human_reason(reason: str | None) -> str:
+    return REASON_HUMAN.get(reason or "", reason or "—")
+
+
+def _page_kb(rows: list[dict], page: int, pages: int) -> InlineKeyboardMarkup:
+    buttons = [
+        [InlineKeyboardButton(
+            text=f"♻️ {r.get('full_name') or r.get('nickname') or r['telegram_id']}",
+            callback_data=f"unr:reset:{r['telegram_id']}:{page}",
+        )]
+        for r in rows
+    ]
+    nav = []
+    if page > 1:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=f"unr:page:{page - 1}"))
+    if page < pages:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=f"unr:page:{page + 1}"))
+    if nav:
+        buttons.append(nav)
+    buttons.append([InlineKeyboardButton(text="🔎 Разметить по логам рассылок", callback_data="unr:backfill")])
+    if rows:
+        buttons.append([InlineKeyboardButton(text="♻️ Сбросить всех", callback_data="unr:reset_all")])
+    buttons.append([InlineKeyboardButton(text="↩️ Назад", callback_data="unr:back")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+async def _render(page: int) -> tuple[str, InlineKeyboardMarkup]:
+    total = await asyncio.to_thread(count_unreachable)
+    pages = max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)
+    page = max(1, min(page, pages))
+    rows = await asyncio.to_thread(list_unreachable, (page - 1) * PAGE_SIZE, PAGE_SIZE)
+
+    lines = [f"🚫 Недоступные получатели: {total}",
+             "Не включаются в рассылки и ДЗ. ♻️ — снова считать доступным.", ""]
+    for r in rows:
+        name = r.get("full_name") or (f"@{r['nickname']}" if r.get("nickname") else "—")
+        lines.append(f"• {name} ({r['telegram_id']}) — {_human_reason(r['reason'])}, {r['failed_at'] or '—'}")
+    if not rows:
+        lines.append("Список пуст.")
+    return "\n".join(lines), _page_kb(rows, page, pages)
+
+
+async def unreachable_entry(cq: CallbackQuery, page: int = 1) -> None:
+    text, kb = await _render(page)
+    try:
+        await cq.message.edit_text(text, reply_markup=kb)
+    except TelegramBadRequest:
+        await cq.message.answer(text, reply_markup=kb)
+
+
+@router.callback_query(F.data.startswith("unr:page:"))
+async def unreachable_page(cq: CallbackQuery):
+    await unreachable_entry(cq, int(cq.data.split(":")[2]))
+    await cq.answer()
+
+
+@router.callback_query(F.data.startswith("unr:reset:"))
+async def unreachable_reset_one(cq: CallbackQuery):
+    _, _, tg_id, page = cq.data.split(":")
+    await asyncio.to_thread(reset_reachability, int(tg_id))
+    await unreachable_entry(cq, int(page))
+    await cq.answer("Отметка снята")
+
+
+@router.callback_query(F.data == "unr:reset_all")
+async def unreachable_reset_all(cq: CallbackQuery):
+    n = await asyncio.to_thread(reset_reachability, None)
+    await unreachable_entry(cq)
+    await cq.answer(f"Сброшено: {n}")
+
+
+@router.callback_query(F.data == "unr:backfill")
+async def unreachable_backfill(cq: CallbackQuery):
+    n = await asyncio.to_thread(backfill_from_broadcasts)
+    await unreachable_entry(cq)
+    await cq.answer(f"Помечено по логам: {n}")
+
+
+@router.callback_query(F.data == "unr:back")
+async def unreachable_back(cq: CallbackQuery):
+    from crm2.handlers.admin.panel import open_admin_menu
+    await open_admin_menu(cq.message)
+    await cq.answer()
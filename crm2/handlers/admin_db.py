@@ -10,7 +10,7 @@ from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
 
-from crm2.db.sqlite import DB_PATH
+from crm2.db.sqlite import get_db_connection
 
 # Центральный роутер этого модуля; подключается из app.py через безопасный include.
 
@@ -20,7 +20,7 @@ router = Router(name="admin_db")
 @router.message(Command("db_sessions_info"))
 async def db_sessions_info(message: Message):
     # УПРОЩЁННО: без проверки роли
-    with sqlite3.connect(DB_PATH) as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
         cols = con.execute("PRAGMA table_info(sessions);").fetchall()
         cnt = con.execute("SELECT COUNT(*) AS c FROM sessions;").fetchone()["c"]
@@ -52,7 +52,7 @@ async def db_sessions_info(message: Message):
 @router.message(Command("db_fix_cohort"))
 async def db_fix_cohort(message: Message):
     # УПРОЩЁННО: без проверки роли
-    with sqlite3.connect(DB_PATH) as con:
+    with get_db_connection(readonly=False) as con:
         cur = con.cursor()
         cols = cur.execute("PRAGMA table_info(sessions);").fetchall()
         names = {c[1] for c in cols}  # c[1] = name
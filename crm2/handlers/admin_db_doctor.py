@@ -17,7 +17,9 @@ from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 from crm2.db.users import get_db_connection   # ВАЖНО: единая точка подключения
+from crm2.db.core import get_db_connection_async
 from crm2.db import auto_migrate
+from crm2.services.users import invalidate_user
 import sqlite3
 
 router = Router(name="admin_db_doctor")
@@ -49,7 +51,7 @@ async def show_menu(message: Message):
 @router.message(Command("db_sessions_info"))
 async def action_sessions_info(message: Message):
     try:
-        with get_db_connection() as con:
+        with get_db_connection(readonly=True) as con:
             con.row_factory = sqlite3.Row
             cur = con.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='sessions';")
             t = cur.fetchone()
@@ -79,7 +81,7 @@ async def action_sessions_info(message: Message):
 @router.message(Command("db_fix_cohort"))
 async def action_fix_sessions(message: Message):
     try:
-        with get_db_connection() as con:
+        with await get_db_connection_async() as con:
             auto_migrate.ensure_topics_and_session_days(con)
             con.commit()
         await message.answer("✅ Готово: <b>cohort_id</b> добавлен/обновлён, данные перенесены, индекс создан.")
@@ -93,7 +95,7 @@ async def action_fix_sessions(message: Message):
 @router.message(Command("db_indexes"))
 async def action_indexes(message: Message):
     try:
-        with get_db_connection() as con:
+        with get_db_connection(readonly=True) as con:
             con.row_factory = sqlite3.Row
             cur = con.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='sessions';")
             t = cur.fetchone()
@@ -120,9 +122,10 @@ async def action_indexes(message: Message):
 @router.message(F.text == BTN_BECOME_GUEST)
 async def action_become_guest(message: Message):
     try:
-        with get_db_connection() as con:
+        with await get_db_connection_async() as con:
             con.execute("DELETE FROM users WHERE telegram_id=?;", (message.from_user.id,))
             con.commit()
+        invalidate_user(message.from_user.id)
         await message.answer("✅ Вы полностью удалены из базы (гость).")
     except Exception as e:
         await message.answer(f"Ошибка: {e}")
@@ -133,7 +136,7 @@ async def action_become_guest(message: Message):
 async def action_become_user2(message: Message):
     try:
         tg_id = message.from_user.id
-        with get_db_connection() as con:
+        with await get_db_connection_async() as con:
             # Создаём минимальную запись, если не было (после «Стать гостем»)
             con.execute(
                 "INSERT OR IGNORE INTO users (telegram_id, role, full_name) VALUES (?, 'user', '');",
@@ -144,6 +147,7 @@ async def action_become_user2(message: Message):
                 (tg_id,),
             )
             con.commit()
+        invalidate_user(tg_id)
         await message.answer("✅ Ваша роль изменена: user, поток = 2.")
     except Exception as e:
         await message.answer(f"Ошибка: {e}")
@@ -114,7 +114,13 @@ async def handle_password_input(message: Message, state: FSMContext) -> None:
         return
 
     # Аутентифицируем пользователя
-    auth_result = await authenticate_user(username, password)
+    auth_result = await authenticate_user(username, password, user_id)
+
+    if auth_result.get('retry_after'):
+        await message.answer(
+            f"⏳ Слишком много попыток входа. Повторите через {int(auth_result['retry_after']) + 1} сек."
+        )
+        return
 
     if auth_result['success']:
         # Успешная аутентификация - обновляем telegram_id в БД
@@ -148,12 +154,21 @@ async def handle_password_input(message: Message, state: FSMContext) -> None:
         await handle_auth_start(message, state)
 
 
-from crm2.utils.password_utils import verify_and_upgrade_password
+from crm2.utils.password_pool import login_attempts, verify_and_upgrade_password_async
 from crm2.services.users import update_user_password
 
 
-async def authenticate_user(username: str, password: str) -> dict:
-    """Функция аутентификации пользователя через БД с проверкой хеша"""
+async def authenticate_user(username: str, password: str, telegram_id: int | None = None) -> dict:
+    """
+    Функция аутентификации пользователя через БД с проверкой хеша.
+    bcrypt выполняется в пуле процессов; попытки ограничены на telegram_id (иначе — на никнейм).
+    При превышении лимита возвращает {'success': False, 'retry_after': сек}.
+    """
+    limit_key = telegram_id if telegram_id is not None else f"nick:{username}"
+    retry_after = login_attempts.acquire(limit_key)
+    if retry_after:
+        logging.warning(f"⛔ Лимит попыток входа: {limit_key}")
+        return {'success': False, 'retry_after': retry_after}
     try:
         # Ищем пользователя в БД по nickname
         user = await get_user_by_nickname(username)
@@ -167,10 +182,11 @@ async def authenticate_user(username: str, password: str) -> dict:
             logging.info(f"📝 Введенный пароль: {password}")
 
             # Используем правильную проверку пароля с поддержкой bcrypt
-            success, new_hash = verify_and_upgrade_password(password, stored_password, user.get('id'))
+            success, new_hash = await verify_and_upgrade_password_async(password, stored_password)
 
             if success:
                 logging.info("✅ Аутентификация успешна")
+                login_attempts.reset(limit_key)
 
                 # Если пароль был в plain text и нужно обновить хеш
                 if new_hash != stored_password:
@@ -1,19 +1,21 @@
 # crm2/handlers/consent.py
 from __future__ import annotations
 
-import sqlite3
 from pathlib import Path
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 
+from crm2.db.pool import get_pool
+from crm2.services.users import invalidate_user
+
 router = Router(name="consent")
 
 
 def get_db_connection():
-    """Получение соединения с БД"""
+    """Получение соединения с БД (писатель из общего пула)"""
     db_path = Path(__file__).resolve().parent.parent / "data" / "crm.db"
-    return sqlite3.connect(db_path)
+    return get_pool(str(db_path)).acquire()
 
 
 @router.message(F.text.func(lambda t: t and t.lower() in {"согласие", "даю согласие", "consent"}))
@@ -34,6 +36,7 @@ async def accept_consent(update: Message | CallbackQuery):
 
         if cursor.rowcount > 0:
             conn.commit()
+            invalidate_user(user_id)
             success_text = "✅ Ваше согласие на обработку персональных данных зафиксировано."
         else:
             success_text = "❌ Пользователь не найден. Пожалуйста, завершите регистрацию."
@@ -22,9 +22,9 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import Message
 
 from crm2.keyboards import guest_start_kb, role_kb
-from crm2.services.users import get_user_by_telegram, update_user_password  # Импортируем update_user_password
-from crm2.utils.password_utils import verify_and_upgrade_password, \
-    normalize_string  # Импортируем verify_and_upgrade_password
+from crm2.services.users import update_user_password  # Импортируем update_user_password
+from crm2.utils.password_utils import normalize_string
+from crm2.utils.password_pool import login_attempts, verify_and_upgrade_password_async
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -35,8 +35,8 @@ class GuestLoginStates(StatesGroup):
 
 
 @router.message(Command("start"))
-async def guest_start(message: Message):
-    u = await get_user_by_telegram(message.from_user.id)
+async def guest_start(message: Message, user: dict | None = None):
+    u = user
 
     if u and u.get("nickname") and u.get("password"):
         await message.answer(
@@ -60,10 +60,10 @@ async def guest_login(message: Message, state: FSMContext):
 
 
 @router.message(GuestLoginStates.waiting_password)
-async def process_login_password(message: Message, state: FSMContext):
+async def process_login_password(message: Message, state: FSMContext, user: dict | None = None):
     """Обработка введенного пароля с автоматическим хешированием"""
     password = normalize_string(message.text.strip())
-    u = await get_user_by_telegram(message.from_user.id)
+    u = user
 
     if not u:
         await message.answer("❌ Ошибка: пользователь не найден")
@@ -72,16 +72,25 @@ async def process_login_password(message: Message, state: FSMContext):
 
     stored_password = u.get("password", "")
 
+    # Лимит попыток на telegram_id: перебор паролей не должен занимать пул bcrypt
+    retry_after = login_attempts.acquire(message.from_user.id)
+    if retry_after:
+        await message.answer(
+            f"⏳ Слишком много попыток входа. Повторите через {int(retry_after) + 1} сек."
+        )
+        return
+
     # ОТЛАДОЧНЫЙ ВЫВОД
     print(f"[DEBUG] User object: {u}")
     print(f"[DEBUG] Nickname: {u.get('nickname')}")
     print(f"[DEBUG] Role: {u.get('role')}")
     print(f"[DEBUG] All keys: {list(u.keys())}")
 
-    # Используем улучшенную проверку с авто-обновлением хеша
-    success, new_hash = verify_and_upgrade_password(password, stored_password)
+    # Проверка с авто-обновлением хеша; bcrypt — в пуле процессов, event loop не блокируется
+    success, new_hash = await verify_and_upgrade_password_async(password, stored_password)
 
     if success:
+        login_attempts.reset(message.from_user.id)
         # Если пароль был в plain text - обновляем его в базе
         if new_hash != stored_password:
             await update_user_password(message.from_user.id, new_hash)
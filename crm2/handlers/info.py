@@ -34,12 +34,11 @@ from crm2.keyboards import schedule_root_kb, role_kb, schedule_dates_kb
 from crm2.services import schedule as sch
 from crm2.keyboards.project import project_menu_kb
 from crm2.keyboards import role_kb, guest_start_kb
-import sqlite3
-from crm2.db.sqlite import DB_PATH
 from aiogram.exceptions import TelegramBadRequest
 from crm2.keyboards.project import project_menu_kb
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 import os
+from datetime import datetime
 
 
 router = Router(name="info")
@@ -90,7 +89,7 @@ def _build_details_kb(items) -> InlineKeyboardMarkup:
 
 async def _show_schedule_list(message: Message):
     """Вспомогательная печать списка (используется при необходимости)."""
-    items = upcoming(message.from_user.id, limit=100)
+    items = await upcoming(message.from_user.id, limit=100)
     if not items:
         await message.answer("Расписание занятий:\n• ближайших занятий пока нет.", reply_markup=role_kb("user"))
         return
@@ -108,14 +107,12 @@ async def _show_schedule_list(message: Message):
 async def session_details(cb: CallbackQuery):
     """Карточка занятия: даты, код, тема и аннотация."""
     start_key = cb.data.split(":", 1)[1]  # YYYYMMDD
-    items = upcoming(cb.from_user.id, limit=200)
-
-    target = None
-    for it in items:
-        s = _get(it, "start")
-        if s and s.strftime("%Y%m%d") == start_key:
-            target = it
-            break
+    try:
+        day = datetime.strptime(start_key, "%Y%m%d").date()
+    except ValueError:
+        day = None
+    # одна точка поиска в индексе расписания вместо перечитывания upcoming(limit=200)
+    target = await sch.session_on(cb.from_user.id, day) if day else None
 
     if not target:
         await cb.answer("Не удалось найти запись :(", show_alert=True)
@@ -230,8 +227,6 @@ async def open_agents_instruction(message: Message):
 # --- О проекте ---
 from crm2.keyboards.project import project_menu_kb
 from crm2.keyboards import role_kb, guest_start_kb
-import sqlite3
-from crm2.db.sqlite import DB_PATH
 
 
 @router.message(F.text.in_({"ℹ️ Информация о проекте", "📖 О проекте"}))
@@ -241,32 +236,17 @@ async def show_project_menu(message: Message):
 
 
 @router.message(F.text == "Как проводятся занятия")
-async def show_project_menu_legacy(message: Message):
-    # Роль можно использовать для будущей логики, но подменю показываем всем
-    with sqlite3.connect(DB_PATH) as con:
-        con.row_factory = sqlite3.Row
-        row = con.execute(
-            "SELECT role FROM users WHERE telegram_id = ? LIMIT 1",
-            (message.from_user.id,)
-        ).fetchone()
-        role = (row["role"] if row else None) or "guest"
-
+async def show_project_menu_legacy(message: Message, user_role: str = "guest"):
+    # Роль (user_role из контекста апдейта) можно использовать для будущей логики, но подменю показываем всем
     await message.answer("ℹ️ Информация о проекте:", reply_markup=project_menu_kb())
 
 @router.message(F.text == "↩️ Главное меню")
-async def back_to_main_from_project(message: Message):
+async def back_to_main_from_project(message: Message, user_role: str = "guest"):
     from aiogram.types import ReplyKeyboardRemove
-    import sqlite3
-    from crm2.db.sqlite import DB_PATH
     from crm2.keyboards import role_kb, guest_start_kb
 
-    with sqlite3.connect(DB_PATH) as con:
-        con.row_factory = sqlite3.Row
-        row = con.execute(
-            "SELECT role FROM users WHERE telegram_id = ? LIMIT 1",
-            (message.from_user.id,)
-        ).fetchone()
-        role = (row["role"] if row else None) or "guest"
+    # роль уже загружена UserContextMiddleware — без запроса к users
+    role = user_role
 
     # Гость не может «выйти в главное меню» изнутри раздела — сообщаем и убираем клавиатуру
     if role == "guest":
@@ -6,7 +6,6 @@ from aiogram import Router, F
 from aiogram.types import Message
 
 from crm2.keyboards import role_kb
-from crm2.services.users import get_user_by_telegram
 
 # crm2/handlers/main_menu.py
 # Назначение: Центральная навигация системы - обработка главного меню для всех ролей пользователей
@@ -79,9 +78,9 @@ async def to_main_menu(message: Message):
         await message.answer("Главное меню:", reply_markup=guest_start_kb())
 
 @router.message(F.text == "🔙 Выйти в меню")
-async def back_to_main(message: Message):
+async def back_to_main(message: Message, user: dict | None = None):
     """Возврат в главное меню с учетом роли"""
-    u = await get_user_by_telegram(message.from_user.id)
+    u = user
 
     if not u or not u.get('nickname') or not u.get('password'):
         # Неавторизованный пользователь - в гостевое меню
@@ -94,9 +93,9 @@ async def back_to_main(message: Message):
 
 
 @router.message(F.text == "⚙️ Админ")
-async def handle_admin_button(message: Message):
+async def handle_admin_button(message: Message, user: dict | None = None):
     """Обработчик кнопки админ-панели в главном меню"""
-    u = await get_user_by_telegram(message.from_user.id)
+    u = user
 
     if not u or u.get("role") != "admin":
         await message.answer("⛔️ Доступ только для администраторов.")
@@ -109,8 +108,8 @@ async def handle_admin_button(message: Message):
 
 # Обработчики других кнопок главного меню (только для авторизованных)
 @router.message(F.text == "📅 Расписание")
-async def show_schedule(message: Message):
-    u = await get_user_by_telegram(message.from_user.id)
+async def show_schedule(message: Message, user: dict | None = None):
+    u = user
     if not u or not u.get('nickname'):
         return
 
@@ -120,8 +119,8 @@ async def show_schedule(message: Message):
 
 
 @router.message(F.text == "📦 Материалы")
-async def show_materials(message: Message):
-    u = await get_user_by_telegram(message.from_user.id)
+async def show_materials(message: Message, user: dict | None = None):
+    u = user
     if not u or not u.get('nickname'):
         return
     await message.answer("📦 Раздел материалов...")
@@ -130,12 +129,12 @@ async def show_materials(message: Message):
 # @router.message(F.text == "👤 Личный кабинет")
 # async def show_profile(message: Message):
 @router.message(F.text == "👤 Личный кабинет")
-async def show_profile(message: Message):
-    u = await get_user_by_telegram(message.from_user.id)
+async def show_profile(message: Message, user: dict | None = None):
+    u = user
     if not u or not u.get('nickname'):
         await message.answer("❌ Для доступа к личному кабинету нужно завершить регистрацию.")
         return
 
     # Импортируем и вызываем функцию show_profile из profile.py
     from crm2.handlers.profile import show_profile as show_profile_handler
-    await show_profile_handler(message)
\ No newline at end of file
+    await show_profile_handler(message, u)
\ No newline at end of file
@@ -65,15 +65,16 @@ def _profile_kb() -> InlineKeyboardBuilder:
 
 
 @router.message(F.text == "👤 Личный кабинет")
-async def profile_entry(message: Message):
-    await show_profile(message)
+async def profile_entry(message: Message, user: dict | None = None):
+    await show_profile(message, user)
 
 
-async def show_profile(obj: Message | CallbackQuery):
+async def show_profile(obj: Message | CallbackQuery, user: dict | None = None):
     chat_id, tg_id = _extract_ids(obj)
 
-    # Получаем данные пользователя из БД
-    user = await get_user_by_telegram(tg_id)
+    # Пользователь из контекста апдейта; без него (например, после смены потока) — свежие данные из БД
+    if user is None:
+        user = await get_user_by_telegram(tg_id)
 
     if not user:
         text = "❌ Пользователь не найден. Пройдите регистрацию."
@@ -187,8 +188,8 @@ async def set_stream_cb(cq: CallbackQuery):
 
 # Остальные обработчики остаются без изменений...
 @router.callback_query(F.data == "profile:back")
-async def profile_back(cq: CallbackQuery):
-    await show_profile(cq)
+async def profile_back(cq: CallbackQuery, user: dict | None = None):
+    await show_profile(cq, user)
 
 
 @router.callback_query(F.data == "profile:back_main")
@@ -200,7 +201,7 @@ async def profile_back_main(cq: CallbackQuery):
 
 
 @router.callback_query(F.data == "profile:toggle_notify")
-async def toggle_notify(cq: CallbackQuery):
+async def toggle_notify(cq: CallbackQuery, user: dict | None = None):
     # TODO: Реализовать переключение уведомлений
     await cq.answer("🔔 Функция уведомлений в разработке")
-    await show_profile(cq)
+    await show_profile(cq, user)
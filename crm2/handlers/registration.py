@@ -54,6 +54,7 @@ from aiogram.types import (
     KeyboardButton,
 )
 
+from crm2.utils.password_pool import hash_password_async
 from crm2.services.users import (
     get_user_by_telegram,
     set_plain_user_field_by_tg,
@@ -149,7 +150,8 @@ async def edit_password(message: Message, state: FSMContext):
 
 @router.message(EditField.password, F.text)
 async def save_password(message: Message, state: FSMContext):
-    set_plain_user_field_by_tg(message.from_user.id, "password", message.text.strip())
+    # сразу bcrypt (в пуле процессов): plain text в users больше не появляется
+    set_plain_user_field_by_tg(message.from_user.id, "password", await hash_password_async(message.text.strip()))
     await state.clear()
     u = await get_user_by_telegram(message.from_user.id) or {}
     await message.answer("Готово. Пароль обновлён.")
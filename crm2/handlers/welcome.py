@@ -9,14 +9,14 @@ from aiogram.filters import CommandStart
 from aiogram.types import Message
 
 import sqlite3
-from crm2.db.sqlite import DB_PATH
+from crm2.db.sqlite import get_db_connection
 from crm2.keyboards import guest_start_kb
 
 router = Router(name="welcome")
 
 
 def _user_exists(tg_id: int) -> bool:
-    with sqlite3.connect(DB_PATH) as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
         cur = con.execute("SELECT 1 FROM users WHERE telegram_id = ? LIMIT 1", (tg_id,))
         return cur.fetchone() is not None
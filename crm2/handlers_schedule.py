@@ -136,11 +136,11 @@ async def _show_all_schedule(message: Message):
 async def _show_main_menu(message: Message):
     """Возврат в главное меню"""
     from crm2.keyboards.main_menu import guest_start_kb, role_kb
-    from crm2.db.sqlite import DB_PATH
+    from crm2.db.sqlite import get_db_connection
     import sqlite3
 
 # Определяем роль пользователя
-    with sqlite3.connect(DB_PATH) as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
         cur = con.execute("SELECT role FROM users WHERE telegram_id=?", (message.from_user.id,))
         row = cur.fetchone()
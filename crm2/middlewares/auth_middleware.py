@@ -16,7 +16,7 @@
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
 from typing import Callable, Dict, Any, Awaitable
-from crm2.services.users import get_user_by_telegram
+from crm2.middlewares.user_context_middleware import context_user
 
 
 class AuthMiddleware(BaseMiddleware):
@@ -42,8 +42,8 @@ class AuthMiddleware(BaseMiddleware):
                                                                                "📖 О проекте", "🔙 Выйти в меню"]:
                 return await handler(event, data)
 
-        # Получаем пользователя (БЕЗ AWAIT - функция синхронная!)
-        user = await get_user_by_telegram(event.from_user.id)
+        # Пользователь уже загружен UserContextMiddleware для этого апдейта
+        user = await context_user(data, event.from_user.id)
 
         if not user or not user.get('nickname') or not user.get('password'):
             # Пользователь не авторизован
@@ -59,6 +59,4 @@ class AuthMiddleware(BaseMiddleware):
                 await event.answer("❌ Необходимо авторизоваться", show_alert=True)
                 return
 
-        # Добавляем пользователя в data для обработчиков
-        data['user'] = user
         return await handler(event, data)
\ No newline at end of file
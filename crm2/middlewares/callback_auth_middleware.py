@@ -17,7 +17,7 @@ from typing import Callable, Dict, Any, Awaitable
 from aiogram import BaseMiddleware
 from aiogram.types import CallbackQuery
 
-from crm2.services.users import get_user_by_telegram
+from crm2.middlewares.user_context_middleware import context_user
 from crm2.keyboards import guest_start_kb
 
 logger = logging.getLogger(__name__)
@@ -35,9 +35,8 @@ class CallbackAuthMiddleware(BaseMiddleware):
         # Пропускаем callback data, которые начинаются с "admin:" - они уже проверены
         if event.data and event.data.startswith('admin:'):
             logger.info(f"CallbackAuthMiddleware: processing admin callback {event.data}")
-            user = await get_user_by_telegram(event.from_user.id)
+            user = await context_user(data, event.from_user.id)
             if user and user.get('nickname') and user.get('password'):
-                data['user'] = user
                 return await handler(event, data)
             else:
                 logger.warning(f"CallbackAuthMiddleware: user not authorized for admin callback")
@@ -48,8 +47,8 @@ class CallbackAuthMiddleware(BaseMiddleware):
                 await event.answer()
                 return
 
-        # Для остальных callback проверяем авторизацию
-        user = await get_user_by_telegram(event.from_user.id)
+        # Для остальных callback проверяем авторизацию (пользователь — из контекста апдейта)
+        user = await context_user(data, event.from_user.id)
         logger.info(f"CallbackAuthMiddleware: user found = {bool(user)}")
 
         if not user:
@@ -72,6 +71,5 @@ class CallbackAuthMiddleware(BaseMiddleware):
             await event.answer()
             return
 
-        data['user'] = user
         logger.info(f"CallbackAuthMiddleware: user authorized, proceeding to handler")
         return await handler(event, data)
\ No newline at end of file
@@ -0,0 +1,50 @@
+# crm2/middlewares/user_context_middleware.py
+# Назначение: Контекст пользователя на время обработки одного апдейта.
+#             Внешний (outer) middleware на уровне Update один раз читает пользователя по telegram_id
+#             и кладёт в data: 'user' (dict | None) и 'user_role' ('guest' для незарегистрированных).
+#             AuthMiddleware, CallbackAuthMiddleware, фильтр AdminOnly и хендлеры берут их из data
+#             (хендлер получает их аргументами user / user_role) — без повторных запросов к users.
+#             Апдейт от пользователя в личке снимает с него отметку «недоступен» (reachability.note_contact).
+# Классы:
+# - UserContextMiddleware - Outer middleware загрузки пользователя
+# Функции:
+# - role_of - Роль из словаря пользователя ('guest', если пользователя нет)
+# - context_user - Пользователь из data (при отсутствии контекста — запрос к БД)
+
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from crm2.services.reachability import note_contact
+from crm2.services.users import get_user_by_telegram
+
+
+def role_of(user: Optional[Dict[str, Any]]) -> str:
+    return (user.get("role") or "guest") if user else "guest"
+
+
+async def context_user(data: Dict[str, Any], telegram_id: int) -> Optional[Dict[str, Any]]:
+    """Пользователь из контекста апдейта; если middleware не отработал — читаем из БД и запоминаем."""
+    if "user" not in data:
+        data["user"] = await get_user_by_telegram(telegram_id)
+        data["user_role"] = role_of(data["user"])
+    return data["user"]
+
+
+class UserContextMiddleware(BaseMiddleware):
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        # event_from_user заполняет встроенный middleware aiogram (он стоит раньше нашего)
+        from_user: Optional[User] = data.get("event_from_user")
+        if from_user is not None:
+            await context_user(data, from_user.id)
+            # доставка шла в личный чат (telegram_id); апдейт из группы не доказывает, что личка доступна
+            chat = data.get("event_chat")
+            if chat is None or chat.type == "private":
+                await note_contact(from_user.id)
+        return await handler(event, data)
@@ -15,7 +15,7 @@ router = Router()
 #     return sqlite3.connect("crm2.db")
 
 def get_user_role(telegram_id: int) -> str | None:
-    with get_db_connection() as conn:
+    with get_db_connection(readonly=True) as conn:
         cur = conn.cursor()
         cur.execute("SELECT role FROM users WHERE telegram_id=?", (telegram_id,))
         row = cur.fetchone()
@@ -12,14 +12,13 @@ from typing import Optional
 # - find_recent_past_sessions - Получение последних прошедших занятий
 # - get_stream_title - Получение названия потока
 # - get_attendance_map - Получение карты посещаемости для сессии
-# - upsert_attendance - Обновление/добавление записи посещаемости
+# - upsert_attendance - Обновление/добавление записи посещаемости (через очередь группового коммита)
 # - status_to_emoji/emoji_to_status - Конвертация статусов в эмодзи и обратно
 # - mark_attendance - Асинхронное отметка посещаемости
 # - get_present_users - Получение присутствовавших пользователей
 # - find_user_id_by_nickname - Поиск user_id по никнейму
 # - get_sessions_near - Получение ближайших сессий
-# - ensure_homework_delivery_table - Создание таблицы доставки ДЗ
-# - get_not_yet_delivered - Получение пользователей без доставленных ДЗ
+# - get_not_yet_delivered - Получение пользователей без доставленных ДЗ (anti-join, без недоступных получателей)
 # - mark_homework_delivered - Отметка доставки ДЗ
 # новое описание:
 # crm2/services/attendance.py
@@ -29,19 +28,20 @@ from typing import Optional
 # - find_recent_past_sessions - Получение последних прошедших занятий
 # - get_stream_title - Получение названия потока
 # - get_attendance_map - Получение карты посещаемости для сессии
-# - upsert_attendance - Обновление/добавление записи посещаемости
+# - upsert_attendance - Обновление/добавление записи посещаемости (через очередь группового коммита)
 # - status_to_emoji/emoji_to_status - Конвертация статусов в эмодзи и обратно
 # - mark_attendance - Асинхронное отметка посещаемости
 # - get_present_users - Получение присутствовавших пользователей
 # - find_user_id_by_nickname - Поиск user_id по никнейму
 # - get_sessions_near - Получение ближайших сессий
-# - ensure_homework_delivery_table - Создание таблицы доставки ДЗ
-# - get_not_yet_delivered - Получение пользователей без доставленных ДЗ
+# - get_not_yet_delivered - Получение пользователей без доставленных ДЗ (anti-join, без недоступных получателей)
 # - mark_homework_delivered - Отметка доставки ДЗ
 from crm2.db.core import get_db_connection, DB_PATH
 # crm2/services/attendance.py
 from crm2.db import db
 from crm2.db.core import get_db_connection
+from crm2.db.write_queue import get_write_queue
+from crm2.services.reachability import reachable_clause
 
 TODAY = date.today().isoformat()
 
@@ -58,7 +58,7 @@ def find_today_session() -> Optional[Dict[str, Any]]:
         ORDER BY id DESC
             LIMIT 1 \
         """
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
         row = con.execute(q, (TODAY,)).fetchone()
     return dict(row) if row else None
@@ -75,7 +75,7 @@ def find_recent_past_sessions(limit: int = 5) -> List[Dict[str, Any]]:
         ORDER BY date DESC, id DESC
             LIMIT ? \
         """
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
         rows = con.execute(q, (TODAY, limit)).fetchall()
     return [dict(r) for r in rows]
@@ -86,7 +86,7 @@ def get_stream_title(cohort_id: int) -> str:
     streams пуста → подставляем 'Поток N'. Если позже появится title — будем читать из streams.
     """
     # Пробуем прочитать из streams
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
         row = con.execute("SELECT title FROM streams WHERE id = ?", (cohort_id,)).fetchone()
     if row and row["title"]:
@@ -99,18 +99,18 @@ def get_attendance_map(session_id: int) -> Dict[int, str]:
     Ключ: user_id → значение status ('present'|'absent'|'left').
     """
     q = "SELECT user_id, status FROM attendance WHERE session_id = ?"
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
         rows = con.execute(q, (session_id,)).fetchall()
     return {r["user_id"]: r["status"] for r in rows}
 
 
-def upsert_attendance(user_id: int, session_id: int, status: str, noted_by: Optional[int]) -> None:
+async def upsert_attendance(user_id: int, session_id: int, status: str, noted_by: Optional[int]) -> None:
     """
     Вставить/обновить отметку. Если запись есть — обновляем status/ts/noted_by.
+    Запись идёт через очередь группового коммита (crm2/db/write_queue.py).
     """
-    with get_db_connection() as con:
-        con.execute("""
+    await get_write_queue(DB_PATH).execute("""
                     INSERT INTO attendance (user_id, session_id, status, noted_at, noted_by)
                     VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?) ON CONFLICT(user_id, session_id) DO
                     UPDATE SET
@@ -118,7 +118,6 @@ def upsert_attendance(user_id: int, session_id: int, status: str, noted_by: Opti
                         noted_at= CURRENT_TIMESTAMP,
                         noted_by=excluded.noted_by
                     """, (user_id, session_id, status, noted_by))
-        con.commit()
 
 
 def status_to_emoji(status: Optional[str]) -> str:
@@ -142,7 +141,7 @@ async def mark_attendance(user_id: int, session_id: int, status: str, noted_by:
               noted_at= CURRENT_TIMESTAMP,
               noted_by=excluded.noted_by \
           """
-    await db.execute(sql, (user_id, session_id, status, noted_by))
+    await get_write_queue(DB_PATH).execute(sql, (user_id, session_id, status, noted_by))
 
 
 async def get_present_users(session_id: int) -> list[int]:
@@ -175,64 +174,33 @@ async def get_sessions_near(days: int = 14):
 
 # --- Домашние задания ---
 
-async def ensure_homework_delivery_table():
-    """Создать таблицу homework_delivery, если её ещё нет."""
-    sql = """
-          CREATE TABLE IF NOT EXISTS homework_delivery
-          (
-              id
-              INTEGER
-              PRIMARY
-              KEY,
-              session_id
-              INTEGER
-              NOT
-              NULL,
-              user_id
-              INTEGER
-              NOT
-              NULL,
-              link
-              TEXT
-              NOT
-              NULL,
-              sent_at
-              TEXT
-              DEFAULT
-              CURRENT_TIMESTAMP,
-              UNIQUE
-          (
-              session_id,
-              user_id
-          )
-              ) \
-          """
-    await db.execute(sql)
-
-
-async def get_not_yet_delivered(session_id: int) -> list[int]:
-    """Список user_id, кто был 'present', но ещё не получал ДЗ."""
-    await ensure_homework_delivery_table()
+async def get_not_yet_delivered(session_id: int, include_unreachable: bool = False) -> list[int]:
+    """
+    Список user_id, кто был 'present', но ещё не получал ДЗ (без недоступных получателей по умолчанию).
+    Один anti-join; таблицы создаются при старте (auto_migrate.ensure_homework_delivery).
+    """
     sql = """
-          SELECT a.user_id
+          SELECT DISTINCT a.user_id
           FROM attendance a
+          LEFT JOIN users u ON u.id = a.user_id
           WHERE a.session_id = ?
             AND a.status = 'present'
             AND NOT EXISTS (SELECT 1
                             FROM homework_delivery h
                             WHERE h.session_id = a.session_id
-                              AND h.user_id = a.user_id) \
+                              AND h.user_id = a.user_id)
           """
+    if not include_unreachable:
+        sql += " AND " + reachable_clause("u.telegram_id")
     rows = await db.fetch_all(sql, (session_id,))
     return [row[0] for row in rows]
 
 
 async def mark_homework_delivered(session_id: int, user_id: int, link: str):
     """Отметить, что курсант получил ДЗ (идемпотентно)."""
-    await ensure_homework_delivery_table()
     sql = """
           INSERT
           OR IGNORE INTO homework_delivery (session_id, user_id, link)
     VALUES (?, ?, ?) \
           """
-    await db.execute(sql, (session_id, user_id, link))
+    await get_write_queue(DB_PATH).execute(sql, (session_id, user_id, link))
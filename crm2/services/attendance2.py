@@ -3,13 +3,15 @@
 # Функции:
 # - get_sessions_near - Асинхронное получение ближайших сессий
 # - get_present_users - Асинхронное получение присутствовавших пользователей
-# - get_not_yet_delivered - Асинхронное получение пользователей без ДЗ
-# - mark_homework_delivered - Асинхронная отметка доставки ДЗ
+# - get_not_yet_delivered - Асинхронное получение пользователей без ДЗ (anti-join, без недоступных)
+# - mark_homework_delivered - Асинхронная отметка доставки ДЗ (через очередь группового коммита)
 import sqlite3
 from datetime import date, timedelta
 from typing import List, Tuple, Optional
 
-from crm2.db.core import get_db_connection
+from crm2.db.core import DB_PATH, get_db_connection
+from crm2.db.write_queue import get_write_queue
+from crm2.services.reachability import reachable_clause
 
 
 async def get_sessions_near(days: int = 14) -> List[Tuple[int, str, Optional[int], Optional[str]]]:
@@ -23,7 +25,7 @@ async def get_sessions_near(days: int = 14) -> List[Tuple[int, str, Optional[int
     start_date = (today - timedelta(days=days)).strftime("%Y-%m-%d")
     end_date = today.strftime("%Y-%m-%d")
 
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         cur = con.execute(
             """
             SELECT id, date, stream_id, topic_code
@@ -46,7 +48,7 @@ async def get_present_users(session_id: int) -> List[int]:
     Returns:
         List[telegram_id]
     """
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         cur = con.execute(
             """
             SELECT u.telegram_id
@@ -70,8 +72,7 @@ async def get_not_yet_delivered(session_id: int) -> Optional[List[int]]:
     Returns:
         List[telegram_id] или None если занятие не найдено
     """
-    # Проверяем существование занятия
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         exists = con.execute(
             "SELECT 1 FROM session_days WHERE id = ? LIMIT 1",
             (session_id,)
@@ -80,25 +81,21 @@ async def get_not_yet_delivered(session_id: int) -> Optional[List[int]]:
         if not exists:
             return None
 
-        # Присутствовавшие
-        present_ids = await get_present_users(session_id)
-        if not present_ids:
-            return []
-
-        # Уже получившие ДЗ
+        # присутствовавшие без отметки доставки — одним anti-join, без выгрузки двух списков
         cur = con.execute(
             """
-            SELECT u.telegram_id
-            FROM homework_delivery hd
-                     JOIN users u ON u.id = hd.user_id
-            WHERE hd.session_id = ?
-            """,
+            SELECT DISTINCT u.telegram_id
+            FROM attendance a
+                     JOIN users u ON u.id = a.user_id
+            WHERE a.session_id = ?
+              AND a.status = 'present'
+              AND u.telegram_id IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM homework_delivery hd
+                              WHERE hd.session_id = a.session_id AND hd.user_id = a.user_id)
+              AND """ + reachable_clause("u.telegram_id"),
             (session_id,),
         )
-        already_delivered = {row[0] for row in cur.fetchall() if row[0]}
-
-        # Разница
-        return [tid for tid in present_ids if tid not in already_delivered]
+        return [row[0] for row in cur.fetchall()]
 
 
 async def mark_homework_delivered(session_id: int, telegram_id: int, link: str) -> None:
@@ -110,24 +107,12 @@ async def mark_homework_delivered(session_id: int, telegram_id: int, link: str)
         telegram_id: telegram_id получателя
         link: ссылка на ДЗ
     """
-    with get_db_connection() as con:
-        # Получаем user_id по telegram_id
-        user_row = con.execute(
-            "SELECT id FROM users WHERE telegram_id = ?",
-            (telegram_id,)
-        ).fetchone()
-
-        if not user_row:
-            return
-
-        user_id = user_row[0]
-
-        # Записываем доставку
-        con.execute(
-            """
-            INSERT INTO homework_delivery (session_id, user_id, link)
-            VALUES (?, ?, ?) ON CONFLICT(session_id, user_id) DO NOTHING
-            """,
-            (session_id, user_id, link),
-        )
-        con.commit()
\ No newline at end of file
+    # user_id ищем прямо в INSERT ... SELECT: одна запись в очередь группового коммита
+    await get_write_queue(DB_PATH).execute(
+        """
+        INSERT INTO homework_delivery (session_id, user_id, link)
+        SELECT ?, id, ? FROM users WHERE telegram_id = ?
+        ON CONFLICT(session_id, user_id) DO NOTHING
+        """,
+        (session_id, link, telegram_id),
+    )
@@ -0,0 +1,522 @@
+# crm2/services/broadcast_engine.py
+# Назначение: Движок массовой рассылки с учётом лимитов Telegram и возобновлением после рестарта.
+#             Источник правды — строки broadcast_recipients со status='queued': движок читает их пачками
+#             (keyset по user_id), рассылает несколькими воркерами под общим token bucket (~28 сообщений/с
+#             на бота) и лимитом на чат, соблюдает TelegramRetryAfter (пауза для всего бота).
+#             Итоги доставки копятся в памяти (ResultBuffer) и пишутся пачкой: executemany по
+#             broadcast_recipients + stats_json рассылки одной транзакцией, каждые N итогов или T секунд.
+#             Постоянные ошибки (заблокировал бота, чат не найден) в той же транзакции помечают получателя
+#             недоступным (crm2/services/reachability.py) — следующие рассылки его не включают.
+#             Лимиты и приоритеты — общий планировщик исходящих (crm2/services/outbound.py, класс BROADCAST):
+#             ответы пользователям и ДЗ обгоняют рассылку, суммарная скорость бота не превышает лимит.
+#             Рассылка в статусе 'sending' после рестарта продолжается с оставшихся queued-строк.
+#             Панель прогресса (crm2/services/broadcast_progress.py) и управление из неё: пауза
+#             (status='paused', после рестарта не возобновляется сама), продолжение, отмена
+#             (оставшиеся queued → 'cancelled').
+# Классы:
+# - ResultBuffer - Буфер итогов доставки с пакетной записью в БД
+# - BroadcastControl - Пауза/продолжение идущей рассылки
+# Функции:
+# - _env_float - Чтение числа из переменной окружения
+# - _now_ts - Текущее время UTC в формате CURRENT_TIMESTAMP
+# - _send_one - Отправка одного сообщения рассылки (текст или вложение)
+# - _deliver - Отправка через планировщик (RetryAfter повторяет он) с повторами при сетевых ошибках
+# - enqueue_audience - Разрешение аудитории в broadcast_recipients одним INSERT … SELECT внутри БД
+# - _fetch_queued - Очередная пачка queued-получателей (keyset)
+# - iter_queued - Асинхронный генератор queued-получателей пачками (keyset, ограниченная память)
+# - _count_statuses - Счётчики получателей рассылки по статусам
+# - _write_results - Запись пачки итогов и stats_json одной транзакцией
+# - _finish - Итоговая статистика и закрытие рассылки
+# - _set_status - Смена статуса рассылки в БД
+# - _cancel_rows - Отмена оставшихся queued-получателей и закрытие рассылки
+# - run_broadcast - Полный прогон одной рассылки
+# - _run_and_report - Фоновый прогон с панелью прогресса и уведомлением автора о результате
+# - start_broadcast - Запуск рассылки фоновой задачей (идемпотентно)
+# - pause_broadcast - Пауза рассылки
+# - resume_broadcast - Продолжение рассылки (в т.ч. поставленной на паузу до рестарта)
+# - cancel_broadcast - Отмена рассылки
+# - resume_broadcasts - Возобновление незавершённых рассылок при старте бота
+# - stop_broadcasts - Остановка всех задач рассылки (queued-строки остаются для возобновления)
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+)
+
+from crm2.db.core import get_db_connection
+from crm2.services.reachability import (
+    classify_failure,
+    mark_unreachable_many,
+    reachable_clause,
+)
+from crm2.services.broadcast_progress import ProgressPanel
+from crm2.services.outbound import Priority, install, priority
+
+log = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, ""))
+    except ValueError:
+        return default
+
+
+# Воркеров на рассылку (лимиты скорости — в crm2/services/outbound.py), повторов, размер пачки чтения
+WORKERS = int(_env_float("CRM_BC_WORKERS", 8))
+MAX_RETRIES = int(_env_float("CRM_BC_RETRIES", 3))
+FETCH_BATCH = int(_env_float("CRM_BC_FETCH", 500))
+# Запись итогов доставки: пачкой по FLUSH_ROWS строк или раз в FLUSH_S секунд
+FLUSH_ROWS = int(_env_float("CRM_BC_FLUSH_ROWS", 200))
+FLUSH_S = _env_float("CRM_BC_FLUSH_S", 2.0)
+
+_RUNNING: Dict[int, asyncio.Task] = {}
+
+
+async def _send_one(bot: Bot, chat_id: int, body: str, file_id: Optional[str], mime: Optional[str]) -> None:
+    if file_id:
+        if mime and mime.startswith("image/"):
+            await bot.send_photo(chat_id, file_id, caption=body)
+        elif mime and mime.startswith("video/"):
+            await bot.send_video(chat_id, file_id, caption=body)
+        elif mime and mime.startswith("audio/"):
+            await bot.send_audio(chat_id, file_id, caption=body)
+        else:
+            await bot.send_document(chat_id, file_id, caption=body)
+    else:
+        await bot.send_message(chat_id, body)
+
+
+async def _deliver(bot: Bot, chat_id: int, bc: dict) -> Tuple[str, Optional[str]]:
+    """
+    ('sent', None) | ('failed', текст ошибки). Сетевые сбои — повтор до MAX_RETRIES.
+    RetryAfter повторяет и ставит бота на паузу сам планировщик (outbound.OutboundScheduler.call);
+    дошедший сюда RetryAfter значит, что его повторы исчерпаны, — окончательная ошибка получателя.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            await _send_one(bot, chat_id, bc["body"], bc["file_id"], bc["mime"])
+            return "sent", None
+        except TelegramRetryAfter as e:
+            return "failed", f"retry_after {e.retry_after}"
+        except TelegramNetworkError as e:
+            await asyncio.sleep(min(30.0, 2 ** attempt))
+            err = str(e)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # заблокировал бота / чат не найден — повторять бессмысленно
+            return "failed", str(e)[:300]
+        except Exception as e:
+            return "failed", str(e)[:300]
+    return "failed", err[:300]
+
+
+def enqueue_audience(con, bc_id: int, audience: str, cohort_id: Optional[int] = None,
+                     *, skip_unreachable: bool = True) -> int:
+    """
+    Получатели рассылки — одним INSERT … SELECT из users, без выгрузки в Python.
+    audience: 'all' | 'cohort' (cohort_id=None — пользователи без потока). Коммит — за вызывающим.
+    Возвращает число добавленных получателей.
+    """
+    where = ["u.telegram_id IS NOT NULL"]
+    params: List[object] = [bc_id]
+    if audience != "all":
+        where.append("u.cohort_id IS ?")
+        params.append(cohort_id)
+    if skip_unreachable:
+        where.append(reachable_clause("u.telegram_id"))
+    before = con.total_changes
+    con.execute(
+        "INSERT OR IGNORE INTO broadcast_recipients(broadcast_id, user_id) "
+        "SELECT ?, u.telegram_id FROM users u WHERE " + " AND ".join(where),
+        params,
+    )
+    return con.total_changes - before
+
+
+def _fetch_queued(bc_id: int, after_uid: int, limit: int) -> List[int]:
+    with get_db_connection(readonly=True) as con:
+        rows = con.execute(
+            """
+            SELECT user_id FROM broadcast_recipients
+            WHERE broadcast_id = ? AND status = 'queued' AND user_id > ?
+            ORDER BY user_id
+            LIMIT ?
+            """,
+            (bc_id, after_uid, limit),
+        ).fetchall()
+    return [int(r[0]) for r in rows]
+
+
+async def iter_queued(bc_id: int, batch: int = FETCH_BATCH) -> AsyncIterator[int]:
+    """queued-получатели по возрастанию user_id; в памяти не больше одной пачки."""
+    after = -(2 ** 63)
+    while True:
+        rows = await asyncio.to_thread(_fetch_queued, bc_id, after, batch)
+        for uid in rows:
+            yield uid
+        if len(rows) < batch:
+            return
+        after = rows[-1]
+
+
+def _count_statuses(con, bc_id: int) -> Dict[str, int]:
+    counts = dict(con.execute(
+        "SELECT status, COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ? GROUP BY status",
+        (bc_id,),
+    ).fetchall())
+    return {
+        "total": sum(counts.values()),
+        "sent": counts.get("sent", 0),
+        "failed": counts.get("failed", 0),
+        "cancelled": counts.get("cancelled", 0),
+    }
+
+
+def _now_ts() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _write_results(bc_id: int, rows: List[Tuple[str, Optional[str], str, int, int]], stats: Dict[str, int],
+                   dead: Optional[List[Tuple[int, str, Optional[str], str]]] = None) -> None:
+    """
+    rows: (status, error, sent_at, broadcast_id, user_id); dead: (telegram_id, reason, error, failed_at).
+    Итоги, счётчики и отметки недоступности — одной транзакцией.
+    """
+    with get_db_connection() as con:
+        con.executemany(
+            """
+            UPDATE broadcast_recipients
+            SET status=?, error=?, sent_at=?
+            WHERE broadcast_id=? AND user_id=?
+            """,
+            rows,
+        )
+        con.execute("UPDATE broadcasts SET stats_json=? WHERE id=?",
+                    (json.dumps(stats, ensure_ascii=False), bc_id))
+        if dead:
+            mark_unreachable_many(con, dead)
+        con.commit()
+
+
+class ResultBuffer:
+    """
+    Итоги доставки одной рассылки: add() только дописывает в память и обновляет счётчики,
+    запись — пачкой по max_rows строк или раз в interval секунд (flush() / close()).
+    Пачка, которую не удалось записать, возвращается в буфер и пишется следующим flush.
+    """
+
+    def __init__(self, bc_id: int, stats: Dict[str, int], *,
+                 max_rows: int = FLUSH_ROWS, interval: float = FLUSH_S):
+        self.bc_id = bc_id
+        self.stats = dict(stats)
+        self.max_rows = max(1, max_rows)
+        self.interval = max(0.1, interval)
+        self.flushes = 0
+        self._rows: List[Tuple[str, Optional[str], str, int, int]] = []
+        self._dead: List[Tuple[int, str, Optional[str], str]] = []
+        self._lock = asyncio.Lock()
+        self._flushing: Optional[asyncio.Task] = None
+        self._timer: Optional[asyncio.Task] = None
+        self._stop = asyncio.Event()
+
+    def start(self) -> "ResultBuffer":
+        self._timer = asyncio.create_task(self._tick(), name=f"bc-{self.bc_id}-flush")
+        return self
+
+    def add(self, uid: int, status: str, err: Optional[str]) -> None:
+        ts = _now_ts()
+        self._rows.append((status, err, ts, self.bc_id, uid))
+        self.stats[status] = self.stats.get(status, 0) + 1
+        reason = classify_failure(err) if status == "failed" else None
+        if reason is not None:
+            self._dead.append((uid, reason, err, ts))
+            self.stats["unreachable"] = self.stats.get("unreachable", 0) + 1
+        if len(self._rows) >= self.max_rows and (self._flushing is None or self._flushing.done()):
+            self._flushing = asyncio.create_task(self.flush())
+
+    async def _tick(self) -> None:
+        # не отменяем таймер посреди записи: поток с транзакцией всё равно доработает
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._rows:
+                return
+            rows, self._rows = self._rows, []
+            dead, self._dead = self._dead, []
+            try:
+                await asyncio.to_thread(_write_results, self.bc_id, rows, dict(self.stats), dead)
+                self.flushes += 1
+            except Exception as e:
+                log.warning("[BC] #%s flush of %d results failed, will retry: %s", self.bc_id, len(rows), e)
+                self._rows[:0] = rows
+                self._dead[:0] = dead
+
+    async def close(self) -> None:
+        """Остановить таймер и дописать хвост (вызывается и при отмене рассылки)."""
+        self._stop.set()
+        if self._timer is not None:
+            await asyncio.gather(self._timer, return_exceptions=True)
+        if self._flushing is not None:
+            await asyncio.gather(self._flushing, return_exceptions=True)
+        await self.flush()
+
+
+def _finish(bc_id: int) -> Dict[str, int]:
+    with get_db_connection() as con:
+        stats = _count_statuses(con, bc_id)
+        con.execute(
+            "UPDATE broadcasts SET status='done', sent_at=CURRENT_TIMESTAMP, stats_json=? WHERE id=?",
+            (json.dumps(stats, ensure_ascii=False), bc_id),
+        )
+        con.commit()
+    return stats
+
+
+def _set_status(bc_id: int, status: str) -> None:
+    with get_db_connection() as con:
+        con.execute("UPDATE broadcasts SET status=? WHERE id=?", (status, bc_id))
+        con.commit()
+
+
+def _cancel_rows(bc_id: int) -> Dict[str, int]:
+    with get_db_connection() as con:
+        con.execute(
+            "UPDATE broadcast_recipients SET status='cancelled' WHERE broadcast_id=? AND status='queued'",
+            (bc_id,),
+        )
+        stats = _count_statuses(con, bc_id)
+        con.execute(
+            "UPDATE broadcasts SET status='cancelled', sent_at=CURRENT_TIMESTAMP, stats_json=? WHERE id=?",
+            (json.dumps(stats, ensure_ascii=False), bc_id),
+        )
+        con.commit()
+    return stats
+
+
+class BroadcastControl:
+    """Пауза идущей рассылки: воркеры ждут running перед каждой отправкой; очередь в БД не трогается."""
+
+    def __init__(self):
+        self.running = asyncio.Event()
+        self.running.set()
+        self.panel: Optional[ProgressPanel] = None
+        self.results: Optional[ResultBuffer] = None
+
+    @property
+    def state(self) -> str:
+        return "sending" if self.running.is_set() else "paused"
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.results.stats) if self.results is not None else {}
+
+
+_CONTROLS: Dict[int, BroadcastControl] = {}
+
+
+async def run_broadcast(bot: Bot, bc_id: int, *, workers: int = WORKERS,
+                        control: Optional[BroadcastControl] = None) -> Dict[str, int]:
+    """
+    Рассылает все queued-строки рассылки bc_id и закрывает её.
+    Можно вызывать повторно: уже отправленные (sent/failed) строки не трогаются.
+    control — пауза из панели и доступ панели к счётчикам.
+    """
+    control = control or BroadcastControl()
+    with get_db_connection() as con:
+        row = con.execute(
+            "SELECT body, attachment_file_id, attachment_mime, created_by FROM broadcasts WHERE id = ?",
+            (bc_id,),
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"broadcast {bc_id} not found")
+        con.execute("UPDATE broadcasts SET status='sending' WHERE id=?", (bc_id,))
+        stats = _count_statuses(con, bc_id)
+        con.commit()
+    bc = {"body": row[0] or "", "file_id": row[1], "mime": row[2]}
+
+    install(bot)
+    results = ResultBuffer(bc_id, stats).start()
+    control.results = results
+    if control.panel is not None:
+        control.panel.attach(control.stats, lambda: control.state)
+    queue: "asyncio.Queue[Optional[int]]" = asyncio.Queue(maxsize=workers * 4)
+
+    async def worker() -> None:
+        while True:
+            uid = await queue.get()
+            if uid is None:
+                return
+            await control.running.wait()  # пауза из панели
+            with priority(Priority.BROADCAST):
+                status, err = await _deliver(bot, uid, bc)
+            results.add(uid, status, err)
+
+    tasks = [asyncio.create_task(worker(), name=f"bc-{bc_id}-w{i}") for i in range(max(1, workers))]
+    started = time.monotonic()
+    fed = 0
+    try:
+        async for uid in iter_queued(bc_id):
+            await queue.put(uid)
+            fed += 1
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        raise
+    finally:
+        # статусы уже отправленных должны попасть в БД даже при отмене (иначе — повтор после рестарта)
+        await results.close()
+
+    stats = await asyncio.to_thread(_finish, bc_id)
+    log.info("[BC] #%s done in %.1fs: %s (this run: %d, %d flushes)",
+             bc_id, time.monotonic() - started, stats, fed, results.flushes)
+    return stats
+
+
+async def _run_and_report(bot: Bot, bc_id: int, notify_chat: Optional[int], control: BroadcastControl) -> None:
+    state, stats = "error", None
+    try:
+        stats = await run_broadcast(bot, bc_id, control=control)
+        state = "done"
+    except asyncio.CancelledError:
+        log.info("[BC] #%s interrupted; will resume from queued rows", bc_id)
+        state = None  # итог панели покажет тот, кто отменил (cancel_broadcast / остановка бота)
+        raise
+    except Exception as e:
+        log.exception("[BC] #%s failed: %s", bc_id, e)
+        return
+    finally:
+        _RUNNING.pop(bc_id, None)
+        _CONTROLS.pop(bc_id, None)
+        if control.panel is not None:
+            await control.panel.close(state, stats if stats is not None else control.stats())
+    if notify_chat:
+        try:
+            await bot.send_message(
+                notify_chat,
+                f"Рассылка #{bc_id} завершена. Отправлено: {stats['sent']}/{stats['total']}. "
+                f"Ошибок: {stats['failed']}.",
+            )
+        except Exception:
+            pass
+
+
+def start_broadcast(bot: Bot, bc_id: int, *, notify_chat: Optional[int] = None,
+                    panel_chat: Optional[int] = None, panel_message: Optional[int] = None) -> asyncio.Task:
+    """
+    Запустить рассылку фоном; повторный вызов для уже идущей рассылки возвращает её задачу.
+    panel_chat — куда выводить панель прогресса (panel_message — уже отправленное сообщение для правок).
+    """
+    task = _RUNNING.get(bc_id)
+    if task is None or task.done():
+        control = BroadcastControl()
+        if panel_chat is not None:
+            control.panel = ProgressPanel(bot, bc_id, panel_chat, panel_message)
+        task = asyncio.create_task(_run_and_report(bot, bc_id, notify_chat, control), name=f"broadcast-{bc_id}")
+        _RUNNING[bc_id] = task
+        _CONTROLS[bc_id] = control
+    return task
+
+
+async def pause_broadcast(bc_id: int) -> bool:
+    """Поставить идущую рассылку на паузу (статус 'paused' сохраняется в БД)."""
+    control = _CONTROLS.get(bc_id)
+    if control is None:
+        return False
+    control.running.clear()
+    await asyncio.to_thread(_set_status, bc_id, "paused")
+    if control.panel is not None:
+        control.panel.poke()
+    return True
+
+
+async def resume_broadcast(bot: Bot, bc_id: int, *, notify_chat: Optional[int] = None,
+                           panel_chat: Optional[int] = None, panel_message: Optional[int] = None) -> bool:
+    """Снять паузу; если задачи нет (пауза пережила рестарт) — запустить рассылку с queued-строк."""
+    control = _CONTROLS.get(bc_id)
+    if control is not None:
+        await asyncio.to_thread(_set_status, bc_id, "sending")
+        control.running.set()
+        if control.panel is not None:
+            control.panel.poke()
+        return True
+
+    def _status() -> Optional[str]:
+        with get_db_connection(readonly=True) as con:
+            row = con.execute("SELECT status FROM broadcasts WHERE id=?", (bc_id,)).fetchone()
+        return row[0] if row else None
+
+    if await asyncio.to_thread(_status) not in ("paused", "sending"):
+        return False
+    start_broadcast(bot, bc_id, notify_chat=notify_chat, panel_chat=panel_chat, panel_message=panel_message)
+    return True
+
+
+async def cancel_broadcast(bc_id: int) -> Dict[str, int]:
+    """
+    Остановить рассылку и пометить оставшиеся queued-строки 'cancelled'.
+    Итоги уже отправленных дописываются до отмены строк (ResultBuffer.close в run_broadcast).
+    """
+    control = _CONTROLS.get(bc_id)
+    task = _RUNNING.get(bc_id)
+    if task is not None and not task.done():
+        if control is not None:
+            control.running.set()  # воркеры на паузе тоже должны завершиться
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    stats = await asyncio.to_thread(_cancel_rows, bc_id)
+    if control is not None and control.panel is not None:
+        await control.panel.refresh("cancelled", stats)
+    return stats
+
+
+async def resume_broadcasts(bot: Bot) -> List[int]:
+    """Продолжить рассылки, прерванные рестартом (status='sending' и есть queued-получатели)."""
+    def _pending() -> List[Tuple[int, Optional[int]]]:
+        with get_db_connection(readonly=True) as con:
+            try:
+                rows = con.execute(
+                    """
+                    SELECT b.id, b.created_by FROM broadcasts b
+                    WHERE b.status = 'sending'
+                      AND EXISTS (SELECT 1 FROM broadcast_recipients r
+                                  WHERE r.broadcast_id = b.id AND r.status = 'queued')
+                    ORDER BY b.id
+                    """
+                ).fetchall()
+            except Exception:  # таблиц рассылок ещё нет
+                return []
+        return [(int(r[0]), r[1]) for r in rows]
+
+    ids = []
+    for bc_id, created_by in await asyncio.to_thread(_pending):
+        log.info("[BC] resuming broadcast #%s", bc_id)
+        # старое сообщение-панель не сохраняется — автор получит новую
+        start_broadcast(bot, bc_id, notify_chat=created_by, panel_chat=created_by)
+        ids.append(bc_id)
+    return ids
+
+
+async def stop_broadcasts() -> None:
+    tasks = list(_RUNNING.values())
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
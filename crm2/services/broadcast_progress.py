@@ -0,0 +1,183 @@
+# crm2/services/broadcast_progress.py
+# Назначение: Живая панель прогресса рассылки в чате админа.
+#             Одно сообщение на рассылку редактируется не чаще раза в CRM_BC_PROGRESS_S секунд и только
+#             при изменении текста: отправлено/ошибки/в очереди, текущая скорость (сообщений/с), ETA и
+#             пауза после TelegramRetryAfter; кнопки пауза/продолжить/отмена (callback bcp:*).
+#             Счётчики берутся из памяти движка (ResultBuffer.stats) — панель не читает БД.
+#             Правки идут через общий планировщик исходящих: ~1 правка за 5 с при лимите ~28 сообщений/с.
+# Классы:
+# - ProgressPanel - Сообщение-панель одной рассылки с объединением правок
+# Функции:
+# - _fmt_duration - Длительность в виде «1 ч 05 мин» / «3 мин 10 с»
+# - format_progress - Текст панели по счётчикам и состоянию рассылки
+# - progress_kb - Кнопки управления для состояния рассылки
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from crm2.services.outbound import scheduler
+
+log = logging.getLogger(__name__)
+
+try:
+    PROGRESS_S = float(os.getenv("CRM_BC_PROGRESS_S", "5"))
+except ValueError:
+    PROGRESS_S = 5.0
+# Минимальный зазор между правками даже при нажатии кнопок
+MIN_GAP_S = 1.0
+
+STATE_TITLE: Dict[str, str] = {
+    "sending": "📤 Идёт отправка",
+    "paused": "⏸ На паузе",
+    "done": "✅ Завершена",
+    "cancelled": "✖️ Отменена",
+    "error": "⚠️ Остановлена с ошибкой",
+}
+
+
+def _fmt_duration(seconds: float) -> str:
+    seconds = int(max(0, seconds))
+    h, rest = divmod(seconds, 3600)
+    m, s = divmod(rest, 60)
+    if h:
+        return f"{h} ч {m:02d} мин"
+    if m:
+        return f"{m} мин {s:02d} с"
+    return f"{s} с"
+
+
+def format_progress(bc_id: int, stats: Dict[str, int], state: str, *,
+                    rate: Optional[float] = None, backoff: float = 0.0) -> str:
+    total = stats.get("total", 0)
+    sent, failed = stats.get("sent", 0), stats.get("failed", 0)
+    cancelled = stats.get("cancelled", 0)
+    queued = max(0, total - sent - failed - cancelled)
+    lines = [
+        f"Рассылка #{bc_id}: {STATE_TITLE.get(state, state)}",
+        f"📨 Отправлено: {sent}/{total}",
+        f"❌ Ошибок: {failed}",
+        f"⏳ В очереди: {queued}",
+    ]
+    if stats.get("unreachable"):
+        lines.append(f"🚫 Недоступны: {stats['unreachable']}")
+    if cancelled:
+        lines.append(f"✖️ Отменено: {cancelled}")
+    if state == "sending":
+        if rate:
+            lines.append(f"⚡ {rate:.1f} сообщ./с, осталось ≈ {_fmt_duration(queued / rate)}")
+        if backoff > 0:
+            lines.append(f"🧊 Лимит Telegram: пауза {backoff:.0f} с")
+    return "\n".join(lines)
+
+
+def progress_kb(bc_id: int, state: str) -> Optional[InlineKeyboardMarkup]:
+    if state == "sending":
+        row = [InlineKeyboardButton(text="⏸ Пауза", callback_data=f"bcp:pause:{bc_id}")]
+    elif state == "paused":
+        row = [InlineKeyboardButton(text="▶️ Продолжить", callback_data=f"bcp:resume:{bc_id}")]
+    else:
+        return None
+    row.append(InlineKeyboardButton(text="✖️ Отменить", callback_data=f"bcp:cancel:{bc_id}"))
+    return InlineKeyboardMarkup(inline_keyboard=[row])
+
+
+class ProgressPanel:
+    """
+    Панель одной рассылки. stats/state — источники из движка (вызываются при каждой правке).
+    poke() просит обновить раньше срока (смена состояния), но не чаще MIN_GAP_S.
+    """
+
+    def __init__(self, bot: Bot, bc_id: int, chat_id: int, message_id: Optional[int] = None,
+                 *, interval: float = PROGRESS_S):
+        self.bot = bot
+        self.bc_id = bc_id
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = max(MIN_GAP_S, interval)
+        self.edits = 0
+        self._stats: Callable[[], Dict[str, int]] = lambda: {}
+        self._state: Callable[[], str] = lambda: "sending"
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._last_text: Optional[str] = None
+        self._last_at = 0.0
+        self._sample: Optional[tuple] = None  # (monotonic, done) для скорости
+        self._rate: Optional[float] = None
+        self._broken = False
+
+    def attach(self, stats: Callable[[], Dict[str, int]], state: Callable[[], str]) -> "ProgressPanel":
+        self._stats, self._state = stats, state
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop(), name=f"bc-{self.bc_id}-progress")
+        return self
+
+    def poke(self) -> None:
+        self._wake.set()
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            gap = MIN_GAP_S - (time.monotonic() - self._last_at)
+            if gap > 0:
+                await asyncio.sleep(gap)
+            await self.refresh()
+
+    def _measure(self, stats: Dict[str, int]) -> Optional[float]:
+        now, done = time.monotonic(), stats.get("sent", 0) + stats.get("failed", 0)
+        if self._sample is not None and now > self._sample[0]:
+            current = (done - self._sample[1]) / (now - self._sample[0])
+            # сглаживаем, чтобы ETA не прыгал от пачки к пачке
+            self._rate = current if self._rate is None else 0.5 * self._rate + 0.5 * current
+        self._sample = (now, done)
+        return self._rate
+
+    async def refresh(self, state: Optional[str] = None, stats: Optional[Dict[str, int]] = None) -> None:
+        if self._broken:
+            return
+        state = state or self._state()
+        stats = stats if stats is not None else self._stats()
+        rate = self._measure(stats)
+        text = format_progress(self.bc_id, stats, state, rate=rate, backoff=scheduler.bucket.paused_for())
+        if text == self._last_text:
+            return
+        kb = progress_kb(self.bc_id, state)
+        try:
+            if self.message_id is None:
+                msg = await self.bot.send_message(self.chat_id, text, reply_markup=kb)
+                self.message_id = msg.message_id
+            else:
+                await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id,
+                                                 reply_markup=kb)
+            self.edits += 1
+            self._last_text = text
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e).lower():
+                self._last_text = text  # на экране уже этот текст
+            else:
+                log.info("[BC] #%s progress panel disabled: %s", self.bc_id, e)
+                self._broken = True  # сообщение удалено / недоступно — рассылку это не останавливает
+        except Exception as e:
+            # сетевой сбой: _last_text не трогаем, чтобы следующий refresh повторил правку
+            log.debug("[BC] #%s progress edit failed: %s", self.bc_id, e)
+        self._last_at = time.monotonic()
+
+    async def close(self, state: Optional[str] = None, stats: Optional[Dict[str, int]] = None) -> None:
+        """Остановить периодические правки и показать итоговое состояние."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if state is not None:
+            await self.refresh(state, stats)
@@ -0,0 +1,74 @@
+# crm2/services/cache_bus.py
+# Назначение: Шина инвалидации кэшей между процессами-обработчиками кластера (BOT_MODE=cluster).
+#             Кэши в памяти (пользователи, индекс расписания, HTML текстов, множество недоступных) сбрасываются
+#             локально их модулями; publish() дополнительно отправляет сброс через процесс-писатель
+#             (crm2/db/writer_process.py, роль «bus») остальным обработчикам, где его выполняют обработчики,
+#             зарегистрированные subscribe(). Без кластера (connect() не вызывался) publish() ничего не делает.
+#             Сброс приходит после commit записи, поэтому следующее чтение в другом процессе видит новые данные.
+# Функции:
+# - subscribe - Зарегистрировать локальный сброс кэша для темы
+# - publish - Разослать сброс остальным процессам (локальный кэш вызывающий сбрасывает сам)
+# - _dispatch - Выполнить сброс, пришедший от другого процесса
+# - _listen - Поток приёма сбросов от процесса-писателя
+# - connect - Подключиться к шине (процесс-обработчик кластера)
+# - close - Отключиться от шины
+from __future__ import annotations
+
+import logging
+import threading
+from multiprocessing.connection import Client, Connection
+from typing import Any, Callable, Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+_HANDLERS: Dict[str, List[Callable[[Any], None]]] = {}
+_conn: Optional[Connection] = None
+_send_lock = threading.Lock()
+
+
+def subscribe(topic: str, handler: Callable[[Any], None]) -> None:
+    """handler(key) вызывается в потоке шины — он должен быть потокобезопасным и не вызывать publish()."""
+    _HANDLERS.setdefault(topic, []).append(handler)
+
+
+def publish(topic: str, key: Any = None) -> None:
+    conn = _conn
+    if conn is None:
+        return
+    try:
+        with _send_lock:
+            conn.send((topic, key))
+    except (OSError, ValueError) as e:
+        log.warning("[CACHE-BUS] publish %s failed: %s", topic, e)
+
+
+def _dispatch(topic: str, key: Any) -> None:
+    for handler in _HANDLERS.get(topic, ()):
+        try:
+            handler(key)
+        except Exception as e:
+            log.warning("[CACHE-BUS] %s handler failed: %s", topic, e)
+
+
+def _listen(conn: Connection) -> None:
+    while True:
+        try:
+            topic, key = conn.recv()
+        except (EOFError, OSError):
+            return
+        _dispatch(topic, key)
+
+
+def connect(address: str, authkey: bytes) -> None:
+    global _conn
+    conn = Client(address, family="AF_UNIX", authkey=authkey)
+    conn.send(("bus",))
+    _conn = conn
+    threading.Thread(target=_listen, args=(conn,), name="cache-bus", daemon=True).start()
+
+
+def close() -> None:
+    global _conn
+    conn, _conn = _conn, None
+    if conn is not None:
+        conn.close()
@@ -4,15 +4,17 @@
 # - ContentKey - Литерал ключей контента (mode, meanings)
 # Функции:
 # - _sanitize_html_for_telegram - Санитизация HTML для Telegram (удаление опасных тегов)
-# - load_html - Загрузка и преобразование markdown-файла в HTML
+# - _render - Чтение markdown-файла и преобразование в HTML
+# - _stat_key - (mtime_ns, size) файла контента; None — файла нет
+# - load_html - HTML по ключу (из кэша, если файл не менялся; иначе — _render)
+# - _drop - Сброс кэша HTML в этом процессе
+# - invalidate - Сброс кэша HTML (вызывается наблюдателем hot_reload; в кластере — во всех процессах)
+# - warm - Прогрев кэша для всех ключей
 from pathlib import Path
-from typing import Literal
+from typing import Dict, Literal, Optional, Tuple
 import re
 
-try:
-    import markdown as _md
-except Exception:
-    _md = None
+from crm2.services import cache_bus
 
 ContentKey = Literal["mode", "meanings"]
 
@@ -24,6 +26,11 @@ _FILES = {
 
 _ALLOWED = ("b", "i", "u", "s", "a", "code", "pre")
 
+# key -> ((mtime_ns, size) файла, готовый HTML). Запись сверяется со stat() файла при каждом чтении —
+# правка .md видна в любом процессе (обработчики кластера) и при CRM_HOT_RELOAD=0;
+# наблюдатель hot_reload лишь прогревает кэш заранее
+_CACHE: Dict[str, Tuple[Optional[Tuple[int, int]], str]] = {}
+
 
 def _sanitize_html_for_telegram(html: str) -> str:
     """Привести Markdown-HTML к безопасному подмножеству Telegram HTML и выровнять теги."""
@@ -76,13 +83,53 @@ def _sanitize_html_for_telegram(html: str) -> str:
 
 
 
-def load_html(key: ContentKey) -> str:
+def _render(key: ContentKey) -> str:
     path = _FILES[key]
     if not path.exists():
         return "<b>Текст временно недоступен.</b>"
     text = path.read_text(encoding="utf-8")
+    # markdown импортируется при первом рендере, а не при старте бота
+    try:
+        import markdown as _md
+    except Exception:
+        _md = None
     if _md is None:
         from html import escape
         return f"<pre>{escape(text)}</pre>"
     html = _md.markdown(text, extensions=["extra", "sane_lists"])
     return _sanitize_html_for_telegram(html)
+
+
+def _stat_key(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def load_html(key: ContentKey) -> str:
+    stat_key = _stat_key(_FILES[key])
+    cached = _CACHE.get(key)
+    if cached is not None and cached[0] == stat_key:
+        return cached[1]
+    html = _render(key)
+    _CACHE[key] = (stat_key, html)
+    return html
+
+
+def _drop(_key=None) -> None:
+    _CACHE.clear()
+
+
+def invalidate() -> None:
+    _drop()
+    cache_bus.publish("content")
+
+
+cache_bus.subscribe("content", _drop)
+
+
+def warm() -> None:
+    for key in _FILES:
+        load_html(key)
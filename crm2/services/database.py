@@ -1,19 +1,24 @@
 # crm2/services/database.py
-# Назначение: Асинхронная обертка для работы с SQLite базой данных
+# Назначение: Асинхронная обертка для работы с SQLite базой данных (поверх общего пула соединений)
 # Классы:
 # - Database - Асинхронный клиент базы данных с методами execute, fetch_all, fetch_one
 # Функции:
 # - _resolve_db_path - Определение пути к файлу БД через переменные окружения
 # Методы Database:
+# - _execute_sync / _fetch_sync - Синхронные операции на соединениях пула (выполняются в потоке)
 # - execute - Выполнение запросов на изменение данных
+# - execute_batched - Запись через очередь группового коммита (crm2/db/write_queue.py)
 # - fetch_all - Выполнение запросов и возврат всех результатов
 # - fetch_one - Выполнение запросов и возврат одной строки
-import aiosqlite
+import asyncio
 import logging
 import os
 import pathlib
 from typing import List, Dict, Any, Optional
 
+from crm2.db.pool import get_pool
+from crm2.db.write_queue import get_write_queue
+
 logger = logging.getLogger(__name__)
 
 def _resolve_db_path() -> str:
@@ -40,24 +45,38 @@ class Database:
     def __init__(self, db_path: str = DB_PATH):
         self.db_path = db_path
 
+    def _execute_sync(self, query: str, params: tuple) -> None:
+        with get_pool(self.db_path).writer() as con:
+            con.execute(query, params)
+
+    def _fetch_sync(self, query: str, params: tuple, one: bool):
+        with get_pool(self.db_path).reader() as con:
+            cursor = con.execute(query, params)
+            if one:
+                row = cursor.fetchone()
+                return dict(row) if row else None
+            return [dict(row) for row in cursor.fetchall()]
+
     async def execute(self, query: str, params: tuple = ()) -> None:
         """Выполняет запрос на изменение данных"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute(query, params)
-                await db.commit()
+            await asyncio.to_thread(self._execute_sync, query, params)
         except Exception as e:
             logger.error(f"Database execute error: {e}")
             raise
 
+    async def execute_batched(self, query: str, params: tuple = ()) -> int:
+        """Мелкая запись через очередь группового коммита; завершается после коммита пачки"""
+        try:
+            return await get_write_queue(self.db_path).execute(query, params)
+        except Exception as e:
+            logger.error(f"Database execute_batched error: {e}")
+            raise
+
     async def fetch_all(self, query: str, params: tuple = ()) -> List[Dict[str, Any]]:
         """Выполняет запрос и возвращает все результаты"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
-                cursor = await db.execute(query, params)
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+            return await asyncio.to_thread(self._fetch_sync, query, params, False)
         except Exception as e:
             logger.error(f"Database fetch_all error: {e}")
             return []
@@ -65,11 +84,7 @@ class Database:
     async def fetch_one(self, query: str, params: tuple = ()) -> Optional[Dict[str, Any]]:
         """Выполняет запрос и возвращает одну строку"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
-                cursor = await db.execute(query, params)
-                row = await cursor.fetchone()
-                return dict(row) if row else None
+            return await asyncio.to_thread(self._fetch_sync, query, params, True)
         except Exception as e:
             logger.error(f"Database fetch_one error: {e}")
             return None
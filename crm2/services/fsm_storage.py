@@ -0,0 +1,298 @@
+# crm2/services/fsm_storage.py
+# Назначение: Хранилище FSM aiogram в SQLite проекта с кэшем в памяти и отложенной записью (write-behind).
+#             Чтение состояния — из кэша (промах один раз читает строку fsm_state, отсутствие тоже кэшируется);
+#             set_state/set_data меняют кэш и помечают ключ «грязным», фоновая задача раз в CRM_FSM_FLUSH_S
+#             (или при CRM_FSM_BATCH изменений) пишет пачку одной транзакцией. Остановка бота дописывает
+#             хвост — незавершённые рассылка, ввод ссылок ДЗ, регистрация переживают рестарт.
+#             Состояния, не менявшиеся дольше CRM_FSM_TTL_S, считаются брошенными: сбрасываются при чтении
+#             и удаляются периодической чисткой; кэш ограничен CRM_FSM_CACHE (LRU, грязные не вытесняются).
+#             Чат всегда обслуживает один процесс (polling, webhook с одним воркером, шард кластера), поэтому
+#             кэш включён по умолчанию; CRM_FSM_SHARED=1 — без кэша (чтение из БД, запись сразу) для
+#             нескольких экземпляров сервиса на одной БД.
+# Классы:
+# - _Entry - Состояние и данные одного ключа FSM в кэше
+# - SQLiteStorage - BaseStorage aiogram поверх таблицы fsm_state
+# Функции:
+# - _env_int - Чтение целого из переменной окружения
+# - ensure_fsm_table - Создание таблицы fsm_state
+# - _key - Строковый ключ строки fsm_state из StorageKey
+# - _load_row - Чтение состояния ключа из БД
+# - _write_rows - Запись пачки изменений одной транзакцией
+# - _delete_expired - Удаление брошенных состояний старше TTL
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from crm2.db.core import get_db_connection
+
+log = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, ""))
+    except ValueError:
+        return default
+
+
+# Окно отложенной записи и размер пачки, после которого пишем не дожидаясь окна
+FLUSH_S = _env_int("CRM_FSM_FLUSH_S", 1)
+MAX_BATCH = _env_int("CRM_FSM_BATCH", 200)
+# Брошенное состояние (сутки без изменений) сбрасывается; чистка таблицы — раз в SWEEP_S
+TTL_S = _env_int("CRM_FSM_TTL_S", 24 * 3600)
+SWEEP_S = _env_int("CRM_FSM_SWEEP_S", 600)
+# Сколько ключей держим в кэше (включая «состояния нет»)
+CACHE_SIZE = _env_int("CRM_FSM_CACHE", 50_000)
+SHARED = _env_int("CRM_FSM_SHARED", 0) == 1
+
+
+def ensure_fsm_table(con) -> None:
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fsm_state (
+            key        TEXT PRIMARY KEY,
+            state      TEXT,
+            data       TEXT,
+            updated_at REAL NOT NULL
+        )
+        """
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS idx_fsm_state_updated ON fsm_state(updated_at)")
+
+
+def _key(key: StorageKey) -> str:
+    parts = (key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny)
+    return ":".join("" if p is None else str(p) for p in parts)
+
+
+def _load_row(k: str) -> Optional[Tuple[Optional[str], Optional[str], float]]:
+    with get_db_connection(readonly=True) as con:
+        row = con.execute("SELECT state, data, updated_at FROM fsm_state WHERE key = ?", (k,)).fetchone()
+    return (row[0], row[1], row[2]) if row else None
+
+
+def _write_rows(rows: List[Tuple[str, Optional[str], Optional[str], float]]) -> None:
+    """rows: (key, state, data_json, updated_at); пустые state и data — удалить строку."""
+    upserts = [r for r in rows if r[1] is not None or r[2] is not None]
+    deletes = [(r[0],) for r in rows if r[1] is None and r[2] is None]
+    with get_db_connection() as con:
+        if upserts:
+            con.executemany(
+                """
+                INSERT INTO fsm_state(key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+                """,
+                upserts,
+            )
+        if deletes:
+            con.executemany("DELETE FROM fsm_state WHERE key = ?", deletes)
+        con.commit()
+
+
+def _delete_expired(before: float) -> int:
+    with get_db_connection() as con:
+        cur = con.execute("DELETE FROM fsm_state WHERE updated_at < ?", (before,))
+        con.commit()
+        return cur.rowcount
+
+
+class _Entry:
+    __slots__ = ("state", "data", "updated")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None, updated: float = 0.0):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.updated = updated
+
+    def empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище: кэш ключей (LRU) + отложенная запись пачками в fsm_state.
+    Порядок изменений одного ключа сохраняется: в пачку уходит последнее состояние ключа.
+    """
+
+    def __init__(self, *, flush_s: float = FLUSH_S, max_batch: int = MAX_BATCH, ttl_s: float = TTL_S,
+                 cache_size: int = CACHE_SIZE, shared: bool = SHARED):
+        self.flush_s = max(0.05, flush_s)
+        self.max_batch = max(1, max_batch)
+        self.ttl_s = ttl_s
+        self.cache_size = max(1, cache_size)
+        self.shared = shared
+        self._cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._dirty: Dict[str, _Entry] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._table_ready = False
+        self._closed = False
+        self._last_sweep = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.expired = 0
+
+    # ---------- BaseStorage ----------
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k, e = await self._entry(key)
+        e.state = state.state if isinstance(state, State) else state
+        await self._touch(k, e)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(key))[1].state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k, e = await self._entry(key)
+        e.data = dict(data)
+        await self._touch(k, e)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._entry(key))[1].data)
+
+    async def close(self) -> None:
+        """Дописать изменения и остановить фоновую запись (Dispatcher вызывает при shutdown)."""
+        self._closed = True
+        if self._task is not None:
+            # без cancel: пачка, которая уже пишется, должна дописаться
+            self._wake.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        log.info("[FSM] storage closed: %s", self.stats())
+
+    # ---------- кэш ----------
+
+    def _expired(self, e: _Entry, now: float) -> bool:
+        return self.ttl_s > 0 and not e.empty() and now - e.updated > self.ttl_s
+
+    async def _ensure_table(self) -> None:
+        if not self._table_ready:
+            def _create() -> None:
+                with get_db_connection() as con:
+                    ensure_fsm_table(con)
+                    con.commit()
+            await asyncio.to_thread(_create)
+            self._table_ready = True
+
+    async def _entry(self, key: StorageKey) -> Tuple[str, _Entry]:
+        k = _key(key)
+        e = None if self.shared else self._cache.get(k)
+        if e is not None:
+            self.hits += 1
+            self._cache.move_to_end(k)
+        else:
+            self.misses += 1
+            await self._ensure_table()
+            row = await asyncio.to_thread(_load_row, k)
+            cached = None if self.shared else self._cache.get(k)
+            if cached is not None:  # ключ загрузили/изменили, пока ждали БД
+                e = cached
+            else:
+                e = _Entry()
+                if row is not None:
+                    e.state, e.data, e.updated = row[0], json.loads(row[1]) if row[1] else {}, row[2]
+                if not self.shared:
+                    self._cache[k] = e
+                    self._evict()
+        if self._expired(e, time.time()):
+            self.expired += 1
+            e.state, e.data = None, {}
+            await self._touch(k, e)
+        return k, e
+
+    def _evict(self) -> None:
+        over = len(self._cache) - self.cache_size
+        if over <= 0:
+            return
+        for k in list(self._cache):
+            if over <= 0:
+                break
+            if k not in self._dirty:
+                del self._cache[k]
+                over -= 1
+
+    # ---------- запись ----------
+
+    async def _touch(self, k: str, e: _Entry) -> None:
+        e.updated = time.time()
+        self._dirty[k] = e
+        if self.shared or self._closed:
+            await self.flush()
+            return
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="fsm-write-behind")
+        if len(self._dirty) >= self.max_batch:
+            self._wake.set()
+
+    async def flush(self) -> None:
+        """Записать все грязные ключи одной транзакцией (при ошибке — вернуть их в очередь)."""
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        # данные сериализуются сейчас: дальнейшие изменения попадут в следующую пачку
+        rows = [(k, e.state, json.dumps(e.data, ensure_ascii=False) if e.data else None, e.updated)
+                for k, e in batch.items()]
+        try:
+            await self._ensure_table()
+            await asyncio.to_thread(_write_rows, rows)
+        except Exception as e:
+            log.error("[FSM] flush of %d keys failed: %s", len(rows), e)
+            for k, entry in batch.items():
+                self._dirty.setdefault(k, entry)
+            return
+        self.flushes += 1
+        self.rows_written += len(rows)
+
+    async def _run(self) -> None:
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+            now = time.time()
+            if self.ttl_s > 0 and now - self._last_sweep >= SWEEP_S:
+                self._last_sweep = now
+                await self._sweep(now)
+
+    async def _sweep(self, now: float) -> None:
+        for k, e in list(self._cache.items()):
+            if k not in self._dirty and self._expired(e, now):
+                del self._cache[k]
+        try:
+            n = await asyncio.to_thread(_delete_expired, now - self.ttl_s)
+        except Exception as e:
+            log.warning("[FSM] sweep failed: %s", e)
+            return
+        if n:
+            self.expired += n
+            log.info("[FSM] removed %d abandoned states older than %ss", n, self.ttl_s)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "cached": len(self._cache),
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "expired": self.expired,
+            "shared": self.shared,
+        }
@@ -0,0 +1,321 @@
+# crm2/services/homework_pipeline.py
+# Назначение: Конвейер доставки ДЗ присутствовавшим на занятии.
+#             Задание (homework_jobs) хранит занятие и текст; получатели — один anti-join запрос
+#             (attendance ⋈ users без homework_delivery и без недоступных), читаемый пачками по keyset.
+#             Несколько воркеров отправляют параллельно через общий планировщик исходящих (класс HOMEWORK),
+#             отметки доставки копятся в памяти и пишутся executemany одной транзакцией раз в N/T.
+#             Задание в статусе 'sending' после рестарта продолжается: anti-join сам отдаёт тех, кому
+#             отметка доставки ещё не записана. Схема создаётся один раз при старте (auto_migrate).
+# Классы:
+# - HomeworkJob - Задание на доставку ДЗ
+# - _MarkBuffer - Буфер отметок доставки с пакетной записью
+# Функции:
+# - _env_float - Чтение числа из переменной окружения
+# - _pending_sql - Anti-join запрос получателей задания
+# - count_pending - Число получателей, которым ДЗ ещё не доставлено
+# - _fetch_pending - Очередная пачка получателей (keyset по users.id)
+# - iter_pending - Асинхронный генератор получателей пачками
+# - create_job - Создание задания на доставку (или уже идущее задание по занятию)
+# - _load_job - Чтение задания
+# - _write_marks - Запись пачки отметок доставки и недоступных получателей
+# - _finish_job - Итоговая статистика и закрытие задания
+# - run_homework - Полный прогон задания
+# - _run_and_report - Фоновый прогон с уведомлением автора
+# - start_homework - Запуск задания фоновой задачей (идемпотентно)
+# - resume_homework_jobs - Возобновление незавершённых заданий при старте бота
+# - stop_homework_jobs - Остановка задач (отметки дописываются, задания продолжатся после рестарта)
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+
+from crm2.db.core import get_db_connection
+from crm2.services.outbound import Priority, install, priority
+from crm2.services.reachability import classify_failure, mark_unreachable_many, reachable_clause
+
+log = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, ""))
+    except ValueError:
+        return default
+
+
+# Воркеров на задание, размер пачки чтения, запись отметок: по FLUSH_ROWS или раз в FLUSH_S секунд
+WORKERS = int(_env_float("CRM_HW_WORKERS", 8))
+FETCH_BATCH = int(_env_float("CRM_HW_FETCH", 200))
+FLUSH_ROWS = int(_env_float("CRM_HW_FLUSH_ROWS", 50))
+FLUSH_S = _env_float("CRM_HW_FLUSH_S", 1.0)
+
+
+@dataclass
+class HomeworkJob:
+    id: int
+    session_id: int
+    body: str
+    link: str
+    created_by: Optional[int]
+
+
+def _pending_sql(extra: str = "") -> str:
+    """(users.id, telegram_id) присутствовавших без отметки доставки; недоступные исключены."""
+    return f"""
+        SELECT a.user_id, u.telegram_id
+        FROM attendance a
+        JOIN users u ON u.id = a.user_id
+        WHERE a.session_id = ?
+          AND a.status = 'present'
+          AND u.telegram_id IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM homework_delivery h
+                          WHERE h.session_id = a.session_id AND h.user_id = a.user_id)
+          AND {reachable_clause('u.telegram_id')}
+          {extra}
+    """
+
+
+def count_pending(session_id: int) -> int:
+    with get_db_connection(readonly=True) as con:
+        return int(con.execute(
+            f"SELECT COUNT(*) FROM ({_pending_sql('GROUP BY a.user_id')})", (session_id,)
+        ).fetchone()[0])
+
+
+def _fetch_pending(session_id: int, after_uid: int, limit: int) -> List[Tuple[int, int]]:
+    with get_db_connection(readonly=True) as con:
+        rows = con.execute(
+            _pending_sql("AND a.user_id > ? GROUP BY a.user_id ORDER BY a.user_id LIMIT ?"),
+            (session_id, after_uid, limit),
+        ).fetchall()
+    return [(int(r[0]), int(r[1])) for r in rows]
+
+
+async def iter_pending(session_id: int, batch: int = FETCH_BATCH) -> AsyncIterator[Tuple[int, int]]:
+    after = -(2 ** 63)
+    while True:
+        rows = await asyncio.to_thread(_fetch_pending, session_id, after, batch)
+        for row in rows:
+            yield row
+        if len(rows) < batch:
+            return
+        after = rows[-1][0]
+
+
+def create_job(session_id: int, links: List[str], created_by: Optional[int]) -> Tuple[int, bool]:
+    """(id задания, создано ли новое). Пока по занятию идёт задание, второе не создаётся — без дублей."""
+    body = "📚 Домашнее задание:\n" + "\n".join(links)
+    with get_db_connection() as con:
+        row = con.execute(
+            "SELECT id FROM homework_jobs WHERE session_id = ? AND status = 'sending' ORDER BY id LIMIT 1",
+            (session_id,),
+        ).fetchone()
+        if row is not None:
+            return int(row[0]), False
+        cur = con.execute(
+            "INSERT INTO homework_jobs(session_id, body, link, created_by, status) VALUES (?, ?, ?, ?, 'sending')",
+            (session_id, body, links[0], created_by),
+        )
+        con.commit()
+        return int(cur.lastrowid), True
+
+
+def _load_job(job_id: int) -> HomeworkJob:
+    with get_db_connection(readonly=True) as con:
+        row = con.execute(
+            "SELECT id, session_id, body, link, created_by FROM homework_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    if row is None:
+        raise ValueError(f"homework job {job_id} not found")
+    return HomeworkJob(int(row[0]), int(row[1]), row[2] or "", row[3] or "", row[4])
+
+
+def _write_marks(marks: List[Tuple[int, int, str]], dead: List[Tuple[int, str, Optional[str], str]]) -> None:
+    """marks: (session_id, users.id, link); dead: (telegram_id, reason, error, failed_at). Одна транзакция."""
+    with get_db_connection() as con:
+        con.executemany(
+            "INSERT OR IGNORE INTO homework_delivery(session_id, user_id, link) VALUES (?, ?, ?)", marks
+        )
+        if dead:
+            mark_unreachable_many(con, dead)
+        con.commit()
+
+
+class _MarkBuffer:
+    """Отметки доставки в памяти; запись пачкой по max_rows или раз в interval секунд."""
+
+    def __init__(self, *, max_rows: int = FLUSH_ROWS, interval: float = FLUSH_S):
+        self.max_rows = max(1, max_rows)
+        self.interval = max(0.1, interval)
+        self.flushes = 0
+        self._marks: List[Tuple[int, int, str]] = []
+        self._dead: List[Tuple[int, str, Optional[str], str]] = []
+        self._lock = asyncio.Lock()
+        self._stop = asyncio.Event()
+        self._flushing: Optional[asyncio.Task] = None
+        self._timer = asyncio.create_task(self._tick(), name="hw-flush")
+
+    def delivered(self, session_id: int, uid: int, link: str) -> None:
+        self._marks.append((session_id, uid, link))
+        if len(self._marks) >= self.max_rows and (self._flushing is None or self._flushing.done()):
+            self._flushing = asyncio.create_task(self.flush())
+
+    def unreachable(self, telegram_id: int, reason: str, err: str) -> None:
+        self._dead.append((telegram_id, reason, err, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())))
+
+    async def _tick(self) -> None:
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._marks and not self._dead:
+                return
+            marks, self._marks = self._marks, []
+            dead, self._dead = self._dead, []
+            try:
+                await asyncio.to_thread(_write_marks, marks, dead)
+                self.flushes += 1
+            except Exception as e:
+                log.warning("[HW] flush of %d marks failed, will retry: %s", len(marks), e)
+                self._marks[:0] = marks
+                self._dead[:0] = dead
+
+    async def close(self) -> None:
+        self._stop.set()
+        await asyncio.gather(self._timer, return_exceptions=True)
+        if self._flushing is not None:
+            await asyncio.gather(self._flushing, return_exceptions=True)
+        await self.flush()
+
+
+def _finish_job(job_id: int, stats: Dict[str, int]) -> None:
+    with get_db_connection() as con:
+        con.execute(
+            "UPDATE homework_jobs SET status='done', finished_at=CURRENT_TIMESTAMP, stats_json=? WHERE id=?",
+            (json.dumps(stats, ensure_ascii=False), job_id),
+        )
+        con.commit()
+
+
+async def run_homework(bot: Bot, job_id: int, *, workers: int = WORKERS) -> Dict[str, int]:
+    """
+    Доставляет ДЗ задания всем, кому оно ещё не доставлено, и закрывает задание.
+    Повторный запуск безопасен: получатели с отметкой доставки в выборку не попадают.
+    """
+    job = await asyncio.to_thread(_load_job, job_id)
+    install(bot)
+    stats = {"sent": 0, "failed": 0, "unreachable": 0}
+    marks = _MarkBuffer()
+    queue: "asyncio.Queue[Optional[Tuple[int, int]]]" = asyncio.Queue(maxsize=workers * 4)
+
+    async def worker() -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            uid, tg_id = item
+            try:
+                with priority(Priority.HOMEWORK):
+                    await bot.send_message(tg_id, job.body)
+            except Exception as e:
+                stats["failed"] += 1
+                reason = classify_failure(e)
+                if reason is not None:
+                    stats["unreachable"] += 1
+                    marks.unreachable(tg_id, reason, str(e)[:300])
+                log.warning("[HW] #%s delivery failed: user=%s err=%r", job_id, tg_id, e)
+                continue
+            stats["sent"] += 1
+            marks.delivered(job.session_id, uid, job.link)
+
+    tasks = [asyncio.create_task(worker(), name=f"hw-{job_id}-w{i}") for i in range(max(1, workers))]
+    started = time.monotonic()
+    try:
+        async for item in iter_pending(job.session_id):
+            await queue.put(item)
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        raise
+    finally:
+        # отметки уже доставленных должны попасть в БД и при остановке — иначе повтор после рестарта
+        await marks.close()
+
+    stats["total"] = stats["sent"] + stats["failed"]
+    await asyncio.to_thread(_finish_job, job_id, stats)
+    log.info("[HW] #%s (session %s) done in %.1fs: %s, %d flushes",
+             job_id, job.session_id, time.monotonic() - started, stats, marks.flushes)
+    return stats
+
+
+_RUNNING: Dict[int, asyncio.Task] = {}
+
+
+async def _run_and_report(bot: Bot, job_id: int, notify_chat: Optional[int]) -> None:
+    try:
+        stats = await run_homework(bot, job_id)
+    except asyncio.CancelledError:
+        log.info("[HW] #%s interrupted; will resume after restart", job_id)
+        raise
+    except Exception as e:
+        log.exception("[HW] #%s failed: %s", job_id, e)
+        return
+    finally:
+        _RUNNING.pop(job_id, None)
+    if notify_chat:
+        try:
+            text = f"ДЗ (задание #{job_id}): отправлено {stats['sent']} из {stats['total']}."
+            if stats["unreachable"]:
+                text += f" Недоступны: {stats['unreachable']}."
+            await bot.send_message(notify_chat, text)
+        except Exception:
+            pass
+
+
+def start_homework(bot: Bot, job_id: int, *, notify_chat: Optional[int] = None) -> asyncio.Task:
+    task = _RUNNING.get(job_id)
+    if task is None or task.done():
+        task = asyncio.create_task(_run_and_report(bot, job_id, notify_chat), name=f"homework-{job_id}")
+        _RUNNING[job_id] = task
+    return task
+
+
+async def resume_homework_jobs(bot: Bot) -> List[int]:
+    """Продолжить задания, прерванные рестартом (status='sending')."""
+    def _pending() -> List[Tuple[int, Optional[int]]]:
+        with get_db_connection(readonly=True) as con:
+            try:
+                rows = con.execute(
+                    "SELECT id, created_by FROM homework_jobs WHERE status = 'sending' ORDER BY id"
+                ).fetchall()
+            except Exception:  # схема ещё не создана (запуск не через python -m crm2)
+                return []
+        return [(int(r[0]), r[1]) for r in rows]
+
+    ids = []
+    for job_id, created_by in await asyncio.to_thread(_pending):
+        log.info("[HW] resuming homework job #%s", job_id)
+        start_homework(bot, job_id, notify_chat=created_by)
+        ids.append(job_id)
+    return ids
+
+
+async def stop_homework_jobs() -> None:
+    tasks = list(_RUNNING.values())
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
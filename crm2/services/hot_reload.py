@@ -0,0 +1,276 @@
+# crm2/services/hot_reload.py
+# Назначение: Горячая подгрузка файлов без перезапуска бота.
+#             Фоновая задача раз в POLL_INTERVAL_S сверяет (mtime, size) наблюдаемых файлов:
+#             - schedule_*_cohort.xlsx (crm2/ и crm2/data/) → инкрементальный import_schedule только изменённых книг;
+#             - *.xlsx в SCHEDULE_DIR (tools/sync_events_xlsx.py) → пересинхронизация events_xlsx по файлу;
+#             - content/info/*.md → сброс и прогрев кэша HTML в content_loader.
+#             Изменение применяется, когда файл не меняется DEBOUNCE_S (дописывание/копирование завершено).
+#             Работа с файлами и БД — в рабочем потоке (asyncio.to_thread), event loop не блокируется.
+#             Состояние (path → mtime/size) хранится в таблице file_watch_state: после рестарта
+#             подгружается только то, что изменилось, пока бот был остановлен.
+#             Если установлен watchfiles (inotify), он будит опрос сразу при событии ФС.
+# Классы:
+# - Watch - Описание наблюдаемой группы файлов (каталоги, шаблон, обработчик)
+# Функции:
+# - _env_float - Чтение числа из переменной окружения
+# - _watches - Список наблюдаемых групп файлов
+# - _scan - Снимок (mtime_ns, size) файлов группы
+# - _load_state - Чтение состояния наблюдателя (file_watch_state)
+# - _save_state - Запись (mtime, size) применённых файлов
+# - _drop_state - Удаление состояния для исчезнувших файлов
+# - _apply_schedule - Импорт изменённых книг расписания
+# - _apply_events - Пересинхронизация events_xlsx по изменённым/удалённым файлам
+# - _apply_content - Сброс и прогрев кэша HTML информационных страниц
+# - _inotify_wakeup - Пробуждение опроса по событиям ФС (если доступен watchfiles)
+# - watch_files - Основной цикл наблюдателя
+# - start_watcher - Запуск фоновой задачи в текущем event loop
+# - stop_watcher - Остановка фоновой задачи
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from crm2.db.core import get_db_connection
+
+log = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, ""))
+    except ValueError:
+        return default
+
+
+# Включение наблюдателя (0 — выключен), период опроса и окно «тишины» перед применением
+ENABLED = os.getenv("CRM_HOT_RELOAD", "1").strip().lower() not in ("0", "false", "no", "off")
+POLL_INTERVAL_S = _env_float("CRM_HOT_RELOAD_INTERVAL_S", 2.0)
+DEBOUNCE_S = _env_float("CRM_HOT_RELOAD_DEBOUNCE_S", 1.0)
+
+_CRM_DIR = Path(__file__).resolve().parents[1]
+
+# (mtime_ns, size)
+_Stat = Tuple[int, int]
+
+
+@dataclass(frozen=True)
+class Watch:
+    """Группа файлов: где искать, по какому шаблону и что делать с изменёнными/удалёнными путями."""
+    kind: str
+    dirs: Tuple[Path, ...]
+    pattern: str
+    apply: Callable[[List[str], List[str]], None]  # (changed, removed) → None, вызывается в рабочем потоке
+
+
+# ---------- обработчики (рабочий поток) ----------
+
+def _apply_schedule(changed: List[str], removed: List[str]) -> None:
+    # удалённые книги не трогаем: удаление дней — только явным --prune (на них ссылается attendance)
+    if not changed:
+        return
+    from crm2.db.schedule_loader import import_schedule
+    report = import_schedule(changed)
+    log.info("[HOT] schedule reloaded from %s: %s", [Path(p).name for p in changed], report.summary())
+
+
+def _apply_events(changed: List[str], removed: List[str]) -> None:
+    from crm2.tools.sync_events_xlsx import ensure_schema, sync_one_file
+    with get_db_connection() as con:
+        ensure_schema(con)
+        total = 0
+        for p in changed:
+            total += sync_one_file(con, Path(p))
+        for p in removed:
+            con.execute("DELETE FROM events_xlsx WHERE source_file = ?", (Path(p).name,))
+    log.info("[HOT] events_xlsx: %d rows from %d file(s), %d file(s) removed", total, len(changed), len(removed))
+
+
+def _apply_content(changed: List[str], removed: List[str]) -> None:
+    from crm2.services import content_loader
+    content_loader.invalidate()
+    content_loader.warm()
+    log.info("[HOT] info content reloaded: %s", [Path(p).name for p in changed + removed])
+
+
+def _watches() -> List[Watch]:
+    items = [
+        Watch("schedule", (_CRM_DIR, _CRM_DIR / "data"), "schedule_*_cohort.xlsx", _apply_schedule),
+        Watch("content", (_CRM_DIR / "content" / "info",), "*.md", _apply_content),
+    ]
+    events_dir = Path(os.getenv("SCHEDULE_DIR", "/var/data/schedules"))
+    if events_dir.is_dir():
+        items.append(Watch("events", (events_dir,), "*.xlsx", _apply_events))
+    return items
+
+
+# ---------- снимки и состояние ----------
+
+def _scan(watch: Watch) -> Dict[str, _Stat]:
+    """Только stat() по шаблону: содержимое файлов не читается."""
+    snap: Dict[str, _Stat] = {}
+    for d in watch.dirs:
+        if not d.is_dir():
+            continue
+        for p in d.glob(watch.pattern):
+            if p.name.startswith((".", "~$")):  # временные файлы редакторов/Excel
+                continue
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            snap[str(p.resolve())] = (st.st_mtime_ns, st.st_size)
+    return snap
+
+
+def _load_state() -> Dict[Tuple[str, str], _Stat]:
+    with get_db_connection() as con:
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS file_watch_state (
+                kind      TEXT NOT NULL,
+                path      TEXT NOT NULL,
+                mtime_ns  INTEGER NOT NULL,
+                size      INTEGER NOT NULL,
+                synced_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (kind, path)
+            )
+            """
+        )
+        rows = con.execute("SELECT kind, path, mtime_ns, size FROM file_watch_state").fetchall()
+    return {(r[0], r[1]): (int(r[2]), int(r[3])) for r in rows}
+
+
+def _save_state(kind: str, items: Dict[str, _Stat]) -> None:
+    with get_db_connection() as con:
+        con.executemany(
+            """
+            INSERT INTO file_watch_state(kind, path, mtime_ns, size) VALUES (?, ?, ?, ?)
+            ON CONFLICT(kind, path) DO UPDATE SET
+                mtime_ns = excluded.mtime_ns, size = excluded.size, synced_at = CURRENT_TIMESTAMP
+            """,
+            [(kind, p, st[0], st[1]) for p, st in items.items()],
+        )
+
+
+def _drop_state(kind: str, paths: List[str]) -> None:
+    with get_db_connection() as con:
+        con.executemany("DELETE FROM file_watch_state WHERE kind = ? AND path = ?", [(kind, p) for p in paths])
+
+
+# ---------- цикл ----------
+
+async def _inotify_wakeup(dirs: List[Path], wake: asyncio.Event) -> None:
+    """Будит цикл опроса по событию ФС. Без watchfiles — просто не используется."""
+    try:
+        from watchfiles import awatch
+    except ImportError:
+        return
+    existing = [str(d) for d in dirs if d.is_dir()]
+    if not existing:
+        return
+    try:
+        async for _ in awatch(*existing, recursive=False):
+            wake.set()
+    except Exception as e:  # inotify недоступен (лимиты, ФС) — остаёмся на опросе
+        log.info("[HOT] inotify unavailable, polling only: %s", e)
+
+
+async def watch_files(*, interval: float = POLL_INTERVAL_S, debounce: float = DEBOUNCE_S) -> None:
+    """
+    Основной цикл. Изменённый файл попадает в «ожидающие» и применяется,
+    когда его (mtime, size) не менялись debounce секунд. Ошибка обработчика
+    не сохраняет состояние — файл будет подхвачен на следующем проходе.
+    """
+    watches = _watches()
+    known: Dict[Tuple[str, str], _Stat] = await asyncio.to_thread(_load_state)
+    # (kind, path) → (stat, когда впервые увидели этот stat)
+    pending: Dict[Tuple[str, str], Tuple[Optional[_Stat], float]] = {}
+
+    wake = asyncio.Event()
+    inotify = asyncio.create_task(
+        _inotify_wakeup([d for w in watches for d in w.dirs], wake), name="hot-reload-inotify"
+    )
+    log.info("[HOT] watching %s every %.1fs", [w.kind for w in watches], interval)
+    try:
+        while True:
+            now = time.monotonic()
+            for w in watches:
+                snap = await asyncio.to_thread(_scan, w)
+                seen: Set[str] = set()
+                for path, st in snap.items():
+                    seen.add(path)
+                    key = (w.kind, path)
+                    if known.get(key) == st:
+                        pending.pop(key, None)
+                        continue
+                    prev = pending.get(key)
+                    if prev is None or prev[0] != st:
+                        pending[key] = (st, now)
+                for key in [k for k in known if k[0] == w.kind and k[1] not in seen]:
+                    prev = pending.get(key)
+                    if prev is None or prev[0] is not None:
+                        pending[key] = (None, now)
+
+                ready = {k: v for k, v in pending.items() if k[0] == w.kind and now - v[1] >= debounce}
+                if not ready:
+                    continue
+                changed = {k[1]: v[0] for k, v in ready.items() if v[0] is not None}
+                removed = [k[1] for k, v in ready.items() if v[0] is None]
+                try:
+                    await asyncio.to_thread(w.apply, sorted(changed), removed)
+                    await asyncio.to_thread(_save_state, w.kind, changed)
+                    if removed:
+                        await asyncio.to_thread(_drop_state, w.kind, removed)
+                except Exception as e:
+                    log.exception("[HOT] %s reload failed: %s", w.kind, e)
+                    for k in ready:  # повторим после следующего окна тишины
+                        pending[k] = (ready[k][0], time.monotonic())
+                    continue
+                for k, v in ready.items():
+                    pending.pop(k, None)
+                    if v[0] is None:
+                        known.pop(k, None)
+                    else:
+                        known[k] = v[0]
+
+            # есть ожидающие — проверяем чаще, чтобы уложиться в окно debounce
+            timeout = min(interval, debounce) if pending else interval
+            wake.clear()
+            try:
+                await asyncio.wait_for(wake.wait(), timeout)
+                await asyncio.sleep(min(debounce, 0.2))  # даём событиям одной записи схлопнуться
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        inotify.cancel()
+
+
+_task: Optional[asyncio.Task] = None
+
+
+def start_watcher() -> Optional[asyncio.Task]:
+    """Запустить наблюдатель в текущем event loop (идемпотентно). CRM_HOT_RELOAD=0 — не запускать."""
+    global _task
+    if not ENABLED:
+        log.info("[HOT] hot reload disabled (CRM_HOT_RELOAD=0)")
+        return None
+    if _task is None or _task.done():
+        _task = asyncio.create_task(watch_files(), name="hot-reload")
+    return _task
+
+
+async def stop_watcher() -> None:
+    global _task
+    task, _task = _task, None
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
@@ -0,0 +1,333 @@
+# crm2/services/outbound.py
+# Назначение: Единый планировщик исходящих сообщений процесса.
+#             Все отправки бота (ответы в хендлерах, ДЗ, рассылки, служебные уведомления) проходят через
+#             request-middleware сессии aiogram: общий token bucket бота (~28 сообщений/с), token bucket
+#             на чат, приоритеты (ответы пользователю > ДЗ > рассылка) и ограничение очереди на класс —
+#             массовая отправка ждёт свободного места, а не копит задачи в памяти.
+#             TelegramRetryAfter ставит на паузу выдачу токенов всем отправителям, запрос повторяется.
+#             Приоритет задаётся контекстом: with priority(Priority.BROADCAST): await bot.send_message(...)
+#             (по умолчанию — INTERACTIVE). Подключение: install(bot) в app._runner.
+# Классы:
+# - Priority - Классы приоритета исходящих сообщений
+# - TokenBucket - Общий лимит скорости бота с выдачей токенов по приоритету
+# - SharedTokenBucket - TokenBucket, берущий токены у общего лимита кластера (процесс-писатель)
+# - ChatLimiter - Token bucket на отдельный чат
+# - OutboundScheduler - Планировщик: ограничение очереди, лимиты, повтор при TelegramRetryAfter
+# - OutboundMiddleware - Request-middleware aiogram, пропускающий отправки через планировщик
+# Функции:
+# - _env_float - Чтение числа из переменной окружения
+# - priority - Контекст приоритета для отправок внутри блока
+# - current_priority - Текущий приоритет контекста
+# - is_throttled - Нужно ли пропускать метод Bot API через лимиты
+# - install - Подключение планировщика к сессии бота (идемпотентно)
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, ""))
+    except ValueError:
+        return default
+
+
+# Общий лимит бота (Telegram: ~30 сообщений/с) и лимит на чат (~1/с в личке, ~20/мин в группе)
+RATE_PER_S = _env_float("CRM_OUT_RATE", _env_float("CRM_BC_RATE", 28.0))
+BURST = _env_float("CRM_OUT_BURST", _env_float("CRM_BC_BURST", 2.0))
+CHAT_RATE_PER_S = _env_float("CRM_OUT_CHAT_RATE", 1.0)
+CHAT_BURST = _env_float("CRM_OUT_CHAT_BURST", 3.0)
+GROUP_RATE_PER_S = _env_float("CRM_OUT_GROUP_RATE", 20 / 60)
+# Повторов после TelegramRetryAfter внутри планировщика
+MAX_RETRIES = int(_env_float("CRM_OUT_RETRIES", 3))
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # ответы пользователю, уведомления админу
+    HOMEWORK = 1  # рассылка ДЗ
+    BROADCAST = 2  # массовые рассылки
+
+
+# Сколько отправок класса может одновременно стоять в планировщике (ожидание + запрос)
+BACKLOG: Dict[Priority, int] = {
+    Priority.INTERACTIVE: int(_env_float("CRM_OUT_BACKLOG_INTERACTIVE", 1000)),
+    Priority.HOMEWORK: int(_env_float("CRM_OUT_BACKLOG_HOMEWORK", 32)),
+    Priority.BROADCAST: int(_env_float("CRM_OUT_BACKLOG_BROADCAST", 32)),
+}
+
+_priority: ContextVar[Priority] = ContextVar("outbound_priority", default=Priority.INTERACTIVE)
+
+
+@contextlib.contextmanager
+def priority(value: Priority) -> Iterator[None]:
+    """Отправки внутри блока (и в задачах, созданных внутри него) идут с приоритетом value."""
+    token = _priority.set(Priority(value))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> Priority:
+    return _priority.get()
+
+
+class TokenBucket:
+    """
+    rate токенов в секунду, ёмкость burst. acquire(prio) ждёт токен; ожидающие обслуживаются
+    по (приоритет, порядок прихода). pause(sec) — остановить выдачу всем (429 касается всего бота).
+    """
+
+    def __init__(self, rate: float = RATE_PER_S, burst: float = BURST):
+        self.rate = max(0.1, rate)
+        self.capacity = max(1.0, burst)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    def paused_for(self) -> float:
+        """Сколько секунд ещё длится пауза после TelegramRetryAfter (0 — отправка идёт)."""
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def waiting(self) -> Dict[Priority, int]:
+        depth = {p: 0 for p in Priority}
+        for prio, _, fut in self._waiters:
+            if not fut.done():
+                depth[Priority(prio)] += 1
+        return depth
+
+    async def acquire(self, prio: Priority = Priority.INTERACTIVE) -> None:
+        now = time.monotonic()
+        if not self._waiters and now >= self._paused_until:
+            self._refill(now)
+            if self._tokens >= 1.0:  # очереди нет — без переключения на диспетчер
+                self._tokens -= 1.0
+                return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (int(prio), next(self._seq), fut))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._dispatch(), name="outbound-bucket")
+        await fut
+
+    async def _dispatch(self) -> None:
+        while self._waiters:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens < 1.0:
+                await asyncio.sleep(self._delay())
+                continue
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():  # ожидающий отменён
+                continue
+            self._tokens -= 1.0
+            fut.set_result(None)
+
+    def _delay(self) -> float:
+        """Через сколько секунд появится следующий токен."""
+        return (1.0 - self._tokens) / self.rate
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Лимит бота на несколько процессов (BOT_MODE=cluster): токены выдаёт один общий bucket в процессе-писателе
+    (writer_process.RateClient), здесь — только очередь по приоритету внутри процесса. Токен берётся по одному
+    в момент отправки, поэтому любой обработчик (в т.ч. ведущий с рассылками) может использовать весь лимит,
+    пока остальные молчат. Пауза после TelegramRetryAfter передаётся всем обработчикам.
+    Если общий bucket недоступен, процесс продолжает с локальным лимитом rate.
+    """
+
+    def __init__(self, remote: Any, rate: float = RATE_PER_S, burst: float = BURST):
+        super().__init__(rate, burst)
+        self._remote = remote
+        self._tokens = 0.0
+        self._wait = 0.0
+
+    def _fallback(self, e: Exception) -> None:
+        log.warning("[OUT] shared rate limiter unavailable (%s): local limit %.1f/s", e, self.rate)
+        self._remote = None
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self._remote is None:
+            super()._refill(now)
+            return
+        if self._tokens >= 1.0:
+            return
+        try:
+            granted, self._wait, paused = self._remote.grant(1)
+        except (OSError, EOFError, ValueError) as e:
+            self._fallback(e)
+            super()._refill(now)
+            return
+        self._tokens += granted
+        if paused > 0:
+            self._paused_until = max(self._paused_until, now + paused)
+
+    def _delay(self) -> float:
+        if self._remote is None:
+            return super()._delay()
+        return max(0.005, self._wait)
+
+    def pause(self, seconds: float) -> None:
+        super().pause(seconds)
+        if self._remote is not None:
+            try:
+                self._remote.pause(seconds)
+            except (OSError, EOFError, ValueError) as e:
+                self._fallback(e)
+
+
+class ChatLimiter:
+    """Token bucket на чат: короткая серия ответов проходит сразу, дальше — не чаще rate в секунду."""
+
+    def __init__(self, rate: float = CHAT_RATE_PER_S, burst: float = CHAT_BURST,
+                 group_rate: float = GROUP_RATE_PER_S):
+        self.rate = max(0.01, rate)
+        self.group_rate = max(0.01, group_rate)
+        self.capacity = max(1.0, burst)
+        self._state: Dict[int, Tuple[float, float]] = {}
+
+    def reserve(self, chat_id: int) -> float:
+        """Занять токен чата; вернуть, сколько секунд подождать до отправки."""
+        now = time.monotonic()
+        rate = self.group_rate if chat_id < 0 else self.rate
+        tokens, updated = self._state.get(chat_id, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated) * rate) - 1.0
+        self._state[chat_id] = (tokens, now)
+        if len(self._state) > 50_000:  # забываем чаты с полным bucket
+            self._state = {c: (t, u) for c, (t, u) in self._state.items()
+                           if t + (now - u) * (self.group_rate if c < 0 else self.rate) < self.capacity}
+        return 0.0 if tokens >= 0 else -tokens / rate
+
+    async def wait(self, chat_id: int) -> None:
+        delay = self.reserve(chat_id)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class OutboundScheduler:
+    """
+    Порядок одной отправки: место в очереди своего класса (back-pressure) → токен чата → общий токен
+    по приоритету → запрос. При TelegramRetryAfter — пауза общего bucket и повтор (до MAX_RETRIES).
+    """
+
+    def __init__(self, bucket: Optional[TokenBucket] = None, chats: Optional[ChatLimiter] = None,
+                 backlog: Optional[Dict[Priority, int]] = None):
+        self.bucket = bucket or TokenBucket()
+        self.chats = chats or ChatLimiter()
+        self._backlog = dict(backlog or BACKLOG)
+        self._slots: Dict[Priority, asyncio.Semaphore] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._inflight = {p: 0 for p in Priority}
+        self._sent = {p: 0 for p in Priority}
+        self.retry_after = 0
+
+    def _slot(self, prio: Priority) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:  # семафоры привязаны к циклу событий
+            self._slots = {p: asyncio.Semaphore(max(1, n)) for p, n in self._backlog.items()}
+            self._loop = loop
+        return self._slots[prio]
+
+    async def call(self, send: Callable[[], Awaitable[T]], chat_id: Optional[int] = None,
+                   prio: Optional[Priority] = None) -> T:
+        prio = current_priority() if prio is None else Priority(prio)
+        async with self._slot(prio):
+            self._inflight[prio] += 1
+            try:
+                attempt = 0
+                while True:
+                    if chat_id is not None:
+                        await self.chats.wait(chat_id)
+                    await self.bucket.acquire(prio)
+                    try:
+                        result = await send()
+                    except TelegramRetryAfter as e:
+                        self.retry_after += 1
+                        log.warning("[OUT] flood control: retry after %ss (%s)", e.retry_after, prio.name)
+                        self.bucket.pause(e.retry_after)
+                        attempt += 1
+                        if attempt > MAX_RETRIES:
+                            raise
+                        continue
+                    self._sent[prio] += 1
+                    return result
+            finally:
+                self._inflight[prio] -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очередей по классам (в планировщике / ждут общий токен) и счётчики отправок."""
+        waiting = self.bucket.waiting()
+        return {
+            p.name.lower(): {"inflight": self._inflight[p], "waiting": waiting[p], "sent": self._sent[p]}
+            for p in Priority
+        } | {"retry_after": self.retry_after}
+
+
+def is_throttled(method: TelegramMethod) -> bool:
+    """Лимиты Telegram считаются на сообщения: send*/copy*/forward*/edit* (кроме sendChatAction)."""
+    name = getattr(method, "__api_method__", "")
+    return name.startswith(("send", "copy", "forward", "edit")) and name != "sendChatAction"
+
+
+class OutboundMiddleware(BaseRequestMiddleware):
+    def __init__(self, scheduler: "OutboundScheduler"):
+        self.scheduler = scheduler
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not is_throttled(method):
+            return await make_request(bot, method)
+        chat_id = getattr(method, "chat_id", None)
+        return await self.scheduler.call(
+            lambda: make_request(bot, method),
+            chat_id if isinstance(chat_id, int) else None,
+        )
+
+
+# Один на процесс: лимит Telegram считается на бота, а не на отдельную рассылку
+scheduler = OutboundScheduler()
+
+
+def install(bot: Bot) -> Bot:
+    """Подключить общий планировщик к сессии бота (повторный вызов ничего не делает)."""
+    if not any(isinstance(m, OutboundMiddleware) for m in bot.session.middleware):
+        bot.session.middleware(OutboundMiddleware(scheduler))
+    return bot
@@ -18,7 +18,7 @@ def get_streams() -> List[Tuple[int, str]]:
     Возвращает список потоков (id, title).
     Если таблица пуста — вернётся пустой список.
     """
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         cur = con.execute("SELECT id, title FROM streams ORDER BY id")
         rows = cur.fetchall()
     return [(r[0], r[1]) for r in rows]
@@ -55,7 +55,7 @@ def users_missing_stream(limit: int = 50) -> List[dict]:
     ORDER BY u.id
     LIMIT ?
     """
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         cur = con.execute(sql, (limit,))
         rows = cur.fetchall()
     out = []
@@ -74,7 +74,7 @@ def users_missing_stream(limit: int = 50) -> List[dict]:
 
 
 def get_user_id_by_tg(telegram_id: int) -> Optional[int]:
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         cur = con.execute("SELECT id FROM users WHERE telegram_id = ?", (telegram_id,))
         row = cur.fetchone()
     return row[0] if row else None
@@ -0,0 +1,233 @@
+# crm2/services/password_migration.py
+# Назначение: Фоновая пакетная миграция паролей users из plain text в bcrypt.
+#             Обход users по ключу (id > last_id ORDER BY id LIMIT N), хеширование пачки в пуле процессов
+#             (crm2/utils/password_pool.py), запись пачки одной транзакцией (executemany, compare-and-set
+#             по старому значению — пароль, сменённый во время миграции, не затирается).
+#             Курсор и счётчики хранятся в таблице background_jobs: после рестарта задача продолжает
+#             с места остановки. Между пачками — пауза, bcrypt-пул делится с логинами мелкими порциями.
+#             Запуск: фоном из app._on_startup (CRM_PASSWORD_MIGRATION=0 — выключить)
+#             или вручную: python -m crm2.services.password_migration [--batch N] [--pause S] [--restart]
+# Классы:
+# - MigrationProgress - Счётчики миграции (просмотрено/захешировано/пропущено, last_id)
+# Функции:
+# - _ensure_jobs_table - Создание таблицы background_jobs
+# - _load_progress - Чтение курсора задачи
+# - _save_progress - Сохранение курсора задачи
+# - _fetch_batch - Очередная пачка пользователей с plain text паролем (keyset)
+# - _write_batch - Запись захешированной пачки одной транзакцией
+# - migrate_plaintext_passwords - Основной цикл миграции
+# - start_migration - Запуск миграции фоновой задачей
+# - _log_result - Логирование ошибки фоновой задачи
+# - stop_migration - Остановка фоновой задачи
+# - main - CLI-запуск
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+from crm2.db.core import get_db_connection
+from crm2.utils.password_utils import is_bcrypt_hash
+
+log = logging.getLogger(__name__)
+
+JOB_NAME = "password_bcrypt_migration"
+
+# Размер пачки (строк users), порция на один вызов пула и пауза между пачками
+BATCH_SIZE = int(os.getenv("CRM_PWMIG_BATCH", "200"))
+HASH_CHUNK = int(os.getenv("CRM_PWMIG_CHUNK", "8"))
+PAUSE_S = float(os.getenv("CRM_PWMIG_PAUSE_S", "0.5"))
+
+
+@dataclass
+class MigrationProgress:
+    last_id: int = 0
+    scanned: int = 0
+    hashed: int = 0
+    skipped: int = 0
+    done: bool = False
+
+    def summary(self) -> str:
+        return (f"last_id={self.last_id} scanned={self.scanned} hashed={self.hashed} "
+                f"skipped={self.skipped} done={self.done}")
+
+
+# ---------- состояние задачи ----------
+
+def _ensure_jobs_table(con) -> None:
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS background_jobs (
+            name       TEXT PRIMARY KEY,
+            last_id    INTEGER NOT NULL DEFAULT 0,
+            processed  INTEGER NOT NULL DEFAULT 0,
+            changed    INTEGER NOT NULL DEFAULT 0,
+            done       INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+def _load_progress(restart: bool = False) -> MigrationProgress:
+    with get_db_connection() as con:
+        _ensure_jobs_table(con)
+        if restart:
+            con.execute("DELETE FROM background_jobs WHERE name = ?", (JOB_NAME,))
+        row = con.execute(
+            "SELECT last_id, processed, changed, done FROM background_jobs WHERE name = ?", (JOB_NAME,)
+        ).fetchone()
+        con.commit()
+    if not row:
+        return MigrationProgress()
+    return MigrationProgress(last_id=int(row[0]), scanned=int(row[1]), hashed=int(row[2]), done=bool(row[3]))
+
+
+def _save_progress(con, p: MigrationProgress) -> None:
+    con.execute(
+        """
+        INSERT INTO background_jobs(name, last_id, processed, changed, done) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET
+            last_id = excluded.last_id, processed = excluded.processed, changed = excluded.changed,
+            done = excluded.done, updated_at = CURRENT_TIMESTAMP
+        """,
+        (JOB_NAME, p.last_id, p.scanned, p.hashed, int(p.done)),
+    )
+
+
+# ---------- пачки ----------
+
+def _fetch_batch(last_id: int, limit: int) -> List[Tuple[int, Optional[int], str]]:
+    """(id, telegram_id, password) с непустым паролем, не похожим на bcrypt; строго по возрастанию id."""
+    with get_db_connection(readonly=True) as con:
+        rows = con.execute(
+            """
+            SELECT id, telegram_id, password
+            FROM users
+            WHERE id > ? AND password IS NOT NULL AND password <> '' AND password NOT LIKE '$2%'
+            ORDER BY id
+            LIMIT ?
+            """,
+            (last_id, limit),
+        ).fetchall()
+    return [(int(r[0]), r[1], str(r[2])) for r in rows]
+
+
+def _write_batch(updates: List[Tuple[str, int, str]], p: MigrationProgress) -> int:
+    """updates: (new_hash, id, old_password). Одна транзакция на пачку + курсор задачи."""
+    with get_db_connection() as con:
+        before = con.total_changes
+        con.executemany("UPDATE users SET password = ? WHERE id = ? AND password = ?", updates)
+        changed = con.total_changes - before
+        p.hashed += changed
+        _save_progress(con, p)
+        con.commit()
+    return changed
+
+
+async def migrate_plaintext_passwords(
+        *,
+        batch_size: int = BATCH_SIZE,
+        chunk: int = HASH_CHUNK,
+        pause_s: float = PAUSE_S,
+        restart: bool = False,
+        progress: Optional[Callable[[MigrationProgress], None]] = None,
+) -> MigrationProgress:
+    """
+    Мигрирует все plain text пароли в bcrypt. Повторный запуск продолжает с сохранённого last_id;
+    restart=True — заново с начала таблицы (уже захешированные строки отфильтруются запросом).
+    """
+    from crm2.services.users import invalidate_user
+    from crm2.utils.password_pool import hash_passwords_async
+
+    p = await asyncio.to_thread(_load_progress, restart)
+    if p.done and not restart:
+        # новые plain text строки (созданные после завершения) подберём с начала таблицы
+        p = MigrationProgress(scanned=p.scanned, hashed=p.hashed)
+    log.info("[PWMIG] start: %s", p.summary())
+
+    while True:
+        rows = await asyncio.to_thread(_fetch_batch, p.last_id, batch_size)
+        if not rows:
+            p.done = True
+            await asyncio.to_thread(_write_batch, [], p)
+            break
+
+        pending = [r for r in rows if not is_bcrypt_hash(r[2])]
+        updates: List[Tuple[str, int, str]] = []
+        for i in range(0, len(pending), max(1, chunk)):
+            part = pending[i:i + chunk]
+            hashes = await hash_passwords_async([pw for _, _, pw in part])
+            updates.extend((h, uid, pw) for h, (uid, _, pw) in zip(hashes, part))
+
+        p.scanned += len(rows)
+        p.last_id = rows[-1][0]
+        changed = await asyncio.to_thread(_write_batch, updates, p)
+        p.skipped += len(rows) - changed
+        invalidate_user()  # в кэше могли остаться plain text значения
+
+        log.info("[PWMIG] batch: %d rows, %d hashed | %s", len(rows), changed, p.summary())
+        if progress is not None:
+            progress(p)
+        if pause_s:
+            await asyncio.sleep(pause_s)
+
+    log.info("[PWMIG] finished: %s", p.summary())
+    return p
+
+
+_task: Optional[asyncio.Task] = None
+
+
+def start_migration() -> Optional[asyncio.Task]:
+    """Запустить миграцию фоном (идемпотентно). CRM_PASSWORD_MIGRATION=0 — не запускать."""
+    global _task
+    if os.getenv("CRM_PASSWORD_MIGRATION", "1").strip().lower() in ("0", "false", "no", "off"):
+        return None
+    if _task is None or _task.done():
+        _task = asyncio.create_task(migrate_plaintext_passwords(), name="password-migration")
+        _task.add_done_callback(_log_result)
+    return _task
+
+
+def _log_result(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        log.error("[PWMIG] failed: %s", task.exception())
+
+
+async def stop_migration() -> None:
+    global _task
+    task, _task = _task, None
+    if task is None or task.done():
+        return
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Миграция plain text паролей users в bcrypt")
+    ap.add_argument("--batch", type=int, default=BATCH_SIZE)
+    ap.add_argument("--chunk", type=int, default=HASH_CHUNK)
+    ap.add_argument("--pause", type=float, default=PAUSE_S)
+    ap.add_argument("--restart", action="store_true", help="начать с начала таблицы")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from crm2.utils.password_pool import shutdown_pool
+    try:
+        p = asyncio.run(migrate_plaintext_passwords(
+            batch_size=args.batch, chunk=args.chunk, pause_s=args.pause, restart=args.restart,
+        ))
+    finally:
+        shutdown_pool()
+    print(p.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# crm2/services/reachability.py
+# Назначение: Учёт недоступных получателей (заблокировали бота, удалили аккаунт, чат не найден).
+#             Постоянные ошибки доставки классифицируются по тексту ошибки Telegram и пишутся в
+#             user_reachability (telegram_id, reachable, reason, failed_at). Аудитории рассылок и ДЗ
+#             по умолчанию исключают недоступных (reachable_clause), админ видит список и сбрасывает отметку.
+#             Ключ — telegram_id (id чата, в который уходило сообщение).
+#             Таблица создаётся один раз при старте (auto_migrate.ensure_homework_delivery); чтения — читателем пула.
+#             Пользователь, снова написавший боту, считается доступным (note_contact из UserContextMiddleware).
+# Функции:
+# - _env_float - Чтение числа из переменной окружения
+# - ensure_reachability_table - Создание таблицы user_reachability (вызывается из auto_migrate)
+# - classify_failure - Код причины постоянной ошибки доставки (None — ошибка временная)
+# - reachable_clause - SQL-условие «получатель не помечен недоступным» для запросов аудитории
+# - mark_unreachable_many - Пометить недоступными пачку получателей (в транзакции вызывающего)
+# - _now_sql - Текущее время по часам SQLite (формат CURRENT_TIMESTAMP)
+# - list_unreachable - Страница недоступных получателей для админки
+# - count_unreachable - Число недоступных получателей
+# - reset_reachability - Сбросить отметку у одного получателя или у всех
+# - backfill_from_broadcasts - Разметить недоступных по сохранённым ошибкам broadcast_recipients
+# - _drop_contacts - Перечитать множество недоступных при следующем апдейте (в этом процессе)
+# - _invalidate_contacts - То же во всех процессах кластера
+# - _load_unreachable_ids - Множество telegram_id с отметкой reachable=0
+# - note_contact - Входящий апдейт от пользователя: снять отметку «недоступен», если она есть
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from crm2.db.core import get_db_connection
+from crm2.services import cache_bus
+
+log = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, ""))
+    except ValueError:
+        return default
+
+
+# Как часто (сек) перечитывать множество недоступных для note_contact
+CONTACT_REFRESH_S = _env_float("CRM_REACH_REFRESH_S", 60.0)
+
+# Подстрока текста ошибки Telegram → код причины (проверяются по порядку)
+PERMANENT_ERRORS: Tuple[Tuple[str, str], ...] = (
+    ("bot was blocked by the user", "blocked"),
+    ("user is deactivated", "deactivated"),
+    ("bot was kicked", "kicked"),
+    ("chat not found", "chat_not_found"),
+    ("bot can't initiate conversation", "no_dialog"),
+    ("bot is not a member", "not_member"),
+    ("have no rights to send", "no_rights"),
+)
+
+REASON_HUMAN: Dict[str, str] = {
+    "blocked": "заблокировал бота",
+    "deactivated": "аккаунт удалён",
+    "kicked": "бот исключён из чата",
+    "chat_not_found": "чат не найден",
+    "no_dialog": "не начинал диалог с ботом",
+    "not_member": "бот не в чате",
+    "no_rights": "нет прав на отправку",
+}
+
+
+def ensure_reachability_table(con) -> None:
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_reachability (
+            telegram_id INTEGER PRIMARY KEY,
+            reachable   INTEGER NOT NULL DEFAULT 1,
+            reason      TEXT,
+            error       TEXT,
+            failed_at   TEXT,
+            updated_at  TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS idx_user_reachability_unreachable "
+                "ON user_reachability(reachable) WHERE reachable = 0")
+
+
+def classify_failure(error: Any) -> Optional[str]:
+    """Код причины, если ошибка постоянная (повтор бессмыслен); None — сетевые сбои, лимиты и т.п."""
+    text = str(error or "").lower()
+    for needle, reason in PERMANENT_ERRORS:
+        if needle in text:
+            return reason
+    return None
+
+
+def reachable_clause(column: str) -> str:
+    """Условие для WHERE: получатель из column не помечен недоступным. column — telegram_id, не users.id."""
+    return (f"NOT EXISTS (SELECT 1 FROM user_reachability ur "
+            f"WHERE ur.telegram_id = {column} AND ur.reachable = 0)")
+
+
+def mark_unreachable_many(con, rows: Iterable[Tuple[int, str, Optional[str], str]]) -> None:
+    """rows: (telegram_id, reason, error, failed_at). Коммит — за вызывающим."""
+    con.executemany(
+        """
+        INSERT INTO user_reachability(telegram_id, reachable, reason, error, failed_at, updated_at)
+        VALUES (?, 0, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(telegram_id) DO UPDATE SET
+            reachable = 0, reason = excluded.reason, error = excluded.error,
+            failed_at = excluded.failed_at, updated_at = CURRENT_TIMESTAMP
+        """,
+        list(rows),
+    )
+    _invalidate_contacts()
+
+
+def _now_sql(con) -> str:
+    return con.execute("SELECT CURRENT_TIMESTAMP").fetchone()[0]
+
+
+def list_unreachable(offset: int = 0, limit: int = 10) -> List[Dict[str, Any]]:
+    with get_db_connection(readonly=True) as con:
+        rows = con.execute(
+            """
+            SELECT r.telegram_id, r.reason, r.error, r.failed_at, u.full_name, u.nickname
+            FROM user_reachability r
+            LEFT JOIN users u ON u.telegram_id = r.telegram_id
+            WHERE r.reachable = 0
+            ORDER BY r.failed_at DESC, r.telegram_id
+            LIMIT ? OFFSET ?
+            """,
+            (limit, offset),
+        ).fetchall()
+    keys = ("telegram_id", "reason", "error", "failed_at", "full_name", "nickname")
+    return [dict(zip(keys, r)) for r in rows]
+
+
+def count_unreachable() -> int:
+    with get_db_connection(readonly=True) as con:
+        return int(con.execute("SELECT COUNT(*) FROM user_reachability WHERE reachable = 0").fetchone()[0])
+
+
+def reset_reachability(telegram_id: Optional[int] = None) -> int:
+    """Снова считать получателя (или всех при telegram_id=None) доступным. Возвращает число строк."""
+    with get_db_connection() as con:
+        before = con.total_changes
+        if telegram_id is None:
+            con.execute("UPDATE user_reachability SET reachable = 1, updated_at = CURRENT_TIMESTAMP "
+                        "WHERE reachable = 0")
+        else:
+            con.execute("UPDATE user_reachability SET reachable = 1, updated_at = CURRENT_TIMESTAMP "
+                        "WHERE telegram_id = ? AND reachable = 0", (telegram_id,))
+        changed = con.total_changes - before
+        con.commit()
+    _invalidate_contacts()
+    return changed
+
+
+def backfill_from_broadcasts() -> int:
+    """
+    Разметить недоступных по уже сохранённым ошибкам рассылок (последняя ошибка получателя).
+    Получатели, которым после ошибки что-то доставлено или которых админ сбросил позже ошибки,
+    не помечаются.
+    """
+    with get_db_connection() as con:
+        rows = con.execute(
+            """
+            SELECT f.user_id, f.error, f.sent_at
+            FROM broadcast_recipients f
+            WHERE f.status = 'failed' AND f.error IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM broadcast_recipients s
+                              WHERE s.user_id = f.user_id AND s.status = 'sent'
+                                AND COALESCE(s.sent_at, '') >= COALESCE(f.sent_at, ''))
+              AND NOT EXISTS (SELECT 1 FROM user_reachability ur
+                              WHERE ur.telegram_id = f.user_id AND ur.reachable = 1
+                                AND ur.updated_at >= COALESCE(f.sent_at, ''))
+            ORDER BY f.sent_at
+            """
+        ).fetchall()
+        marks: Dict[int, Tuple[int, str, Optional[str], str]] = {}
+        for uid, error, sent_at in rows:
+            reason = classify_failure(error)
+            if reason is not None:
+                marks[int(uid)] = (int(uid), reason, error, sent_at or _now_sql(con))
+        mark_unreachable_many(con, marks.values())
+        con.commit()
+    return len(marks)
+
+
+# ---------- снятие отметки при входящем сообщении ----------
+
+_unreachable_ids: Optional[FrozenSet[int]] = None
+_loaded_at = 0.0
+
+
+def _drop_contacts(_key=None) -> None:
+    global _loaded_at
+    _loaded_at = 0.0
+
+
+def _invalidate_contacts() -> None:
+    _drop_contacts()
+    cache_bus.publish("reachability")
+
+
+cache_bus.subscribe("reachability", _drop_contacts)
+
+
+def _load_unreachable_ids() -> FrozenSet[int]:
+    with get_db_connection(readonly=True) as con:
+        rows = con.execute("SELECT telegram_id FROM user_reachability WHERE reachable = 0").fetchall()
+    return frozenset(int(r[0]) for r in rows)
+
+
+async def note_contact(telegram_id: int) -> bool:
+    """
+    Пользователь прислал апдейт — значит, бот ему снова доступен: отметка reachable=0 снимается.
+    Проверка по множеству недоступных в памяти (перечитывается раз в CONTACT_REFRESH_S, по частичному
+    индексу reachable=0), поэтому обычный апдейт не ходит в БД. True — отметка была снята.
+    """
+    global _unreachable_ids, _loaded_at
+    now = time.monotonic()
+    if _unreachable_ids is None or now - _loaded_at >= CONTACT_REFRESH_S:
+        try:
+            _unreachable_ids = await asyncio.to_thread(_load_unreachable_ids)
+        except Exception as e:  # таблицы ещё нет и т.п. — не мешаем обработке апдейта
+            log.debug("[REACH] unreachable ids not loaded: %s", e)
+            _unreachable_ids = frozenset()
+        _loaded_at = now
+    if telegram_id not in _unreachable_ids:
+        return False
+    _unreachable_ids = _unreachable_ids - {telegram_id}
+    await asyncio.to_thread(reset_reachability, telegram_id)
+    log.info("[REACH] %s wrote to the bot again — marked reachable", telegram_id)
+    return True
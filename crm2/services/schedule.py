@@ -8,11 +8,15 @@
 # - _find_header_row - Поиск строки заголовков в XLSX файле
 # - _cohort_id_from_filename - Извлечение ID потока из имени файла
 # - _load_one_file - Загрузка одного XLSX файла расписания
-# - load_all - Загрузка всех расписаний (XLSX + fallback на БД)
+# - _file_sha256 / _sessions_to_json / _sessions_from_json - Хэш файла и сериализация разбора
+# - _db_cache_get / _db_cache_put - Кэш разборов в таблице schedule_parse_cache (опционально)
+# - _load_one_file_cached - Загрузка файла через кэш (путь + mtime/size + sha256)
+# - load_all - Загрузка всех расписаний (XLSX через кэш разборов + fallback на БД)
 # - get_user_cohort_id - Получение ID потока пользователя
 # - upcoming - Ближайшие занятия для пользовcrm2/services/schedule.pyателя
 # - list_for_cohort - Список сессий для конкретного потока
 # - detail_for_cohort_date - Детали сессии по потоку и дате
+# - session_on - Блок занятий пользователя на дату (для карточки занятия)
 # - list_all - Общий список всех сессий
 # - _rows_to_sessions - Конвертация строк БД в объекты Session
 # - format_next - Форматирование информации о ближайшем занятии
@@ -30,11 +34,15 @@
 # - _find_header_row - Поиск строки заголовков в XLSX файле
 # - _cohort_id_from_filename - Извлечение ID потока из имени файла
 # - _load_one_file - Загрузка одного XLSX файла расписания
-# - load_all - Загрузка всех расписаний (XLSX + fallback на БД)
+# - _file_sha256 / _sessions_to_json / _sessions_from_json - Хэш файла и сериализация разбора
+# - _db_cache_get / _db_cache_put - Кэш разборов в таблице schedule_parse_cache (опционально)
+# - _load_one_file_cached - Загрузка файла через кэш (путь + mtime/size + sha256)
+# - load_all - Загрузка всех расписаний (XLSX через кэш разборов + fallback на БД)
 # - get_user_cohort_id - Получение ID потока пользователя
-# - upcoming - Ближайшие занятия для пользователя
+# - upcoming - Ближайшие занятия для пользователя (sessions/events, затем индекс schedule_index, фолбэк — БД/XLSX)
 # - list_for_cohort - Список сессий для конкретного потока
 # - detail_for_cohort_date - Детали сессии по потоку и дате
+# - session_on - Блок занятий пользователя на дату (для карточки занятия)
 # - list_all - Общий список всех сессий
 # - _rows_to_sessions - Конвертация строк БД в объекты Session
 # - format_next - Форматирование информации о ближайшем занятии
@@ -42,16 +50,21 @@
 # - next_training_text_for_user - Текст ближайшего занятия для пользователя
 from __future__ import annotations
 
+import asyncio
 from dataclasses import dataclass
 from datetime import date, datetime
+import hashlib
+import json
+import logging
+import os
 import re
+import threading
 from pathlib import Path
 from typing import Iterable, Optional, Dict, List, Tuple
 
-from openpyxl import load_workbook
 from crm2.services.users import get_user_by_telegram
 from crm2.db.core import get_db_connection
-from crm2.db.sessions import get_upcoming_sessions
+from crm2.db.sessions import get_upcoming_sessions, get_upcoming_from_sessions_events
 import sqlite3
 
 from crm2.db.sessions import (
@@ -168,6 +181,8 @@ def _cohort_id_from_filename(path: Path) -> Optional[int]:
 
 
 def _load_one_file(path: Path) -> List[Session]:
+    # openpyxl (~0.2 с импорта) нужен только при разборе XLSX мимо кэша разборов
+    from openpyxl import load_workbook
     wb = load_workbook(path, read_only=True, data_only=True)
     ws = wb.active
 
@@ -205,12 +220,117 @@ def _load_one_file(path: Path) -> List[Session]:
     return sessions
 
 
+# ---------- кэш разобранных файлов ----------
+# Ключ — путь + (mtime, size) + sha256 содержимого. Неизменённая книга не разбирается повторно:
+# при совпадении mtime/size берём из памяти, при «touch» без изменений — сверяем хэш,
+# после перезапуска — поднимаем разбор из таблицы schedule_parse_cache (если включена).
+
+# Хранить ли разборы в SQLite (переживают перезапуск); 0 — только память процесса
+PARSE_CACHE_DB = os.getenv("CRM_SCHEDULE_PARSE_CACHE_DB", "1").strip().lower() not in ("0", "false", "no", "")
+
+# path → ((mtime_ns, size), sha256, sessions)
+_PARSE_CACHE: Dict[str, Tuple[Tuple[int, int], str, List[Session]]] = {}
+_PARSE_CACHE_LOCK = threading.Lock()
+
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _sessions_to_json(items: List[Session]) -> str:
+    return json.dumps(
+        [[s.start.isoformat(), s.end.isoformat(), s.code, s.title, s.annotation] for s in items],
+        ensure_ascii=False,
+    )
+
+
+def _sessions_from_json(payload: str) -> List[Session]:
+    return [
+        Session(start=date.fromisoformat(a), end=date.fromisoformat(b), code=c, title=t, annotation=n)
+        for a, b, c, t, n in json.loads(payload)
+    ]
+
+
+def _db_cache_get(path: Path, sha: str) -> Optional[List[Session]]:
+    if not PARSE_CACHE_DB:
+        return None
+    try:
+        with get_db_connection(readonly=True) as con:
+            row = con.execute(
+                "SELECT payload FROM schedule_parse_cache WHERE path = ? AND sha256 = ?",
+                (str(path), sha),
+            ).fetchone()
+        return _sessions_from_json(row[0]) if row else None
+    except sqlite3.Error:
+        # таблицы ещё нет — создастся при первой записи
+        return None
+
+
+def _db_cache_put(path: Path, stat_key: Tuple[int, int], sha: str, items: List[Session]) -> None:
+    if not PARSE_CACHE_DB:
+        return
+    try:
+        with get_db_connection() as con:
+            con.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schedule_parse_cache (
+                    path       TEXT PRIMARY KEY,
+                    sha256     TEXT NOT NULL,
+                    mtime_ns   INTEGER NOT NULL,
+                    size       INTEGER NOT NULL,
+                    payload    TEXT NOT NULL,
+                    parsed_at  TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+                """
+            )
+            con.execute(
+                """
+                INSERT INTO schedule_parse_cache(path, sha256, mtime_ns, size, payload)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    sha256=excluded.sha256, mtime_ns=excluded.mtime_ns, size=excluded.size,
+                    payload=excluded.payload, parsed_at=CURRENT_TIMESTAMP
+                """,
+                (str(path), sha, stat_key[0], stat_key[1], _sessions_to_json(items)),
+            )
+    except sqlite3.Error as e:
+        logging.getLogger(__name__).warning("[SCHEDULE] parse cache write failed for %s: %s", path, e)
+
+
+def _load_one_file_cached(path: Path) -> List[Session]:
+    """_load_one_file с кэшем: повторный разбор только при изменении содержимого файла."""
+    key = str(path.resolve())
+    st = path.stat()
+    stat_key = (st.st_mtime_ns, st.st_size)
+
+    cached = _PARSE_CACHE.get(key)
+    if cached is not None and cached[0] == stat_key:
+        return list(cached[2])
+
+    sha = _file_sha256(path)
+    if cached is not None and cached[1] == sha:
+        items = cached[2]  # файл «тронули», но содержимое то же
+    else:
+        items = _db_cache_get(path, sha)
+        if items is None:
+            items = _load_one_file(path)
+            _db_cache_put(path, stat_key, sha, items)
+
+    with _PARSE_CACHE_LOCK:
+        _PARSE_CACHE[key] = (stat_key, sha, items)
+    return list(items)
+
+
 # ---------- публичный API, который зовут хендлеры ----------
 
 def load_all() -> Dict[int, List[Session]]:
     """
     Читает все файлы вида 'расписание *.xlsx' из crm2/data и
-    возвращает {cohort_id: [Session, ...]}.
+    возвращает {cohort_id: [Session, ...]}. Неизменённые файлы берутся из кэша разборов.
     """
     result: Dict[int, List[Session]] = {}
     has_files = False
@@ -219,11 +339,11 @@ def load_all() -> Dict[int, List[Session]]:
         cohort_id = _cohort_id_from_filename(path)
         if not cohort_id:
             continue
-        result[cohort_id] = _load_one_file(path)
+        result[cohort_id] = _load_one_file_cached(path)
     if has_files:
         return result
     # --- Fallback: берём из БД таблицу sessions (если xlsx отсутствуют) ---
-    with get_db_connection() as con:
+    with get_db_connection(readonly=True) as con:
         con.row_factory = sqlite3.Row
         cur = con.execute("""
                           SELECT id,
@@ -263,17 +383,20 @@ async def get_user_cohort_id(telegram_id: int) -> Optional[int]:
 
 async def upcoming(telegram_id: int, limit: int = 1) -> List[Session]:
     """Ближайшие занятия для пользователя (асинхронная версия)"""
-    # Получаем cohort_id пользователя
-    cohort_id = await get_user_cohort_id(telegram_id)
+    # sessions/events главнее session_days (порядок db/sessions.get_upcoming_sessions); там же — поток
+    # пользователя: participants, затем users.cohort_id
+    cohort_id, rows = await asyncio.to_thread(get_upcoming_from_sessions_events, limit=limit, tg_id=telegram_id)
+    items = _rows_to_sessions(rows)
+    if items:
+        return items[:limit]
 
-    # Используем существующую синхронную функцию, но в асинхронном контексте
-    # В реальном приложении лучше сделать асинхронную версию get_upcoming_sessions
-    def _sync_upcoming():
-        return get_upcoming_sessions(limit=limit, tg_id=telegram_id)
+    # session_days/session_blocks — из индекса расписания в памяти (crm2/services/schedule_index.py)
+    items = (await schedule_index.get_index_async()).upcoming(cohort_id, limit)
+    if items:
+        return items
 
-    # Имитируем асинхронный вызов синхронной функции
-    # В продакшене используйте asyncio.to_thread или сделайте асинхронную версию БД
-    rows = _sync_upcoming()
+    # фолбэки читают БД/XLSX — в потоке, не в цикле событий
+    rows = await asyncio.to_thread(get_upcoming_sessions, limit=limit, tg_id=telegram_id)
 
     if rows:
         def _to_date(s: str) -> date:
@@ -297,7 +420,7 @@ async def upcoming(telegram_id: int, limit: int = 1) -> List[Session]:
             return items[:limit]
 
     # Fallback: используем load_all
-    all_by_cohort = load_all()
+    all_by_cohort = await asyncio.to_thread(load_all)
     today = date.today()
 
     if cohort_id and cohort_id in all_by_cohort:
@@ -310,11 +433,25 @@ async def upcoming(telegram_id: int, limit: int = 1) -> List[Session]:
 
 def list_for_cohort(cohort_id: int, limit: int = 5) -> list[Session]:
     """Синхронная версия для использования в синхронном контексте"""
+    _, rows = get_upcoming_from_sessions_events(limit=limit, cohort_id=cohort_id)
+    items = _rows_to_sessions(rows)
+    if items:
+        return items[:limit]
+    items = schedule_index.get_index().upcoming(cohort_id, limit)
+    if items:
+        return items
     rows = get_upcoming_sessions_by_cohort(cohort_id, limit=limit)
     return _rows_to_sessions(rows)[:limit]
 
 
 def detail_for_cohort_date(cohort_id: int, date_iso: str) -> Optional[Session]:
+    """Блок занятий потока, в который попадает дата (поиск по индексу, фолбэк — запрос к БД)."""
+    try:
+        s = schedule_index.get_index().block_on(cohort_id, _parse_date(date_iso))
+    except ValueError:
+        s = None
+    if s:
+        return s
     r = get_session_detail_by_cohort_and_date(cohort_id, date_iso)
     if not r:
         return None
@@ -328,7 +465,30 @@ def detail_for_cohort_date(cohort_id: int, date_iso: str) -> Optional[Session]:
     )
 
 
+async def session_on(telegram_id: int, day: date) -> Optional[Session]:
+    """Блок занятий пользователя, в который попадает дата day (без перечитывания всего списка)."""
+    cohort_id, rows = await asyncio.to_thread(get_upcoming_from_sessions_events, limit=200, tg_id=telegram_id)
+    if rows:  # расписание из sessions/events главнее session_days — как в upcoming()
+        return next((s for s in _rows_to_sessions(rows) if s.start == day), None)
+    # только поток пользователя: занятие чужого потока в этот день — не его занятие
+    s = (await schedule_index.get_index_async()).block_on(cohort_id, day)
+    if s is not None:
+        return s
+    # фолбэк для расписаний вне session_days (sessions/events/XLSX)
+    for it in await upcoming(telegram_id, limit=200):
+        if it.start == day:
+            return it
+    return None
+
+
 def list_all(limit: int = 50) -> list[Session]:
+    _, rows = get_upcoming_from_sessions_events(limit=limit)
+    items = _rows_to_sessions(rows)
+    if items:
+        return items[:limit]
+    items = schedule_index.get_index().upcoming(None, limit)
+    if items:
+        return items
     rows = get_upcoming_sessions_by_cohort(None, limit=limit)
     return _rows_to_sessions(rows)[:limit]
 
@@ -366,4 +526,8 @@ def format_sessions_brief(sessions: List[Session]) -> str:
 async def next_training_text_for_user(telegram_id: int) -> str:
     """Асинхронная версия функции получения текста ближайшего занятия"""
     items = await upcoming(telegram_id, limit=1)
-    return format_next(items[0]) if items else ""
\ No newline at end of file
+    return format_next(items[0]) if items else ""
+
+
+# индекс импортирует Session из этого модуля, поэтому подключаем его в конце
+from crm2.services import schedule_index  # noqa: E402
@@ -0,0 +1,245 @@
+# crm2/services/schedule_index.py
+# Назначение: Индекс расписания в памяти процесса: для каждого потока — отсортированный по дате
+#             массив блоков занятий (session_blocks / подряд идущие дни session_days) с данными темы из topics.
+#             «Ближайшие N после сегодня» и «блок на дату X» — бинарным поиском, без запросов к БД.
+#             Индекс строится при старте и атомарно пересобирается после импорта расписания
+#             или при изменении таблиц session_days/topics/session_blocks (проверка отпечатка не чаще раза
+#             в CHECK_INTERVAL_S). Отпечаток — счетчики изменений schedule_changes, которые ведут триггеры
+#             (crm2/db/auto_migrate.ensure_schedule_changes): видна любая правка, в т.ч. даты той же длины и потока.
+# Классы:
+# - ScheduleIndex - Неизменяемый снимок расписания с методами поиска
+# Функции:
+# - _env_float - Чтение числа из переменной окружения
+# - _fingerprint - Отпечаток расписания: счетчики изменений таблиц + COUNT/MAX(id) session_days
+# - _load_blocks - Чтение блоков из session_blocks (фолбэк — склейка подряд идущих дней session_days, в т.ч. если блоки устарели)
+# - _fresh - Снимок, если проверка отпечатка сейчас не нужна
+# - get_index - Актуальный снимок индекса (перестраивается при изменениях)
+# - get_index_async - То же для корутин: проверка/пересборка — в потоке, не в цикле событий
+# - _mark_stale - Пометить индекс устаревшим в этом процессе
+# - invalidate - Пометить индекс устаревшим (после импорта расписания; в кластере — во всех процессах)
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from crm2.db.core import get_db_connection
+from crm2.services import cache_bus
+from crm2.services.schedule import Session
+
+log = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, ""))
+    except ValueError:
+        return default
+
+
+# Как часто (сек) сверять отпечаток БД с построенным индексом
+CHECK_INTERVAL_S = _env_float("CRM_SCHEDULE_INDEX_CHECK_S", 10.0)
+
+
+class ScheduleIndex:
+    """Снимок расписания: {cohort_id: [Session, ...]} + параллельные массивы дат для bisect."""
+
+    def __init__(self, by_cohort: Dict[int, List[Session]], fingerprint: Tuple = ()):
+        self.fingerprint = fingerprint
+        self.by_cohort = by_cohort
+        # блоки одного потока не пересекаются → и starts, и ends отсортированы
+        self._starts = {cid: [s.start for s in items] for cid, items in by_cohort.items()}
+        self._ends = {cid: [s.end for s in items] for cid, items in by_cohort.items()}
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self.by_cohort.values())
+
+    def cohorts(self) -> List[int]:
+        return sorted(self.by_cohort)
+
+    def _tail(self, cohort_id: int, today: date) -> List[Session]:
+        i = bisect_left(self._ends[cohort_id], today)
+        return self.by_cohort[cohort_id][i:]
+
+    def upcoming(self, cohort_id: Optional[int], limit: int, today: Optional[date] = None) -> List[Session]:
+        """Ближайшие блоки, которые ещё не закончились (end >= today). cohort_id=None — все потоки."""
+        today = today or date.today()
+        if cohort_id is not None:
+            if cohort_id not in self.by_cohort:
+                return []
+            return self._tail(cohort_id, today)[:limit]
+        tails = [self._tail(cid, today) for cid in self.by_cohort]
+        merged = heapq.merge(*tails, key=lambda s: (s.start, s.end))
+        return [s for _, s in zip(range(limit), merged)]
+
+    def block_on(self, cohort_id: Optional[int], day: date) -> Optional[Session]:
+        """Блок, в который попадает дата day (start <= day <= end). cohort_id=None — любой поток."""
+        cohort_ids = [cohort_id] if cohort_id is not None else self.cohorts()
+        for cid in cohort_ids:
+            starts = self._starts.get(cid)
+            if not starts:
+                continue
+            i = bisect_right(starts, day) - 1
+            if i >= 0 and self._ends[cid][i] >= day:
+                return self.by_cohort[cid][i]
+        return None
+
+
+_index: Optional[ScheduleIndex] = None
+_checked_at = 0.0
+_stale = True
+_lock = threading.Lock()
+
+
+def _fingerprint(con) -> Tuple:
+    row = con.execute("SELECT (SELECT COUNT(*) FROM session_days), (SELECT MAX(id) FROM session_days)").fetchone()
+    try:
+        versions = tuple(tuple(r) for r in con.execute(
+            "SELECT table_name, version FROM schedule_changes ORDER BY table_name").fetchall())
+    except Exception:  # база без счетчиков (не прошла auto_migrate) — только COUNT/MAX(id)
+        versions = ()
+    return tuple(row) + versions + (con.execute("PRAGMA schema_version").fetchone()[0],)
+
+
+def _load_blocks(con) -> Dict[int, List[Session]]:
+    from crm2.db.schedule_loader import session_blocks_fresh
+    has_blocks = con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='session_blocks'"
+    ).fetchone() is not None
+    # блоки, собранные до прямой правки session_days, устарели — склеиваем дни сами
+    if has_blocks and session_blocks_fresh(con):
+        rows = con.execute(
+            """
+            SELECT b.cohort_id, b.start_date, b.end_date,
+                   COALESCE(t.code, b.topic_code, '') AS code,
+                   COALESCE(t.title, '')              AS title,
+                   COALESCE(t.annotation, '')         AS annotation
+            FROM session_blocks b
+            LEFT JOIN topics t ON t.id = b.topic_id
+            ORDER BY b.cohort_id, b.start_date
+            """
+        ).fetchall()
+        if rows:
+            by_cohort: Dict[int, List[Session]] = {}
+            for r in rows:
+                try:
+                    by_cohort.setdefault(int(r["cohort_id"]), []).append(Session(
+                        start=date.fromisoformat(r["start_date"]),
+                        end=date.fromisoformat(r["end_date"]),
+                        code=str(r["code"] or ""),
+                        title=str(r["title"] or ""),
+                        annotation=str(r["annotation"] or ""),
+                    ))
+                except Exception:
+                    continue
+            return by_cohort
+
+    # фолбэк: склейка подряд идущих дней session_days
+    cols = {r["name"] for r in con.execute("PRAGMA table_info(session_days)").fetchall()}
+    cohort_col = "cohort_id" if "cohort_id" in cols else "stream_id"
+    rows = con.execute(
+        f"""
+        SELECT sd.{cohort_col}                          AS cohort_id,
+               sd.date                                  AS day,
+               COALESCE(t1.code, t2.code, sd.topic_code, '') AS code,
+               COALESCE(t1.title, t2.title, '')         AS title,
+               COALESCE(t1.annotation, t2.annotation, '') AS annotation
+        FROM session_days sd
+        LEFT JOIN topics t1 ON t1.id = sd.topic_id
+        LEFT JOIN topics t2 ON t2.code = sd.topic_code
+        WHERE sd.{cohort_col} IS NOT NULL
+        ORDER BY sd.{cohort_col}, sd.date
+        """
+    ).fetchall()
+
+    by_cohort: Dict[int, List[Session]] = {}
+    for r in rows:
+        try:
+            s = r["day"]
+            d = datetime.fromisoformat(s).date() if "T" in s else datetime.strptime(s[:10], "%Y-%m-%d").date()
+            cid = int(r["cohort_id"])
+        except Exception:
+            continue
+        items = by_cohort.setdefault(cid, [])
+        last = items[-1] if items else None
+        if last is not None and d - last.end <= timedelta(days=1):
+            # подряд идущий (или дублирующийся) день — продлеваем блок
+            last.end = max(last.end, d)
+            last.code = last.code or str(r["code"] or "")
+            last.title = last.title or str(r["title"] or "")
+            last.annotation = last.annotation or str(r["annotation"] or "")
+            continue
+        items.append(Session(
+            start=d,
+            end=d,
+            code=str(r["code"] or ""),
+            title=str(r["title"] or ""),
+            annotation=str(r["annotation"] or ""),
+        ))
+    return by_cohort
+
+
+def _fresh() -> Optional[ScheduleIndex]:
+    idx = _index
+    if idx is not None and not _stale and time.monotonic() - _checked_at < CHECK_INTERVAL_S:
+        return idx
+    return None
+
+
+def get_index(*, force: bool = False) -> ScheduleIndex:
+    """
+    Актуальный индекс. Отпечаток БД сверяется не чаще раза в CHECK_INTERVAL_S;
+    новый снимок собирается целиком и подменяет старый одной операцией присваивания.
+    """
+    global _index, _checked_at, _stale
+    now = time.monotonic()
+    idx = _index
+    if not force and _fresh() is not None:
+        return idx
+
+    with _lock:
+        if _index is not idx:  # пока ждали блокировку, другой поток уже пересобрал
+            return _index
+        rebuild = idx is None or force or _stale
+        try:
+            with get_db_connection(readonly=True) as con:
+                fp = _fingerprint(con)
+                if rebuild or fp != idx.fingerprint:
+                    idx = ScheduleIndex(_load_blocks(con), fp)
+                    log.info("[SCHEDULE] index rebuilt: %d blocks, cohorts=%s", len(idx), idx.cohorts())
+        except Exception as e:
+            log.warning("[SCHEDULE] index rebuild failed: %s", e)
+            if idx is None:
+                idx = ScheduleIndex({})
+        _index = idx
+        _checked_at = now
+        _stale = False
+    return idx
+
+
+async def get_index_async() -> ScheduleIndex:
+    """Для хендлеров: свежий снимок сразу, а сверка отпечатка и пересборка — в потоке."""
+    idx = _fresh()
+    if idx is not None:
+        return idx
+    return await asyncio.to_thread(get_index)
+
+
+def _mark_stale(_key=None) -> None:
+    global _stale
+    _stale = True
+
+
+def invalidate() -> None:
+    """Пометить индекс устаревшим: следующий get_index() пересоберёт снимок."""
+    _mark_stale()
+    cache_bus.publish("schedule")
+
+
+cache_bus.subscribe("schedule", _mark_stale)
@@ -0,0 +1,165 @@
+# crm2/services/update_executor.py
+# Назначение: Параллельная обработка апдейтов с сохранением порядка внутри чата.
+#             Апдейты разных чатов обрабатываются одновременно (не больше CRM_UPDATE_WORKERS хендлеров
+#             сразу), апдейты одного чата — строго по очереди в порядке поступления: FSM-сценарии
+#             (BroadcastFSM, регистрация) не видят «обгонов». Тяжёлый хендлер админа (рассылка, импорт
+#             XLSX, bcrypt) занимает один слот и держит только свой чат.
+#             Подключение: dp = OrderedDispatcher() в crm2/bot.py — и polling, и webhook идут через
+#             Dispatcher.feed_update. Метрики очереди: executor.stats() (/metrics в FastAPI).
+# Классы:
+# - UpdateExecutor - Очереди по чатам + общий лимит одновременно работающих хендлеров, метрики
+# - OrderedDispatcher - Dispatcher, пропускающий каждый апдейт через UpdateExecutor
+# Функции:
+# - _env_int - Чтение целого из переменной окружения
+# - chat_key - Ключ очереди апдейта (id чата, иначе id пользователя)
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, ""))
+    except ValueError:
+        return default
+
+
+# Сколько хендлеров выполняется одновременно (по всем чатам)
+WORKERS = _env_int("CRM_UPDATE_WORKERS", 64)
+# С какой длины очереди одного чата писать предупреждение в лог
+WARN_DEPTH = _env_int("CRM_UPDATE_WARN_DEPTH", 20)
+
+
+def chat_key(update: Update) -> Optional[int]:
+    """Чат апдейта (для callback — чат сообщения с кнопкой), иначе пользователь; None — без очереди."""
+    try:
+        event = update.event
+    except Exception:  # неизвестный тип апдейта
+        return None
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None) or getattr(event, "user", None)
+    return user.id if user is not None else None
+
+
+class UpdateExecutor:
+    """
+    run(key, call): call() стартует после завершения всех ранее поставленных вызовов с тем же key
+    и при свободном слоте из workers. Порядок внутри key — порядок вызовов run().
+    """
+
+    def __init__(self, workers: int = WORKERS):
+        self.workers = max(1, workers)
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tails: Dict[int, asyncio.Future] = {}  # последний поставленный вызов чата
+        self._depth: Dict[int, int] = {}  # ждут + выполняются, по чатам
+        self.running = 0
+        self.waiting_slot = 0
+        self.peak_depth = 0
+        self.processed = 0
+        self.failed = 0
+        self._wait_total = 0.0
+
+    def _slot(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:  # семафор привязан к циклу событий
+            self._slots = asyncio.Semaphore(self.workers)
+            self._loop = loop
+        return self._slots
+
+    async def _execute(self, call: Callable[[], Awaitable[T]], queued_at: float) -> T:
+        self.waiting_slot += 1
+        try:
+            await self._slot().acquire()
+        finally:
+            self.waiting_slot -= 1
+        self._wait_total += time.monotonic() - queued_at
+        self.running += 1
+        try:
+            return await call()
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            self.processed += 1
+            self._slots.release()
+
+    async def run(self, key: Optional[int], call: Callable[[], Awaitable[T]]) -> T:
+        queued_at = time.monotonic()
+        if key is None:
+            return await self._execute(call, queued_at)
+
+        prev = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        depth = self._depth.get(key, 0) + 1
+        self._depth[key] = depth
+        self.peak_depth = max(self.peak_depth, depth)
+        if depth == WARN_DEPTH:
+            log.warning("[UPD] chat %s: %s updates queued", key, depth)
+        try:
+            if prev is not None:
+                await asyncio.shield(prev)
+            return await self._execute(call, queued_at)
+        finally:
+            self._depth[key] -= 1
+            if not self._depth[key]:
+                del self._depth[key]
+            if self._tails.get(key) is done:
+                del self._tails[key]
+            # следующий апдейт чата стартует только после предыдущего, даже если этот ожидающий отменён
+            if prev is not None and not prev.done():
+                prev.add_done_callback(lambda _f: done.done() or done.set_result(None))
+            else:
+                done.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очередей и счётчики: running/waiting_slot сейчас, queued — всего ждут своей очереди."""
+        in_chats = sum(self._depth.values())
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "waiting_slot": self.waiting_slot,
+            "queued": max(0, in_chats - self.running - self.waiting_slot),
+            "chats": len(self._depth),
+            "max_chat_depth": max(self._depth.values(), default=0),
+            "peak_chat_depth": self.peak_depth,
+            "processed": self.processed,
+            "failed": self.failed,
+            "avg_wait_ms": round(self._wait_total / self.processed * 1000, 1) if self.processed else 0.0,
+        }
+
+
+# Один на процесс: лимит воркеров общий для polling/webhook
+executor = UpdateExecutor()
+
+
+class OrderedDispatcher(Dispatcher):
+    """
+    feed_update через executor. Polling (handle_as_tasks) и webhook создают задачу на апдейт в порядке
+    поступления; ключ чата ставится в очередь синхронно, до первого await, — порядок сохраняется.
+    """
+
+    def __init__(self, *args: Any, executor: UpdateExecutor = executor, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.executor = executor
+
+    async def feed_update(self, bot: Bot, update: Update, **kwargs: Any) -> Any:
+        return await self.executor.run(
+            chat_key(update),
+            lambda: super(OrderedDispatcher, self).feed_update(bot, update, **kwargs),
+        )
@@ -3,14 +3,19 @@ from __future__ import annotations
 import asyncio
 import logging
 import os
-import sqlite3
-from typing import Any, Optional
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from crm2.db.pool import get_pool
+from crm2.services import cache_bus
 
 # crm2/services/users.py
 # Назначение: Сервис для работы с пользователями - CRUD операции и управление профилями
 # Функции:
 # - _resolve_db_path - Определение пути к БД через переменные окружения
-# - _connect - Создание подключения к БД с настройками
+# - _connect - Соединение с БД из общего пула
 # - get_user_by_telegram - Получение пользователя по Telegram ID
 # - get_user_cohort_id_by_tg - Получение ID потока пользователя
 # - set_plain_user_field_by_tg - Безопасное обновление полей пользователя
@@ -24,8 +29,10 @@ from typing import Any, Optional
 # Назначение: Сервис для работы с пользователями - CRUD операции и управление профилями
 # Функции:
 # - _resolve_db_path - Определение пути к БД через переменные окружения
-# - _connect - Создание подключения к БД с настройками
-# - get_user_by_telegram - Получение пользователя по Telegram ID
+# - _connect - Соединение с БД из общего пула
+# - invalidate_user - Сброс записи пользователя в кэше (вызывают все writer-функции; в кластере — во всех процессах)
+# - user_cache_stats - Счётчики кэша пользователей (hits/misses/evictions/expired, hit_rate)
+# - get_user_by_telegram - Получение пользователя по Telegram ID (через TTL/LRU-кэш)
 # - get_user_cohort_id_by_tg - Получение ID потока пользователя
 # - set_plain_user_field_by_tg - Безопасное обновление полей пользователя
 # - upsert_participant_by_tg_sync - Синхронное обновление привязки к потоку
@@ -60,6 +67,7 @@ async def update_user_password(telegram_id: int, new_hashed_password: str) -> bo
 
         loop = asyncio.get_event_loop()
         result = await loop.run_in_executor(None, sync_update)
+        invalidate_user(telegram_id)
         return result
     except Exception as e:
         logging.error(f"Error updating password for user {telegram_id}: {e}")
@@ -80,6 +88,7 @@ async def update_user_password(telegram_id: int, new_hashed_password: str) -> No
 
     loop = asyncio.get_event_loop()
     await loop.run_in_executor(None, sync_update)
+    invalidate_user(telegram_id)
 
 
 # ───────────────────────── DB path resolver ─────────────────────────
@@ -105,28 +114,115 @@ def _resolve_db_path() -> str:
 DB_PATH = _resolve_db_path()
 
 
-def _connect() -> sqlite3.Connection:
-    """Создание подключения к БД"""
-    # Создаем директорию если не существует
-    db_dir = os.path.dirname(DB_PATH)
-    if db_dir and not os.path.exists(db_dir):
-        os.makedirs(db_dir, exist_ok=True)
+def _connect(*, readonly: bool = False):
+    """Соединение из общего пула (readonly=True — читатель, иначе писатель)"""
+    return get_pool(DB_PATH).acquire(readonly=readonly)
+
+
+# ───────────────────────── Кэш пользователей ─────────────────────────
+def _env_num(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, ""))
+    except ValueError:
+        return default
+
+
+USER_CACHE_SIZE = int(_env_num("CRM_USER_CACHE_SIZE", 2048))
+USER_CACHE_TTL_S = _env_num("CRM_USER_CACHE_TTL_S", 300.0)
+
+
+class _UserCache:
+    """
+    LRU-кэш записей users по telegram_id с TTL.
+    Запись сбрасывается явно каждым writer-ом (invalidate_user); TTL — страховка
+    от записей в users мимо этого модуля. Отсутствующие пользователи не кэшируются.
+    Поколение (_gen) защищает от гонки «чтение из БД → инвалидация → запись в кэш устаревшего значения».
+    """
 
-    con = sqlite3.connect(DB_PATH)
-    con.row_factory = sqlite3.Row
-    # немного ускорим запись при наших объёмах
-    con.execute("PRAGMA journal_mode=WAL;")
-    return con
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = max(0, maxsize)
+        self.ttl = ttl
+        self._data: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._gen = 0
+        self.hits = self.misses = self.evictions = self.expired = 0
+
+    def get(self, key: int) -> Tuple[Optional[Dict[str, Any]], int]:
+        """(копия записи или None, поколение для последующего put)."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                if item[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return dict(item[1]), self._gen
+                del self._data[key]
+                self.expired += 1
+            self.misses += 1
+            return None, self._gen
+
+    def put(self, key: int, value: Dict[str, Any], gen: int) -> None:
+        if not self.maxsize:
+            return
+        with self._lock:
+            if gen != self._gen:  # пока читали, запись инвалидировали — не кэшируем
+                return
+            self._data[key] = (time.monotonic() + self.ttl, dict(value))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Optional[int] = None) -> None:
+        with self._lock:
+            self._gen += 1
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_USER_CACHE = _UserCache(USER_CACHE_SIZE, USER_CACHE_TTL_S)
+cache_bus.subscribe("users", _USER_CACHE.invalidate)
+
+
+def invalidate_user(telegram_id: Optional[int] = None) -> None:
+    """Сбросить запись пользователя в кэше (None — весь кэш). Вызывать после любой записи в users."""
+    key = int(telegram_id) if telegram_id is not None else None
+    _USER_CACHE.invalidate(key)
+    cache_bus.publish("users", key)
+
+
+def user_cache_stats() -> Dict[str, Any]:
+    return _USER_CACHE.stats()
 
 
 # ───────────────────────── Публичные функции ─────────────────────────
 async def get_user_by_telegram(telegram_id: int) -> dict | None:
     """
-    Получаем пользователя по Telegram ID (асинхронная версия)
+    Получаем пользователя по Telegram ID (асинхронная версия).
+    Попадание в кэш — без обращения к БД и без перехода в пул потоков.
     """
+    cached, gen = _USER_CACHE.get(int(telegram_id))
+    if cached is not None:
+        return cached
     try:
         def sync_get_user():
-            with _connect() as conn:
+            with _connect(readonly=True) as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     "SELECT id, telegram_id, nickname, full_name, role, phone, email, cohort_id, password, created_at FROM users WHERE telegram_id = ?",
@@ -138,6 +234,8 @@ async def get_user_by_telegram(telegram_id: int) -> dict | None:
         # Запускаем синхронную операцию в отдельном потоке
         loop = asyncio.get_event_loop()
         user = await loop.run_in_executor(None, sync_get_user)
+        if user is not None:
+            _USER_CACHE.put(int(telegram_id), user, gen)
         return user
     except Exception as e:
         logging.error(f"Error getting user by telegram {telegram_id}: {e}")
@@ -178,6 +276,7 @@ async def set_user_cohort(telegram_id: int, cohort_id: int) -> bool:
 
         loop = asyncio.get_event_loop()
         result = await loop.run_in_executor(None, sync_set_cohort)
+        invalidate_user(telegram_id)
         return result
     except Exception as e:
         logging.error(f"Error setting cohort for user {telegram_id}: {e}")
@@ -190,7 +289,7 @@ async def get_cohorts() -> list[dict]:
     """
     try:
         def sync_get_cohorts():
-            with _connect() as conn:
+            with _connect(readonly=True) as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT id, name FROM cohorts ORDER BY id")
                 rows = cursor.fetchall()
@@ -227,6 +326,7 @@ def set_plain_user_field_by_tg(tg_id: int, field: str, value: Any) -> None:
     with _connect() as con:
         con.execute(f"UPDATE users SET {field} = ? WHERE telegram_id = ?", (value, int(tg_id)))
         con.commit()
+    invalidate_user(tg_id)
 
 
 def upsert_participant_by_tg_sync(tg_id: int, cohort_id: Optional[int]) -> None:
@@ -235,27 +335,31 @@ def upsert_participant_by_tg_sync(tg_id: int, cohort_id: Optional[int]) -> None:
     - Если cohort_id is None — удаляем запись участника (сброс потока).
     - Иначе — INSERT ... ON CONFLICT(user_id) DO UPDATE.
     """
-    with _connect() as con:
-        cur = con.execute("SELECT id FROM users WHERE telegram_id = ? LIMIT 1", (int(tg_id),))
-        row = cur.fetchone()
-        if not row:
-            return
-        user_id = int(row["id"])
-
-        if cohort_id is None:
-            con.execute("DELETE FROM participants WHERE user_id = ?", (user_id,))
+    try:
+        with _connect() as con:
+            cur = con.execute("SELECT id FROM users WHERE telegram_id = ? LIMIT 1", (int(tg_id),))
+            row = cur.fetchone()
+            if not row:
+                return
+            user_id = int(row["id"])
+
+            if cohort_id is None:
+                con.execute("DELETE FROM participants WHERE user_id = ?", (user_id,))
+                con.commit()
+                return
+
+            con.execute(
+                """
+                INSERT INTO participants (user_id, cohort_id)
+                VALUES (?, ?) ON CONFLICT(user_id) DO
+                UPDATE SET cohort_id = excluded.cohort_id
+                """,
+                (user_id, int(cohort_id)),
+            )
             con.commit()
-            return
-
-        con.execute(
-            """
-            INSERT INTO participants (user_id, cohort_id)
-            VALUES (?, ?) ON CONFLICT(user_id) DO
-            UPDATE SET cohort_id = excluded.cohort_id
-            """,
-            (user_id, int(cohort_id)),
-        )
-        con.commit()
+    finally:
+        # привязка к потоку — часть профиля пользователя
+        invalidate_user(tg_id)
 
 
 # Неблокирующая «обёртка» — если кто-то вызывает через await
@@ -287,13 +391,17 @@ async def get_user_cohort_id_by_tg(telegram_id: int) -> int | None:
 async def execute_query(query: str, params: tuple = ()) -> list:
     """Выполняет SQL запрос и возвращает результат"""
     try:
+        is_select = query.strip().upper().startswith('SELECT')
+
         def sync_execute():
-            with _connect() as conn:
+            with _connect(readonly=is_select) as conn:
                 cursor = conn.cursor()
                 cursor.execute(query, params)
-                if query.strip().upper().startswith('SELECT'):
+                if is_select:
                     return [dict(row) for row in cursor.fetchall()]
                 conn.commit()
+                # произвольная запись: какие telegram_id затронуты, не знаем — сбрасываем весь кэш
+                invalidate_user()
                 return []
 
         loop = asyncio.get_event_loop()
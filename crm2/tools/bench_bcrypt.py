@@ -0,0 +1,58 @@
+# === Файл: crm2/tools/bench_bcrypt.py
+# Аннотация: подбор cost factor bcrypt под целевую задержку на текущем хосте.
+#            Замеряет checkpw для rounds в диапазоне и печатает наибольший rounds,
+#            укладывающийся в --target-ms (медиана), — значение для CRM_BCRYPT_ROUNDS.
+#            Пример: python -m crm2.tools.bench_bcrypt --target-ms 250
+# Классы: —
+# Функции: measure, pick_rounds, main
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+from typing import Dict
+
+import bcrypt
+
+
+def measure(rounds: int, samples: int) -> float:
+    """Медиана времени одной проверки пароля (мс) для данного cost factor."""
+    pw = b"benchmark-password"
+    hashed = bcrypt.hashpw(pw, bcrypt.gensalt(rounds=rounds))
+    times = []
+    for _ in range(samples):
+        t0 = time.perf_counter()
+        bcrypt.checkpw(pw, hashed)
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+def pick_rounds(target_ms: float, *, min_rounds: int = 10, max_rounds: int = 15, samples: int = 3) -> Dict[int, float]:
+    """Замеры по возрастанию rounds; останавливаемся, как только превысили цель (каждый шаг ×2)."""
+    results: Dict[int, float] = {}
+    for r in range(min_rounds, max_rounds + 1):
+        results[r] = measure(r, samples)
+        if results[r] > target_ms:
+            break
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Подбор CRM_BCRYPT_ROUNDS под целевую задержку")
+    ap.add_argument("--target-ms", type=float, default=250.0, help="допустимая задержка одной проверки, мс")
+    ap.add_argument("--min-rounds", type=int, default=10)
+    ap.add_argument("--max-rounds", type=int, default=15)
+    ap.add_argument("--samples", type=int, default=3)
+    args = ap.parse_args()
+
+    results = pick_rounds(args.target_ms, min_rounds=args.min_rounds,
+                          max_rounds=args.max_rounds, samples=args.samples)
+    for r, ms in results.items():
+        print(f"rounds={r:2d}  {ms:8.1f} ms")
+    fitting = [r for r, ms in results.items() if ms <= args.target_ms]
+    best = max(fitting) if fitting else args.min_rounds
+    print(f"\nCRM_BCRYPT_ROUNDS={best}  (target {args.target_ms:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# === Файл: crm2/tools/fake_telegram.py
+# Аннотация: локальный «фейковый Telegram» для сквозной проверки режима webhook без сети.
+#            Поднимает сервер Bot API (getMe/setWebhook/sendMessage/...), запоминает вызовы бота,
+#            присылает апдейт на зарегистрированный webhook с секретом (как Telegram) и ждёт ответа бота.
+#            Проверки: чужой секрет → 403; апдейт принят с 200 сразу; бот ответил в чат (задержка).
+#            Пример (бот уже запущен с BOT_MODE=webhook и TELEGRAM_API_BASE=http://127.0.0.1:8081):
+#              python -m crm2.tools.fake_telegram --port 8081 --text /start
+#            Всё в одном процессе (нужен uvicorn): python -m crm2.tools.fake_telegram --serve
+#            Кластер (фронт + 4 обработчика + писатель БД): python -m crm2.tools.fake_telegram --serve --cluster 4
+# Классы: FakeTelegram
+# Функции: message_update, deliver, run_checks, _serve_bot, main
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import ClientSession, web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "crm2-test", "username": "crm2_test_bot"}
+
+
+class FakeTelegram:
+    """Сервер Bot API: отвечает на запросы бота и записывает их (method, params) в calls."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081):
+        self.host, self.port = host, port
+        self.calls: List[Tuple[str, Dict[str, Any]]] = []
+        self.webhook: Dict[str, Any] = {}
+        self._message_ids = itertools.count(1000)
+        self._changed = asyncio.Condition()
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> "FakeTelegram":
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        return self
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params.get("chat_id") or 0)
+        return {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "from": BOT_USER,
+            "text": params.get("text") or "",
+        }
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        # aiogram шлёт параметры формой; вложенные объекты (reply_markup и т.п.) — строкой JSON
+        params: Dict[str, Any] = dict(await request.post())
+        if method == "getMe":
+            result: Any = BOT_USER
+        elif method == "setWebhook":
+            self.webhook = params
+            result = True
+        elif method == "deleteWebhook":
+            self.webhook = {}
+            result = True
+        elif method == "getUpdates":
+            result = []
+        elif method in ("sendMessage", "sendPhoto", "sendDocument", "copyMessage", "editMessageText"):
+            result = self._message(params)
+            if method == "copyMessage":
+                result = {"message_id": result["message_id"]}
+        else:
+            result = True
+        async with self._changed:
+            self.calls.append((method, params))
+            self._changed.notify_all()
+        return web.json_response({"ok": True, "result": result})
+
+    async def wait_for(self, method: str, *, chat_id: Optional[int] = None, since: int = 0,
+                       timeout: float = 10.0) -> Optional[Dict[str, Any]]:
+        """Первый вызов method (в чат chat_id) после индекса since; None — не дождались."""
+
+        def _find() -> Optional[Dict[str, Any]]:
+            for name, params in self.calls[since:]:
+                if name == method and (chat_id is None or str(params.get("chat_id")) == str(chat_id)):
+                    return params
+            return None
+
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait_for(lambda: _find() is not None), timeout)
+            except asyncio.TimeoutError:
+                return None
+            return _find()
+
+
+def message_update(update_id: int, chat_id: int, text: str) -> Dict[str, Any]:
+    user = {"id": chat_id, "is_bot": False, "first_name": "Test", "username": f"user{chat_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "Test"},
+            "from": user,
+            "text": text,
+        },
+    }
+
+
+async def deliver(url: str, update: Dict[str, Any], secret: Optional[str]) -> Tuple[int, float]:
+    """Отправить апдейт на webhook так же, как Telegram. Возвращает (HTTP-статус, время ответа, с)."""
+    headers = {"Content-Type": "application/json"}
+    if secret is not None:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+    async with ClientSession() as s:
+        t0 = time.perf_counter()
+        async with s.post(url, data=json.dumps(update), headers=headers) as r:
+            await r.read()
+            return r.status, time.perf_counter() - t0
+
+
+async def run_checks(tg: FakeTelegram, *, chat_id: int, text: str, timeout: float) -> bool:
+    if not tg.webhook.get("url"):
+        print(f"Ждём setWebhook от бота (TELEGRAM_API_BASE={tg.base}) ...")
+        if await tg.wait_for("setWebhook", timeout=timeout) is None:
+            print("FAIL: бот не вызвал setWebhook")
+            return False
+    url, secret = tg.webhook["url"], tg.webhook.get("secret_token")
+    print(f"webhook: {url} (allowed_updates={tg.webhook.get('allowed_updates')})")
+    ok = True
+
+    status, _ = await deliver(url, message_update(1, chat_id, text), "wrong-secret")
+    print(f"{'ok  ' if status == 403 else 'FAIL'}: чужой секрет → {status} (ожидается 403)")
+    ok &= status == 403
+
+    since = len(tg.calls)
+    t0 = time.perf_counter()
+    status, took = await deliver(url, message_update(2, chat_id, text), secret)
+    print(f"{'ok  ' if status == 200 else 'FAIL'}: апдейт {text!r} → {status} за {took * 1000:.1f} мс")
+    ok &= status == 200
+
+    reply = await tg.wait_for("sendMessage", chat_id=chat_id, since=since, timeout=timeout)
+    if reply is None:
+        print(f"FAIL: бот не ответил в чат {chat_id} за {timeout:.0f} с")
+        return False
+    print(f"ok  : ответ бота через {(time.perf_counter() - t0) * 1000:.1f} мс: {reply.get('text', '')[:80]!r}")
+    return ok
+
+
+async def _serve_bot(tg: FakeTelegram, port: int, cluster: int = 0):
+    """Поднять crm2.app под uvicorn в этом же процессе, направив бота на фейковый Telegram."""
+    import uvicorn
+
+    os.environ.update({
+        "BOT_MODE": "cluster" if cluster else "webhook",
+        "TELEGRAM_API_BASE": tg.base,
+        "WEBHOOK_URL": f"http://127.0.0.1:{port}",
+    })
+    os.environ.setdefault("TELEGRAM_TOKEN", "1:fake-telegram-token")
+    from crm2.app import app
+
+    if cluster:
+        from crm2.cluster import start_cluster
+        await asyncio.to_thread(start_cluster, cluster)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    return server, asyncio.create_task(server.serve())
+
+
+async def _amain(args) -> bool:
+    tg = await FakeTelegram(args.host, args.port).start()
+    print(f"Фейковый Bot API: {tg.base}")
+    server = task = None
+    try:
+        if args.serve:
+            server, task = await _serve_bot(tg, args.bot_port, args.cluster)
+        return await run_checks(tg, chat_id=args.chat_id, text=args.text, timeout=args.timeout)
+    finally:
+        if server is not None:
+            server.should_exit = True
+            await task
+        if args.cluster:
+            from crm2.cluster import stop_cluster
+            await asyncio.to_thread(stop_cluster)
+        await tg.stop()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Сквозная проверка webhook-режима через фейковый Telegram")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081, help="порт фейкового Bot API")
+    ap.add_argument("--chat-id", type=int, default=777000001)
+    ap.add_argument("--text", default="/start")
+    ap.add_argument("--timeout", type=float, default=15.0)
+    ap.add_argument("--serve", action="store_true", help="запустить бота (uvicorn) в этом же процессе")
+    ap.add_argument("--bot-port", type=int, default=8088, help="порт бота при --serve")
+    ap.add_argument("--cluster", type=int, default=0, metavar="N",
+                    help="при --serve: режим cluster с N процессами-обработчиками")
+    args = ap.parse_args()
+    sys.exit(0 if asyncio.run(_amain(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# === Файл: crm2/tools/startup_bench.py
+# Аннотация: замер холодного старта бота (как после деплоя/рестарта на Render) без сети.
+#            Каждый прогон — новый процесс python -X importtime: импорт crm2.app, проверка схемы
+#            (ensure_all_schemas), подключение роутеров (_setup_dispatcher). Печатает медиану по фазам
+#            и самые тяжёлые пакеты по времени импорта; --budget — код выхода 1, если медиана старта больше.
+#            Пример: python -m crm2.tools.startup_bench --runs 5 --top 10 --budget 1.0
+# Классы: —
+# Функции: _phases_script, _parse_importtime, run_once, main
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, Tuple
+
+PHASES = ("import", "schema", "routers", "total")
+
+
+def _phases_script() -> str:
+    """Код, выполняемый в дочернем процессе: фазы старта в том порядке, в каком их проходит python -m crm2."""
+    return (
+        "import json, time\n"
+        "t0 = time.perf_counter()\n"
+        "import crm2.app as a\n"
+        "t1 = time.perf_counter()\n"
+        "from crm2.db.auto_migrate import ensure_all_schemas\n"
+        "ensure_all_schemas()\n"
+        "t2 = time.perf_counter()\n"
+        "a._setup_dispatcher()\n"
+        "t3 = time.perf_counter()\n"
+        "print('STARTUP_BENCH ' + json.dumps({'import': t1 - t0, 'schema': t2 - t1, "
+        "'routers': t3 - t2, 'total': t3 - t0}))\n"
+    )
+
+
+def _parse_importtime(stderr: str) -> Dict[str, float]:
+    """Собственное время импорта (с) по пакетам верхнего уровня из вывода -X importtime."""
+    totals: Dict[str, float] = defaultdict(float)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, _cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+            totals[name.split(".")[0]] += int(self_us) / 1e6
+        except ValueError:
+            continue
+    return dict(totals)
+
+
+def run_once(env: Dict[str, str]) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """Один холодный старт: (фазы, время импорта по пакетам)."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _phases_script()],
+        env=env, capture_output=True, text=True, check=False,
+    )
+    for line in proc.stdout.splitlines():
+        if line.startswith("STARTUP_BENCH "):
+            return json.loads(line[len("STARTUP_BENCH "):]), _parse_importtime(proc.stderr)
+    tail = "\n".join(proc.stderr.splitlines()[-20:])
+    raise RuntimeError(f"прогон завершился с кодом {proc.returncode}:\n{tail}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Замер холодного старта crm2 (-X importtime + фазы старта)")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=10, help="сколько самых тяжёлых пакетов показать")
+    ap.add_argument("--budget", type=float, default=0.0, metavar="SEC",
+                    help="допустимая медиана полного старта; 0 — не проверять")
+    args = ap.parse_args()
+
+    env = dict(os.environ)
+    # токен нужен только для создания Bot — сеть при замере не используется
+    env.setdefault("TELEGRAM_TOKEN", "1:startup-bench-token")
+    env.setdefault("BOT_MODE", "polling")
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (os.getcwd(), env.get("PYTHONPATH")) if p)
+
+    phases: Dict[str, list] = {p: [] for p in PHASES}
+    packages: Dict[str, list] = defaultdict(list)
+    for i in range(max(1, args.runs)):
+        run, imports = run_once(env)
+        for p in PHASES:
+            phases[p].append(run[p])
+        for name, sec in imports.items():
+            packages[name].append(sec)
+        print(f"прогон {i + 1}: " + ", ".join(f"{p} {run[p] * 1000:.0f} мс" for p in PHASES))
+
+    median = {p: statistics.median(v) for p, v in phases.items()}
+    print("медиана: " + ", ".join(f"{p} {median[p] * 1000:.0f} мс" for p in PHASES))
+    heavy = sorted(((statistics.median(v), name) for name, v in packages.items()), reverse=True)[:args.top]
+    print("тяжёлые импорты (собственное время, медиана):")
+    for sec, name in heavy:
+        print(f"  {sec * 1000:8.1f} мс  {name}")
+
+    if args.budget and median["total"] > args.budget:
+        print(f"FAIL: старт {median['total']:.2f} с больше бюджета {args.budget:.2f} с")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
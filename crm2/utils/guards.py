@@ -18,10 +18,12 @@ router.callback_query.filter(AdminOnly())
 
 from aiogram.filters import Filter
 from aiogram.types import Message, CallbackQuery
-from typing import Union
+from typing import Any, Dict, Optional, Union
 
 from crm2.db.core import get_db_connection
 
+_MISSING: Any = object()
+
 
 class AdminOnly(Filter):
     """
@@ -29,7 +31,11 @@ class AdminOnly(Filter):
     Разрешает доступ только пользователям с ролью 'admin'
     """
 
-    async def __call__(self, update: Union[Message, CallbackQuery]) -> bool:
+    async def __call__(
+            self,
+            update: Union[Message, CallbackQuery],
+            user: Optional[Dict[str, Any]] = _MISSING,
+    ) -> bool:
         if isinstance(update, Message):
             user_id = update.from_user.id
         elif isinstance(update, CallbackQuery):
@@ -37,11 +43,15 @@ class AdminOnly(Filter):
         else:
             return False
 
-        # Используем синхронное подключение к БД
-        with get_db_connection() as conn:
-            user = conn.execute(
+        # Пользователь из контекста апдейта (UserContextMiddleware) — без запроса к БД
+        if user is not _MISSING:
+            return bool(user) and user.get('role') == 'admin'
+
+        # Фолбэк, если middleware контекста не подключён
+        with get_db_connection(readonly=True) as conn:
+            row = conn.execute(
                 "SELECT role FROM users WHERE telegram_id = ?",
                 (user_id,)
             ).fetchone()
 
-        return user and user['role'] == 'admin'
+        return bool(row) and row['role'] == 'admin'
@@ -0,0 +1,146 @@
+# crm2/utils/password_pool.py
+# Назначение: bcrypt вне event loop: хеширование и проверка паролей в отдельном пуле процессов
+#             с ограничением параллелизма, плюс ограничитель попыток входа по telegram_id.
+#             Один вход с bcrypt (~250 мс CPU) больше не замораживает обработку остальных апдейтов,
+#             а поток неверных паролей от одного пользователя не занимает весь пул.
+# Классы:
+# - AttemptLimiter - Скользящее окно попыток входа на ключ (telegram_id / nickname)
+# Функции:
+# - _env_int - Чтение целого числа из переменной окружения
+# - _executor - Ленивое создание пула процессов
+# - _run - Выполнение функции в пуле с ограничением параллелизма
+# - hash_password_async - Асинхронное хеширование пароля (bcrypt в пуле)
+# - hash_passwords_async - Асинхронное хеширование порции паролей одним вызовом пула
+# - verify_and_upgrade_password_async - Асинхронная проверка пароля с апгрейдом plain text → bcrypt
+# - shutdown_pool - Остановка пула процессов (при остановке бота)
+from __future__ import annotations
+
+import asyncio
+import hmac
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Deque, Dict, List, Optional, Tuple
+
+from crm2.utils.password_utils import hash_password, hash_passwords, is_bcrypt_hash, normalize_string, verify_password
+
+log = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, ""))
+    except ValueError:
+        return default
+
+
+# Процессов в пуле bcrypt и сколько операций одновременно допускаем в работу
+BCRYPT_WORKERS = max(1, _env_int("CRM_BCRYPT_WORKERS", min(2, os.cpu_count() or 1)))
+BCRYPT_CONCURRENCY = max(1, _env_int("CRM_BCRYPT_CONCURRENCY", BCRYPT_WORKERS))
+# Попыток входа на telegram_id за окно (сек); успешный вход сбрасывает счётчик
+LOGIN_ATTEMPTS = max(1, _env_int("CRM_LOGIN_ATTEMPTS", 5))
+LOGIN_WINDOW_S = max(1, _env_int("CRM_LOGIN_WINDOW_S", 300))
+
+
+class AttemptLimiter:
+    """
+    Не более `limit` попыток за `window` секунд на ключ.
+    Попытка учитывается до проверки пароля — сама проверка и есть дорогой ресурс.
+    """
+
+    def __init__(self, limit: int = LOGIN_ATTEMPTS, window: float = LOGIN_WINDOW_S):
+        self.limit = limit
+        self.window = window
+        self._hits: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def acquire(self, key) -> float:
+        """0 — попытка разрешена (и учтена); иначе — через сколько секунд можно повторить."""
+        now = time.monotonic()
+        key = str(key)
+        with self._lock:
+            q = self._hits.setdefault(key, deque())
+            while q and now - q[0] >= self.window:
+                q.popleft()
+            if len(q) >= self.limit:
+                self.rejected += 1
+                return max(0.0, self.window - (now - q[0]))
+            q.append(now)
+            if len(self._hits) > 10_000:  # не даём словарю расти от одноразовых ключей
+                for k in [k for k, v in self._hits.items() if not v or now - v[-1] >= self.window]:
+                    del self._hits[k]
+            return 0.0
+
+    def reset(self, key) -> None:
+        with self._lock:
+            self._hits.pop(str(key), None)
+
+
+# Общий ограничитель попыток входа (handlers/auth, handlers/guest_menu)
+login_attempts = AttemptLimiter()
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_sem: Optional[asyncio.Semaphore] = None
+_sem_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: дочерние процессы не наследуют потоки/соединения SQLite родителя
+                _pool = ProcessPoolExecutor(
+                    max_workers=BCRYPT_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                log.info("[AUTH] bcrypt process pool: %d worker(s), concurrency %d",
+                         BCRYPT_WORKERS, BCRYPT_CONCURRENCY)
+    return _pool
+
+
+async def _run(fn, *args):
+    global _sem, _sem_loop
+    loop = asyncio.get_running_loop()
+    if _sem is None or _sem_loop is not loop:
+        _sem, _sem_loop = asyncio.Semaphore(BCRYPT_CONCURRENCY), loop
+    async with _sem:
+        return await loop.run_in_executor(_executor(), fn, *args)
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run(hash_password, password)
+
+
+async def hash_passwords_async(passwords: List[str]) -> List[str]:
+    """Порция паролей одним вызовом пула (фоновая миграция: мелкие порции не задерживают логины)."""
+    return await _run(hash_passwords, list(passwords))
+
+
+async def verify_and_upgrade_password_async(plain_password: str, stored_password: str) -> Tuple[bool, str]:
+    """
+    То же, что password_utils.verify_and_upgrade_password, но bcrypt — в пуле процессов.
+    Сравнение с plain text (дешёвое) выполняется на месте; в пул уходит только bcrypt.
+    """
+    stored_password = str(stored_password or "")
+    if is_bcrypt_hash(stored_password):
+        return await _run(verify_password, plain_password, stored_password), stored_password
+
+    plain = normalize_string(plain_password)
+    if not hmac.compare_digest(normalize_string(stored_password).encode(), plain.encode()):
+        return False, stored_password
+    return True, await hash_password_async(plain)
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
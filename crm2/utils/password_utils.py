@@ -5,18 +5,22 @@
 # - normalize_string - Нормализация строк (удаление невидимых символов, пробелов)
 # - is_bcrypt_hash - Проверка является ли строка bcrypt-хешем
 # - hash_password - Хеширование пароля с использованием bcrypt
+# - hash_passwords - Пакетное хеширование списка паролей
 # - verify_password - Проверка пароля с поддержкой bcrypt и plain text (для миграции)
 # - needs_rehash - Проверка необходимости перехеширования пароля
 # - verify_and_upgrade_password - Комплексная проверка и автоматическое обновление хеша
 from __future__ import annotations
 
 import hmac
+import os
 import re
 
 import bcrypt
 
 # Bcrypt хеш всегда имеет длину 60 символов
 BCRYPT_HASH_LENGTH = 60
+# Cost factor bcrypt (подбирается под железо: python -m crm2.tools.bench_bcrypt)
+BCRYPT_ROUNDS = int(os.getenv("CRM_BCRYPT_ROUNDS", "12"))
 
 def normalize_string(s: str) -> str:
     """Убираем неразрывные/невидимые пробелы и обрезаем края."""
@@ -37,10 +41,14 @@ def is_bcrypt_hash(s: str) -> bool:
 
 def hash_password(password: str) -> str:
     password = normalize_string(password)
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed.decode('utf-8')
 
+def hash_passwords(passwords: list[str]) -> list[str]:
+    """Пакетное хеширование (одна передача данных в процесс пула на порцию)."""
+    return [hash_password(p) for p in passwords]
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     plain_password = normalize_string(plain_password)
     hashed_password = str(hashed_password or "")